@@ -0,0 +1,150 @@
+# allocation_planner.py - Demand-driven allocation plan for a manufacturer's distributors
+
+import numpy as np
+
+from stock_shards import live_quantity_sql
+
+DEFAULT_WINDOW_DAYS = 30
+DEFAULT_COVER_DAYS = 21
+DEFAULT_DIST_REORDER_LEVEL = 50
+
+
+def load_planner_inputs(cursor, manufacturer_id, window_days):
+    # Manufacturer stock per product
+    cursor.execute(f"""
+        SELECT i.product_id, {live_quantity_sql('manufacturer', 'i')}, COALESCE(i.reorder_level, 0)
+        FROM inventory i
+        WHERE i.manufacturer_id = %s
+        ORDER BY i.product_id
+    """, (manufacturer_id,))
+    mfg_rows = cursor.fetchall()
+
+    # Current distributor stock for this manufacturer's products
+    cursor.execute(f"""
+        SELECT di.distributor_id, di.product_id, {live_quantity_sql('distributor', 'di')}, di.reorder_level
+        FROM distributor_inventory di
+        JOIN product p ON di.product_id = p.product_id
+        WHERE p.manufacturer_id = %s
+    """, (manufacturer_id,))
+    stock_rows = cursor.fetchall()
+
+    # Units sold by each distributor over the window
+    cursor.execute("""
+        SELECT oi.seller_id, oi.product_id, CAST(SUM(oi.quantity) AS SIGNED)
+        FROM order_item oi
+        JOIN customer_order co ON oi.order_id = co.order_id
+        JOIN product p ON oi.product_id = p.product_id
+        WHERE oi.seller_type = 'distributor'
+          AND p.manufacturer_id = %s
+          AND co.order_date >= NOW() - INTERVAL %s DAY
+          AND co.order_status <> 'cancelled'
+        GROUP BY oi.seller_id, oi.product_id
+    """, (manufacturer_id, window_days))
+    sales_rows = cursor.fetchall()
+
+    return mfg_rows, stock_rows, sales_rows
+
+
+def _pair_keys(distributor_ids, product_ids):
+    return (distributor_ids.astype(np.int64) << 32) | product_ids.astype(np.int64)
+
+
+def compute_plan(mfg_rows, stock_rows, sales_rows, window_days=DEFAULT_WINDOW_DAYS,
+                 cover_days=DEFAULT_COVER_DAYS, keep_reserve=True):
+    if not mfg_rows:
+        return []
+
+    mfg = np.array(mfg_rows, dtype=np.int64).reshape(-1, 3)
+    product_ids, mfg_qty, mfg_reorder = mfg[:, 0], mfg[:, 1], mfg[:, 2]
+    supply = np.maximum(mfg_qty - (mfg_reorder if keep_reserve else 0), 0)
+
+    stock = np.array([(d, p, q, DEFAULT_DIST_REORDER_LEVEL if r is None else r) for d, p, q, r in stock_rows],
+                     dtype=np.int64).reshape(-1, 4)
+    sales = np.array(sales_rows, dtype=np.int64).reshape(-1, 3)
+
+    # Every (distributor, product) pair that holds stock or sold recently
+    stock_keys = _pair_keys(stock[:, 0], stock[:, 1])
+    sales_keys = _pair_keys(sales[:, 0], sales[:, 1])
+    keys = np.union1d(stock_keys, sales_keys)
+    dist_ids = (keys >> 32).astype(np.int64)
+    prod_ids = (keys & 0xFFFFFFFF).astype(np.int64)
+
+    # Only products this manufacturer still tracks in inventory
+    prod_idx = np.searchsorted(product_ids, prod_ids)
+    prod_idx = np.minimum(prod_idx, len(product_ids) - 1)
+    known = product_ids[prod_idx] == prod_ids
+    keys, dist_ids, prod_ids, prod_idx = keys[known], dist_ids[known], prod_ids[known], prod_idx[known]
+    if len(keys) == 0:
+        return []
+
+    on_hand = np.zeros(len(keys), dtype=np.int64)
+    reorder = np.full(len(keys), DEFAULT_DIST_REORDER_LEVEL, dtype=np.int64)
+    pos = np.searchsorted(keys, stock_keys)
+    hit = (pos < len(keys)) & (keys[np.minimum(pos, len(keys) - 1)] == stock_keys)
+    on_hand[pos[hit]] = stock[hit, 2]
+    reorder[pos[hit]] = stock[hit, 3]
+
+    sold = np.zeros(len(keys), dtype=np.int64)
+    pos = np.searchsorted(keys, sales_keys)
+    hit = (pos < len(keys)) & (keys[np.minimum(pos, len(keys) - 1)] == sales_keys)
+    sold[pos[hit]] = sales[hit, 2]
+
+    # Target stock covers expected demand, never below the distributor's reorder level
+    daily_velocity = sold / float(window_days)
+    target = np.maximum(np.ceil(daily_velocity * cover_days).astype(np.int64), reorder)
+    need = np.maximum(target - on_hand, 0)
+
+    # Share scarce manufacturer stock proportionally to need
+    total_need = np.bincount(prod_idx, weights=need, minlength=len(product_ids))
+    ratio = np.divide(supply, total_need, out=np.zeros(len(product_ids)), where=total_need > 0)
+    ratio = np.minimum(ratio, 1.0)
+    raw = need * ratio[prod_idx]
+    proposed = np.floor(raw).astype(np.int64)
+
+    # Hand out the rounding remainder to the largest fractional shares first
+    leftover = np.minimum(supply, total_need.astype(np.int64)) - np.bincount(prod_idx, weights=proposed,
+                                                                             minlength=len(product_ids)).astype(np.int64)
+    order = np.lexsort((-(raw - proposed), prod_idx))
+    sorted_prod = prod_idx[order]
+    group_start = np.searchsorted(sorted_prod, sorted_prod, side='left')
+    rank = np.arange(len(order)) - group_start
+    bump = (rank < leftover[sorted_prod]) & (proposed[order] < need[order])
+    proposed[order[bump]] += 1
+
+    plan = []
+    for i in np.flatnonzero(need > 0):
+        plan.append({
+            'distributor_id': int(dist_ids[i]),
+            'product_id': int(prod_ids[i]),
+            'on_hand': int(on_hand[i]),
+            'reorder_level': int(reorder[i]),
+            'units_sold': int(sold[i]),
+            'daily_velocity': round(float(daily_velocity[i]), 2),
+            'target_stock': int(target[i]),
+            'need': int(need[i]),
+            'proposed_quantity': int(proposed[i]),
+            'manufacturer_available': int(mfg_qty[prod_idx[i]]),
+        })
+    plan.sort(key=lambda row: (-row['proposed_quantity'], row['product_id'], row['distributor_id']))
+    return plan
+
+
+def attach_names(cursor, manufacturer_id, plan):
+    cursor.execute("SELECT distributor_id, company_name FROM distributor")
+    distributors = dict(cursor.fetchall())
+    cursor.execute("SELECT product_id, product_name FROM product WHERE manufacturer_id = %s", (manufacturer_id,))
+    products = dict(cursor.fetchall())
+    for row in plan:
+        row['company_name'] = distributors.get(row['distributor_id'])
+        row['product_name'] = products.get(row['product_id'])
+    return plan
+
+
+def build_plan(conn, manufacturer_id, window_days=DEFAULT_WINDOW_DAYS, cover_days=DEFAULT_COVER_DAYS):
+    cursor = conn.cursor()
+    try:
+        mfg_rows, stock_rows, sales_rows = load_planner_inputs(cursor, manufacturer_id, window_days)
+        plan = compute_plan(mfg_rows, stock_rows, sales_rows, window_days, cover_days)
+        return attach_names(cursor, manufacturer_id, plan)
+    finally:
+        cursor.close()
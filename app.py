@@ -1,12 +1,47 @@
 # app.py - Complete Flask Application with MySQL Connector
 
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, stream_with_context, g
 import mysql.connector
 from mysql.connector import errorcode
 from functools import wraps
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 from decimal import Decimal
+import hmac
+import json
+import os
+
+from allocation_planner import DEFAULT_COVER_DAYS, DEFAULT_WINDOW_DAYS, build_plan
+from audit_log import AuditLogger
+from bulk_allocation import distributor_price, parse_csv_lines, parse_json_lines, run_bulk_allocation
+from bulk_pricing import (apply_prices, parse_price_form, parse_price_lines, parse_pricing_form,
+                          parse_pricing_payload)
+from catalog_snapshot import SnapshotReader
+from db_guard import (CLOSED, CircuitBreaker, DatabaseUnavailable, counts_against_breaker, is_overload, read_timeout,
+                      request_budget, statement_budget)
+from exports import ARROW_AVAILABLE, EXPORTS, FORMATS as EXPORT_FORMATS, export_stream
+from fragment_cache import FragmentCache, FragmentCacheExtension
+from http_cache import ScopeVersions, conditional_get
+from invalidation_bus import (DISTRIBUTORS_CHANGED, MANUFACTURER_STOCK_CHANGED, PRODUCT_ADDED, InvalidationBus,
+                              UnixSocketTransport)
+from inventory_adjustment import parse_csv_lines as parse_adjustment_csv
+from inventory_adjustment import parse_json_lines as parse_adjustment_json
+from inventory_adjustment import run_bulk_adjustment
+from inventory_ledger import movements_between, record_movements, stock_at
+from order_archive import ARCHIVE_SUFFIX, with_archive
+from outbox import (ORDER_CREATED, PAYMENT_RECEIVED, PRODUCT_CREATED, STOCK_ADJUSTED, STOCK_ALLOCATED, OutboxRelay,
+                    stage_event)
+from price_history import DEFAULT_POINTS, MAX_POINTS, MIN_POINTS, cached_series, parse_date, svg_polyline
+from price_recommender import DEFAULT_WINDOW_DAYS as PRICING_WINDOW_DAYS, build_recommendations
+from product_import import ImportNotFound, iter_rows, run_import
+from ref_cache import (get_categories, get_distributors, get_manufacturer_products, invalidate_categories,
+                       invalidate_distributors, invalidate_manufacturer_products, reference_cache)
+from reports import REPORTS, ReportJobRunner, ReportLimitExceeded, purge_expired_reports
+from reports import distributor_analytics as distributor_sales_analytics
+from sales_columns import sales_store
+from search_index import ensure_index, product_search_index
+from stock_shards import live_quantity_sql, lock_slot_totals, set_slot_total, take_stock
+from streaming import RowStream, ndjson_response, stream_page, wants_ndjson
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_change_this_in_production'
@@ -21,10 +56,82 @@ db_config = {
     'autocommit': True
 }
 
+# Shared catalog snapshot written by `python catalog_snapshot.py`
+snapshot_config = {
+    'path': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'var', 'catalog_snapshot.bin'),
+    'check_interval': 5.0,
+    'max_age': 900.0         # seconds; an older snapshot is skipped in favour of the database
+}
+
+# Rendered HTML fragments shared by every viewer of the same scope
+fragment_cache_config = {
+    'max_bytes': 32 * 1024 * 1024,
+    'ttl': 300
+}
+
+# Background report jobs (run in a process pool, results kept for result_ttl seconds)
+report_config = {
+    'max_workers': 2,
+    'per_user_limit': 2,
+    'result_ttl': 900
+}
+
+# Write-behind audit log (flushed every flush_interval seconds or batch_size events)
+audit_config = {
+    'batch_size': 200,
+    'flush_interval': 2.0
+}
+
+# Cross-worker cache invalidation (set socket_dir to also push events over Unix sockets)
+bus_config = {
+    'poll_interval': 2.0,
+    'socket_dir': None
+}
+
+# /cache/stats answers only requests carrying this token in X-Stats-Token (disabled when unset)
+monitoring_config = {
+    'stats_token': os.environ.get('CACHE_STATS_TOKEN')
+}
+
+# Outbox relay (see outbox.py); set embedded_relay to False when `python outbox.py` runs separately
+outbox_config = {
+    'embedded_relay': True,
+    'interval': 0.5,
+    'batch_size': 500
+}
+
+# Statement time budgets (ms) and the database circuit breaker; see db_guard.py
+db_guard_config = {
+    'read_ms': 2000,          # interactive read pages
+    'default_ms': 5000,       # routes without their own budget
+    'bulk_ms': 60000,         # imports, bulk writes, plans
+    'read_timeout_slack': 2,  # client read timeout = budget + slack (seconds)
+    'failure_threshold': 5,
+    'reset_timeout': 15.0
+}
+
+db_breaker = CircuitBreaker(db_guard_config['failure_threshold'], db_guard_config['reset_timeout'])
+
 # Get database connection
 def get_db_connection():
+    # Inside a request a failure raises DatabaseUnavailable, answered by database_error();
+    # CLI tools and background threads keep the None return and carry no budget
+    budget = request_budget(db_guard_config['default_ms'])
+    if budget is not None and not db_breaker.allow():
+        raise DatabaseUnavailable(msg='Database circuit breaker is open')
+    options = dict(db_config)
+    timeout = read_timeout(budget, db_guard_config['read_timeout_slack'])
+    if timeout:
+        # Applies to connect and to every read on the socket
+        options['connection_timeout'] = timeout
     try:
-        conn = mysql.connector.connect(**db_config)
+        conn = mysql.connector.connect(**options)
+        if budget:
+            cursor = conn.cursor()
+            cursor.execute("SET SESSION max_execution_time = %s", (budget,))
+            cursor.close()
+        if budget is not None:
+            g.db_used = True
         return conn
     except mysql.connector.Error as err:
         if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
@@ -33,7 +140,85 @@ def get_db_connection():
             print("Database does not exist")
         else:
             print(err)
-        return None
+        if budget is None:
+            return None
+        if counts_against_breaker():
+            db_breaker.record_failure()
+        g.db_failed = True
+        raise DatabaseUnavailable(msg=f'Database connection failed: {err}') from err
+
+# Cache invalidation bus shared by every in-process cache
+invalidation_bus = InvalidationBus(
+    get_db_connection,
+    poll_interval=bus_config['poll_interval'],
+    transport=UnixSocketTransport(bus_config['socket_dir']) if bus_config['socket_dir'] else None
+)
+
+@invalidation_bus.subscribe(PRODUCT_ADDED)
+def on_product_added(manufacturer_id):
+    invalidate_manufacturer_products(manufacturer_id)
+    invalidate_categories()
+    product_search_index.mark_stale()
+
+@invalidation_bus.subscribe(MANUFACTURER_STOCK_CHANGED)
+def on_manufacturer_stock_changed(manufacturer_id):
+    invalidate_manufacturer_products(manufacturer_id)
+
+@invalidation_bus.subscribe(DISTRIBUTORS_CHANGED)
+def on_distributors_changed(_):
+    invalidate_distributors()
+
+# Turns committed outbox events into invalidation events and rollups
+outbox_relay = OutboxRelay(get_db_connection, outbox_config['batch_size'], invalidation_bus.transport)
+
+@app.before_request
+def apply_invalidation_events():
+    invalidation_bus.start()
+    if outbox_config['embedded_relay']:
+        outbox_relay.start(outbox_config['interval'])
+    invalidation_bus.poll()
+
+@app.errorhandler(mysql.connector.Error)
+def database_error(err):
+    if not is_overload(err):
+        raise err
+    if not isinstance(err, DatabaseUnavailable):
+        # Statement timeout or lost connection mid-request
+        if counts_against_breaker():
+            db_breaker.record_failure()
+        g.db_failed = True
+    retry_after = db_breaker.retry_after() or db_guard_config['read_timeout_slack']
+    message = 'The database is busy. Please try again in a few seconds.'
+    if request.is_json or request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json':
+        response = jsonify({'success': False, 'message': message})
+    else:
+        response = app.make_response(render_template('service_unavailable.html', message=message))
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@app.teardown_request
+def record_database_outcome(exc):
+    # A request that reached the database and finished cleanly closes the breaker
+    if g.get('db_used') and not g.get('db_failed') and exc is None:
+        db_breaker.record_success()
+
+# Per-scope version stamps backing ETag / Last-Modified on listing pages
+scope_versions = ScopeVersions(invalidation_bus, os.path.dirname(os.path.abspath(__file__)))
+
+fragment_cache = FragmentCache(fragment_cache_config['max_bytes'], fragment_cache_config['ttl'],
+                               version_fn=scope_versions.version)
+app.jinja_env.add_extension(FragmentCacheExtension)
+app.jinja_env.fragment_cache = fragment_cache
+
+report_runner = ReportJobRunner(db_config, report_config['max_workers'], report_config['per_user_limit'],
+                                report_config['result_ttl'])
+
+audit_logger = AuditLogger(get_db_connection, audit_config['batch_size'], audit_config['flush_interval'])
+
+# Read-only view of the shared catalog snapshot (None until the builder has run)
+catalog_reader = SnapshotReader(snapshot_config['path'], snapshot_config['check_interval'],
+                                snapshot_config['max_age'])
 
 # Login required decorator
 def login_required(f):
@@ -56,6 +241,44 @@ def get_user():
     conn.close()
     return user
 
+# Manufacturer / distributor id and company name of the logged-in user
+def get_profile(user_type):
+    if session.get('user_type') != user_type:
+        return None
+
+    def load():
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(f"SELECT {user_type}_id AS id, company_name FROM {user_type} WHERE user_id = %s",
+                       (session['user_id'],))
+        row = cursor.fetchone()
+        cursor.close()
+        conn.close()
+        return row
+    return reference_cache.get_or_load(('profile', user_type, session['user_id']), load)
+
+def get_profile_id(user_type):
+    profile = get_profile(user_type)
+    return profile['id'] if profile else None
+
+def catalog_scope():
+    return 'catalog' if session.get('user_type') == 'customer' else None
+
+def catalog_source():
+    # The browse page answers from the snapshot when one is mapped, so its ETag follows it
+    snapshot = catalog_reader.get()
+    if snapshot is None:
+        return 'db', None
+    return f'snap{snapshot.generation}:{snapshot.built_at}', snapshot.built_at
+
+def manufacturer_scope():
+    manufacturer_id = get_profile_id('manufacturer')
+    return f'manufacturer:{manufacturer_id}' if manufacturer_id else None
+
+def distributor_scope():
+    distributor_id = get_profile_id('distributor')
+    return f'distributor:{distributor_id}' if distributor_id else None
+
 # ======================= HOME & AUTH ROUTES =======================
 
 @app.route('/')
@@ -88,8 +311,11 @@ def login():
             session['username'] = user['username']
             session['user_type'] = user['user_type']
             
-            cursor.execute("UPDATE users SET last_login=NOW() WHERE user_id=%s", (user['user_id'],))
+            login_time = datetime.now().replace(microsecond=0)
+            cursor.execute("UPDATE users SET last_login=%s WHERE user_id=%s", (login_time, user['user_id']))
             conn.commit()
+            audit_logger.log('users', 'UPDATE', user['user_id'],
+                             f"Last login: {user['last_login'] or 'Never'}", f"Last login: {login_time}")
             cursor.close()
             conn.close()
             return redirect(url_for('home'))
@@ -128,14 +354,16 @@ def manufacturer_dashboard():
     total_products = cursor.fetchone()['total']
     
     # Inventory value
-    cursor.execute("""SELECT COALESCE(SUM(i.quantity_available * p.unit_price), 0) as value 
-                      FROM inventory i 
-                      JOIN product p ON i.product_id = p.product_id 
-                      WHERE i.manufacturer_id = %s""", (manufacturer_id,))
+    cursor.execute(f"""SELECT COALESCE(SUM({live_quantity_sql('manufacturer', 'i')} * p.unit_price), 0) as value 
+                       FROM inventory i 
+                       JOIN product p ON i.product_id = p.product_id 
+                       WHERE i.manufacturer_id = %s""", (manufacturer_id,))
     inventory_value = cursor.fetchone()['value']
     
     # Low stock count
-    cursor.execute("SELECT COUNT(*) as total FROM inventory WHERE manufacturer_id = %s AND quantity_available <= reorder_level", (manufacturer_id,))
+    cursor.execute(f"""SELECT COUNT(*) as total FROM inventory i
+                       WHERE i.manufacturer_id = %s AND {live_quantity_sql('manufacturer', 'i')} <= i.reorder_level""",
+                   (manufacturer_id,))
     low_stock = cursor.fetchone()['total']
     
     # Recent allocations
@@ -149,6 +377,16 @@ def manufacturer_dashboard():
     recent_allocations = cursor.fetchall()
     
     cursor.close()
+    
+    # Direct sales, from the columnar copy of this manufacturer's order items
+    sales = sales_store.get(conn, 'manufacturer', manufacturer_id)
+    with sales.lock:
+        selected = sales.mask()
+        sales_summary = sales.totals(selected)
+        top_products = sales.top_products(selected)
+        monthly_sales = sales.revenue_by_month(selected, limit=6)
+        order_stats = sales.status_breakdown(selected)
+    
     conn.close()
     
     return render_template('manufacturer_dashboard.html', 
@@ -156,7 +394,11 @@ def manufacturer_dashboard():
                          total_products=total_products, 
                          inventory_value=inventory_value, 
                          low_stock=low_stock,
-                         recent_allocations=recent_allocations)
+                         recent_allocations=recent_allocations,
+                         sales_summary=sales_summary,
+                         top_products=top_products,
+                         monthly_sales=monthly_sales,
+                         order_stats=order_stats)
 
 @app.route('/manufacturer/add_product', methods=['GET', 'POST'])
 @login_required
@@ -192,6 +434,7 @@ def add_product():
             manufacturer_id = cursor.fetchone()[0]
             
             # Insert product
+            conn.start_transaction()
             cursor.execute("""INSERT INTO product
                             (manufacturer_id, product_name, description, category, unit_price, manufacturing_cost, weight, dimensions)
                             VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
@@ -203,6 +446,9 @@ def add_product():
             cursor.execute("""INSERT INTO inventory (product_id, manufacturer_id, quantity_available, reorder_level)
                             VALUES (%s, %s, %s, %s)""",
                          (product_id, manufacturer_id, initial_quantity, reorder_level))
+            record_movements(cursor, [('manufacturer', manufacturer_id, product_id, 'adjustment',
+                                       initial_quantity, None)])
+            stage_event(cursor, PRODUCT_CREATED, manufacturer_id, {'product_id': product_id})
             
             conn.commit()
             message = 'Product added successfully!'
@@ -216,8 +462,67 @@ def add_product():
     return render_template('manufacturer_add_product.html', error=error, message=message)
 
 
+@app.route('/manufacturer/products/import', methods=['GET', 'POST'])
+@login_required
+@statement_budget(db_guard_config['bulk_ms'])
+def import_products():
+    wants_json = request.args.get('format') == 'json'
+    if session.get('user_type') != 'manufacturer':
+        if wants_json:
+            return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+        return redirect(url_for('home'))
+
+    if request.method == 'GET':
+        return render_template('manufacturer_import_products.html', import_id=request.args.get('import_id'))
+
+    manufacturer_id = get_profile_id('manufacturer')
+    if not manufacturer_id:
+        if wants_json:
+            return jsonify({'success': False, 'message': 'Manufacturer profile not found.'}), 404
+        return render_template('manufacturer_import_products.html', error="Manufacturer profile not found.")
+
+    # Resuming a failed import: same file plus the import_id from its report
+    upload = request.files.get('file')
+    import_id = request.form.get('import_id') or request.args.get('import_id') or None
+    error = None
+    if not upload or not upload.filename:
+        error = 'Please choose a CSV or JSONL file to upload.'
+    elif import_id is not None and not import_id.isdigit():
+        error = 'import_id must be an integer'
+    if error:
+        if wants_json:
+            return jsonify({'success': False, 'message': error}), 400
+        return render_template('manufacturer_import_products.html', error=error, import_id=import_id)
+
+    conn = get_db_connection()
+    try:
+        report = run_import(conn, manufacturer_id, iter_rows(upload), upload.filename,
+                            int(import_id) if import_id else None)
+    except ImportNotFound as e:
+        conn.close()
+        if wants_json:
+            return jsonify({'success': False, 'message': str(e)}), 404
+        return render_template('manufacturer_import_products.html', error=str(e))
+    except ValueError as e:
+        conn.close()
+        if wants_json:
+            return jsonify({'success': False, 'message': str(e)}), 409
+        return render_template('manufacturer_import_products.html', error=str(e))
+    except mysql.connector.Error as err:
+        conn.close()
+        if wants_json:
+            return jsonify({'success': False, 'message': str(err)}), 500
+        return render_template('manufacturer_import_products.html', error=f"Error during import: {err}")
+    conn.close()
+
+    if wants_json:
+        return jsonify({'success': report['status'] == 'completed', **report})
+    return render_template('manufacturer_import_products.html', report=report)
+
 @app.route('/manufacturer/products')
 @login_required
+@statement_budget(db_guard_config['read_ms'])
+@conditional_get(scope_versions, manufacturer_scope, 'private, max-age=30, must-revalidate')
 def manufacturer_products():
     if session.get('user_type') != 'manufacturer':
         return redirect(url_for('home'))
@@ -230,11 +535,11 @@ def manufacturer_products():
     manufacturer_id = cursor.fetchone()['manufacturer_id']
     
     # Get products
-    cursor.execute("""SELECT p.*, i.quantity_available, i.reorder_level 
-                      FROM product p
-                      LEFT JOIN inventory i ON p.product_id = i.product_id
-                      WHERE p.manufacturer_id = %s
-                      ORDER BY p.product_name""", (manufacturer_id,))
+    cursor.execute(f"""SELECT p.*, {live_quantity_sql('manufacturer', 'i')} AS quantity_available, i.reorder_level 
+                       FROM product p
+                       LEFT JOIN inventory i ON p.product_id = i.product_id
+                       WHERE p.manufacturer_id = %s
+                       ORDER BY p.product_name""", (manufacturer_id,))
     products = cursor.fetchall()
     
     cursor.close()
@@ -244,6 +549,8 @@ def manufacturer_products():
 
 @app.route('/manufacturer/inventory')
 @login_required
+@statement_budget(db_guard_config['read_ms'])
+@conditional_get(scope_versions, manufacturer_scope, 'private, no-cache')
 def manufacturer_inventory():
     if session.get('user_type') != 'manufacturer':
         return redirect(url_for('home'))
@@ -256,11 +563,13 @@ def manufacturer_inventory():
     manufacturer_id = cursor.fetchone()['manufacturer_id']
     
     # Get inventory
-    cursor.execute("""SELECT i.*, p.product_name, p.category, p.unit_price
-                      FROM inventory i
-                      JOIN product p ON i.product_id = p.product_id
-                      WHERE i.manufacturer_id = %s
-                      ORDER BY p.product_name""", (manufacturer_id,))
+    cursor.execute(f"""SELECT i.inventory_id, i.product_id, {live_quantity_sql('manufacturer', 'i')} AS quantity_available,
+                              i.reorder_level, i.row_version, i.stock_slots, i.last_updated,
+                              p.product_name, p.category, p.unit_price
+                       FROM inventory i
+                       JOIN product p ON i.product_id = p.product_id
+                       WHERE i.manufacturer_id = %s
+                       ORDER BY p.product_name""", (manufacturer_id,))
     inventory = cursor.fetchall()
     
     cursor.close()
@@ -268,6 +577,119 @@ def manufacturer_inventory():
     
     return render_template('manufacturer_inventory.html', inventory=inventory)
 
+@app.route('/manufacturer/inventory/<int:inventory_id>', methods=['POST'])
+@login_required
+def update_inventory(inventory_id):
+    if session.get('user_type') != 'manufacturer':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    try:
+        quantity = int(request.form.get('quantity_available'))
+        reorder_level = int(request.form.get('reorder_level'))
+        row_version = int(request.form.get('row_version'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'quantity_available, reorder_level and row_version must be integers'}), 400
+    if quantity < 0 or reorder_level < 0:
+        return jsonify({'success': False, 'message': 'Quantities cannot be negative'}), 400
+    
+    manufacturer_id = get_profile_id('manufacturer')
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    
+    # Compare-and-set: applies only if nobody (an allocation, an order) changed the row since it was read.
+    # The row is locked, so the quantity read is the one the UPDATE replaces and the ledger delta is taken from.
+    conn.start_transaction()
+    cursor.execute("""SELECT product_id, quantity_available, stock_slots FROM inventory
+                      WHERE inventory_id = %s AND manufacturer_id = %s AND row_version = %s
+                      FOR UPDATE""",
+                   (inventory_id, manufacturer_id, row_version))
+    seen = cursor.fetchone()
+    updated = False
+    if seen:
+        previous = seen['quantity_available']
+        if seen['stock_slots']:
+            # Sharded: the count is written to the slots; the parent's quantity is only a mirror
+            shards = lock_slot_totals(cursor, 'manufacturer', manufacturer_id, [seen['product_id']])
+            slot_ids, previous = shards[seen['product_id']]
+            set_slot_total(cursor, 'manufacturer', manufacturer_id, seen['product_id'], slot_ids, quantity)
+        cursor.execute("""UPDATE inventory
+                          SET quantity_available = IF(stock_slots > 0, quantity_available, %s), reorder_level = %s
+                          WHERE inventory_id = %s AND manufacturer_id = %s AND row_version = %s""",
+                       (quantity, reorder_level, inventory_id, manufacturer_id, row_version))
+        updated = cursor.rowcount == 1
+    if updated:
+        record_movements(cursor, [('manufacturer', manufacturer_id, seen['product_id'], 'adjustment',
+                                   quantity - previous, None)])
+        stage_event(cursor, STOCK_ADJUSTED, manufacturer_id,
+                    {'owner_type': 'manufacturer', 'product_id': seen['product_id']})
+        conn.commit()
+    else:
+        conn.rollback()
+    
+    cursor.execute(f"""SELECT i.inventory_id, {live_quantity_sql('manufacturer', 'i')} AS quantity_available,
+                              i.reorder_level, i.row_version
+                       FROM inventory i WHERE i.inventory_id = %s AND i.manufacturer_id = %s""",
+                   (inventory_id, manufacturer_id))
+    current = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    
+    if not current:
+        return jsonify({'success': False, 'message': 'Inventory item not found'}), 404
+    if not updated:
+        return jsonify({'success': False, 'message': 'Changed by someone else; reload and retry',
+                        'current': current}), 409
+    return jsonify({'success': True, 'message': 'Inventory updated successfully', 'current': current})
+
+@app.route('/inventory/bulk_adjust', methods=['GET', 'POST'])
+@login_required
+@statement_budget(db_guard_config['bulk_ms'])
+def bulk_adjust_inventory():
+    wants_json = request.is_json or request.args.get('format') == 'json'
+    owner_type = session.get('user_type')
+    if owner_type not in ('manufacturer', 'distributor'):
+        if wants_json:
+            return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+        return redirect(url_for('home'))
+
+    if request.method == 'GET':
+        return render_template('inventory_bulk_adjust.html')
+
+    # JSON {"mode": "set"|"delta", "adjustments": [...]} or an uploaded CSV with the mode chosen on the form
+    try:
+        if request.is_json:
+            lines = parse_adjustment_json(request.get_json(silent=True))
+        else:
+            upload = request.files.get('file')
+            if not upload or not upload.filename:
+                raise ValueError('Please choose a CSV file to upload.')
+            lines = parse_adjustment_csv(upload, request.form.get('mode') or 'set')
+    except (ValueError, UnicodeDecodeError) as e:
+        if wants_json:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        return render_template('inventory_bulk_adjust.html', error=str(e))
+
+    owner_id = get_profile_id(owner_type)
+    if not owner_id:
+        if wants_json:
+            return jsonify({'success': False, 'message': 'Profile not found.'}), 404
+        return render_template('inventory_bulk_adjust.html', error="Profile not found.")
+
+    conn = get_db_connection()
+    try:
+        report = run_bulk_adjustment(conn, owner_type, owner_id, lines)
+    except mysql.connector.Error as err:
+        conn.rollback()
+        conn.close()
+        if wants_json:
+            return jsonify({'success': False, 'message': str(err)}), 500
+        return render_template('inventory_bulk_adjust.html', error=f"Error during adjustment: {err}")
+    conn.close()
+
+    if wants_json:
+        return jsonify({'success': True, **report})
+    return render_template('inventory_bulk_adjust.html', report=report)
+
 @app.route('/manufacturer/allocate', methods=['GET', 'POST'])
 @login_required
 def allocate_product():
@@ -296,9 +718,10 @@ def allocate_product():
         quantity = int(request.form.get('quantity'))
 
         try:
-            # 1️⃣ Check available inventory
-            cursor.execute("""
-                SELECT i.quantity_available, p.manufacturing_cost, p.unit_price
+            # 1️⃣ Check available inventory (hot products count their stock slots)
+            cursor.execute(f"""
+                SELECT {live_quantity_sql('manufacturer', 'i')} AS quantity_available, i.stock_slots,
+                       p.manufacturing_cost, p.unit_price
                 FROM inventory i
                 JOIN product p ON i.product_id = p.product_id
                 WHERE i.product_id = %s AND i.manufacturer_id = %s
@@ -313,31 +736,38 @@ def allocate_product():
                 # 2️⃣ Compute prices
                 cost_price = Decimal(inv_row['manufacturing_cost'])
                 manufacturer_unit_price = Decimal(inv_row['unit_price'])
-                distributor_price = (manufacturer_unit_price * Decimal('1.10')).quantize(Decimal('0.01'))  # 10% markup
+                dist_price = distributor_price(manufacturer_unit_price)  # 10% markup
 
-                # 3️⃣ Record allocation
+                # 3️⃣ Deduct from manufacturer inventory first; the check above was a plain read,
+                #    take_stock only succeeds if the units are still there (in the slots, if sharded)
+                conn.start_transaction()
+                if not take_stock(conn, 'manufacturer', manufacturer_id, product_id, quantity, inv_row['stock_slots']):
+                    raise ValueError('Insufficient stock! Units were taken by other orders; reload and retry.')
+
+                # 4️⃣ Record allocation
                 cursor.execute("""
                     INSERT INTO allocation 
                         (manufacturer_id, distributor_id, product_id, allocated_quantity, unit_price, status)
                     VALUES (%s, %s, %s, %s, %s, 'completed')
-                """, (manufacturer_id, distributor_id, product_id, quantity, distributor_price))
-
-                # 4️⃣ Deduct from manufacturer inventory
-                cursor.execute("""
-                    UPDATE inventory 
-                    SET quantity_available = quantity_available - %s 
-                    WHERE product_id = %s AND manufacturer_id = %s
-                """, (quantity, product_id, manufacturer_id))
+                """, (manufacturer_id, distributor_id, product_id, quantity, dist_price))
+                allocation_id = cursor.lastrowid
 
                 # 5️⃣ Add/update distributor inventory using alias for MySQL 8+ compliance
+                #    (the allocation price only seeds new rows; an existing retail price is the distributor's)
                 cursor.execute("""
                     INSERT INTO distributor_inventory (distributor_id, product_id, quantity_available, cost_price, unit_price)
                     VALUES (%s, %s, %s, %s, %s) AS new
                     ON DUPLICATE KEY UPDATE
                         quantity_available = distributor_inventory.quantity_available + new.quantity_available,
-                        cost_price = new.cost_price,
-                        unit_price = new.unit_price
-                """, (distributor_id, product_id, quantity, cost_price, distributor_price))
+                        cost_price = new.cost_price
+                """, (distributor_id, product_id, quantity, cost_price, dist_price))
+
+                # 6️⃣ Both sides of the move go to the stock ledger
+                record_movements(cursor, [
+                    ('manufacturer', manufacturer_id, product_id, 'allocation_out', -quantity, allocation_id),
+                    ('distributor', distributor_id, product_id, 'allocation_in', quantity, allocation_id),
+                ])
+                stage_event(cursor, STOCK_ALLOCATED, manufacturer_id, {'distributor_ids': [distributor_id]})
 
                 conn.commit()
                 message = f'✅ Successfully allocated {quantity} units to distributor.'
@@ -346,18 +776,9 @@ def allocate_product():
             conn.rollback()
             error = f"Error during allocation: {str(e)}"
     
-    # Load distributor and product dropdowns
-    cursor.execute("SELECT distributor_id, company_name FROM distributor ORDER BY company_name")
-    distributors = cursor.fetchall()
-    
-    cursor.execute("""
-        SELECT p.product_id, p.product_name, i.quantity_available 
-        FROM product p
-        LEFT JOIN inventory i ON p.product_id = i.product_id
-        WHERE p.manufacturer_id = %s
-        ORDER BY p.product_name
-    """, (manufacturer_id,))
-    products = cursor.fetchall()
+    # Load distributor and product dropdowns (cached reference data)
+    distributors = get_distributors(cursor)
+    products = get_manufacturer_products(cursor, manufacturer_id)
     
     cursor.close()
     conn.close()
@@ -371,32 +792,171 @@ def allocate_product():
     )
 
 
-@app.route('/manufacturer/allocations')
+@app.route('/manufacturer/allocate/bulk', methods=['GET', 'POST'])
 @login_required
-def manufacturer_allocations():
+@statement_budget(db_guard_config['bulk_ms'])
+def bulk_allocate():
+    wants_json = request.is_json or request.args.get('format') == 'json'
     if session.get('user_type') != 'manufacturer':
+        if wants_json:
+            return jsonify({'success': False, 'message': 'Unauthorized'}), 403
         return redirect(url_for('home'))
-    
+
+    if request.method == 'GET':
+        return render_template('manufacturer_bulk_allocate.html')
+
+    # Parse JSON body or uploaded CSV into allocation lines
+    try:
+        if request.is_json:
+            lines = parse_json_lines(request.get_json(silent=True))
+        else:
+            upload = request.files.get('file')
+            if not upload or not upload.filename:
+                raise ValueError('Please choose a CSV file to upload.')
+            lines = parse_csv_lines(upload)
+    except (ValueError, UnicodeDecodeError) as e:
+        if wants_json:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        return render_template('manufacturer_bulk_allocate.html', error=str(e))
+
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
-    
-    # Get manufacturer id
     cursor.execute("SELECT manufacturer_id FROM manufacturer WHERE user_id = %s", (session['user_id'],))
-    manufacturer_id = cursor.fetchone()['manufacturer_id']
+    manufacturer = cursor.fetchone()
+    cursor.close()
+
+    if not manufacturer:
+        conn.close()
+        if wants_json:
+            return jsonify({'success': False, 'message': 'Manufacturer profile not found.'}), 404
+        return render_template('manufacturer_bulk_allocate.html', error="Manufacturer profile not found.")
+
+    try:
+        report = run_bulk_allocation(conn, manufacturer['manufacturer_id'], lines)
+    except mysql.connector.Error as err:
+        conn.rollback()
+        conn.close()
+        if wants_json:
+            return jsonify({'success': False, 'message': str(err)}), 500
+        return render_template('manufacturer_bulk_allocate.html', error=f"Error during allocation: {err}")
+    conn.close()
+
+    if wants_json:
+        return jsonify({'success': True, **report})
+    return render_template('manufacturer_bulk_allocate.html', report=report)
+
+
+@app.route('/manufacturer/allocation_plan')
+@login_required
+@statement_budget(db_guard_config['bulk_ms'])
+def allocation_plan():
+    wants_json = request.args.get('format') == 'json'
+    if session.get('user_type') != 'manufacturer':
+        if wants_json:
+            return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+        return redirect(url_for('home'))
+
+    window_days = request.args.get('window_days', DEFAULT_WINDOW_DAYS, type=int)
+    cover_days = request.args.get('cover_days', DEFAULT_COVER_DAYS, type=int)
+    window_days = min(max(window_days, 1), 365)
+    cover_days = min(max(cover_days, 1), 365)
+
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT manufacturer_id FROM manufacturer WHERE user_id = %s", (session['user_id'],))
+    manufacturer = cursor.fetchone()
+    cursor.close()
+
+    if not manufacturer:
+        conn.close()
+        if wants_json:
+            return jsonify({'success': False, 'message': 'Manufacturer profile not found.'}), 404
+        return redirect(url_for('home'))
+
+    plan = build_plan(conn, manufacturer['manufacturer_id'], window_days, cover_days)
+    conn.close()
+
+    if wants_json:
+        return jsonify({'success': True, 'window_days': window_days, 'cover_days': cover_days, 'plan': plan})
+    return render_template('manufacturer_allocation_plan.html',
+                         plan=plan,
+                         window_days=window_days,
+                         cover_days=cover_days)
+
+
+@app.route('/manufacturer/allocation_plan/apply', methods=['POST'])
+@login_required
+@statement_budget(db_guard_config['bulk_ms'])
+def apply_allocation_plan():
+    if session.get('user_type') != 'manufacturer':
+        if request.is_json:
+            return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+        return redirect(url_for('home'))
+
+    # Reviewed lines come back either as JSON or as the checked rows of the plan form
+    try:
+        if request.is_json:
+            lines = parse_json_lines(request.get_json(silent=True))
+        else:
+            rows = []
+            for key in request.form.getlist('selected'):
+                distributor_id, _, product_id = key.partition('-')
+                rows.append({'distributor_id': distributor_id,
+                             'product_id': product_id,
+                             'quantity': request.form.get(f'qty-{key}')})
+            lines = parse_json_lines(rows)
+    except ValueError as e:
+        if request.is_json:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        return render_template('manufacturer_bulk_allocate.html', error=str(e))
+
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT manufacturer_id FROM manufacturer WHERE user_id = %s", (session['user_id'],))
+    manufacturer = cursor.fetchone()
+    cursor.close()
+
+    if not manufacturer:
+        conn.close()
+        if request.is_json:
+            return jsonify({'success': False, 'message': 'Manufacturer profile not found.'}), 404
+        return redirect(url_for('home'))
+
+    try:
+        report = run_bulk_allocation(conn, manufacturer['manufacturer_id'], lines)
+    except mysql.connector.Error as err:
+        conn.rollback()
+        conn.close()
+        if request.is_json:
+            return jsonify({'success': False, 'message': str(err)}), 500
+        return render_template('manufacturer_bulk_allocate.html', error=f"Error during allocation: {err}")
+    conn.close()
+
+    if request.is_json:
+        return jsonify({'success': True, **report})
+    return render_template('manufacturer_bulk_allocate.html', report=report)
+
+
+@app.route('/manufacturer/allocations')
+@login_required
+@statement_budget(0)   # streamed: rows keep arriving long after the first batch
+def manufacturer_allocations():
+    if session.get('user_type') != 'manufacturer':
+        return redirect(url_for('home'))
     
-    # Get allocations
-    cursor.execute("""SELECT a.*, d.company_name, p.product_name 
+    manufacturer_id = get_profile_id('manufacturer')
+    
+    # Get allocations (streamed in batches rather than fetched all at once)
+    allocations = RowStream(get_db_connection, """SELECT a.*, d.company_name, p.product_name 
                       FROM allocation a
                       JOIN distributor d ON a.distributor_id = d.distributor_id
                       JOIN product p ON a.product_id = p.product_id
                       WHERE a.manufacturer_id = %s
                       ORDER BY a.allocation_date DESC""", (manufacturer_id,))
-    allocations = cursor.fetchall()
     
-    cursor.close()
-    conn.close()
-    
-    return render_template('manufacturer_allocations.html', allocations=allocations)
+    if wants_ndjson():
+        return ndjson_response(allocations)
+    return stream_page('manufacturer_allocations.html', allocations=allocations)
 
 # ======================= DISTRIBUTOR ROUTES =======================
 
@@ -416,11 +976,12 @@ def distributor_dashboard():
     company_name = dist['company_name']
     
     # Get stats
-    cursor.execute("""SELECT COUNT(DISTINCT product_id) as unique_products,
-                             COALESCE(SUM(quantity_available), 0) as total_units,
-                             COALESCE(SUM(quantity_available * unit_price), 0) as inventory_value
-                      FROM distributor_inventory
-                      WHERE distributor_id = %s""", (distributor_id,))
+    live_quantity = live_quantity_sql('distributor', 'di')
+    cursor.execute(f"""SELECT COUNT(DISTINCT di.product_id) as unique_products,
+                              COALESCE(SUM({live_quantity}), 0) as total_units,
+                              COALESCE(SUM({live_quantity} * di.unit_price), 0) as inventory_value
+                       FROM distributor_inventory di
+                       WHERE di.distributor_id = %s""", (distributor_id,))
     stats = cursor.fetchone()
     
     cursor.close()
@@ -434,6 +995,8 @@ def distributor_dashboard():
 
 @app.route('/distributor/inventory')
 @login_required
+@statement_budget(db_guard_config['read_ms'])
+@conditional_get(scope_versions, distributor_scope, 'private, no-cache')
 def distributor_inventory():
     if session.get('user_type') != 'distributor':
         return redirect(url_for('home'))
@@ -446,11 +1009,13 @@ def distributor_inventory():
     distributor_id = cursor.fetchone()['distributor_id']
     
     # Get inventory
-    cursor.execute("""SELECT di.*, p.product_name, p.category, p.description
-                      FROM distributor_inventory di
-                      JOIN product p ON di.product_id = p.product_id
-                      WHERE di.distributor_id = %s
-                      ORDER BY p.product_name""", (distributor_id,))
+    cursor.execute(f"""SELECT di.dist_inventory_id, di.product_id, {live_quantity_sql('distributor', 'di')} AS quantity_available,
+                              di.unit_price, di.cost_price, di.reorder_level, di.price_version, di.stock_slots,
+                              di.last_updated, p.product_name, p.category, p.description
+                       FROM distributor_inventory di
+                       JOIN product p ON di.product_id = p.product_id
+                       WHERE di.distributor_id = %s
+                       ORDER BY p.product_name""", (distributor_id,))
     inventory = cursor.fetchall()
     
     cursor.close()
@@ -464,34 +1029,240 @@ def update_distributor_price():
     if session.get('user_type') != 'distributor':
         return jsonify({'success': False, 'message': 'Unauthorized'})
     
-    dist_inventory_id = request.form.get('dist_inventory_id')
-    new_price = float(request.form.get('new_price'))
+    try:
+        lines = parse_price_lines([{'dist_inventory_id': request.form.get('dist_inventory_id'),
+                                    'new_price': request.form.get('new_price'),
+                                    'price_version': request.form.get('price_version')}])
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
     
     conn = get_db_connection()
-    cursor = conn.cursor()
     
     try:
-        # Get distributor id
-        cursor.execute("SELECT distributor_id FROM distributor WHERE user_id = %s", (session['user_id'],))
-        distributor_id = cursor.fetchone()[0]
-        
-        # Update price
-        cursor.execute("""UPDATE distributor_inventory 
-                         SET unit_price = %s 
-                         WHERE dist_inventory_id = %s AND distributor_id = %s""",
-                     (new_price, dist_inventory_id, distributor_id))
-        
-        conn.commit()
-        cursor.close()
+        distributor_id = get_profile_id('distributor')
+        report = apply_prices(conn, distributor_id, session['user_id'], lines=lines, reason='Manual update')
         conn.close()
         
-        return jsonify({'success': True, 'message': 'Price updated successfully'})
+        result = report['results'][0]
+        if result['status'] == 'conflict':
+            return jsonify({'success': False, 'message': result['message'],
+                            'current': {'unit_price': result['current_price'],
+                                        'price_version': result['price_version']}}), 409
+        if result['status'] == 'error':
+            return jsonify({'success': False, 'message': result['message']})
+        return jsonify({'success': True, 'message': 'Price updated successfully',
+                        'price_version': result.get('price_version')})
     except Exception as e:
-        conn.rollback()
-        cursor.close()
         conn.close()
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/distributor/bulk_update_prices', methods=['POST'])
+@login_required
+@statement_budget(db_guard_config['bulk_ms'])
+def bulk_update_prices():
+    wants_json = request.is_json or request.args.get('format') == 'json'
+    if session.get('user_type') != 'distributor':
+        if wants_json:
+            return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+        return redirect(url_for('home'))
+
+    # JSON: {"prices": [{dist_inventory_id, new_price}, ...]} or {"rule": {...}}; form: the pricing page rule
+    try:
+        if request.is_json:
+            payload = request.get_json(silent=True)
+            lines, rule = parse_pricing_payload(payload)
+            reason = payload.get('reason') or 'Bulk update'
+        elif 'apply' in request.form:
+            lines, rule = parse_price_form(request.form), None
+            reason = 'Recommended price'
+        else:
+            lines, rule = None, parse_pricing_form(request.form)
+            reason = 'Bulk update'
+    except ValueError as e:
+        if wants_json:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        return render_distributor_pricing(error=str(e))
+
+    distributor_id = get_profile_id('distributor')
+    if not distributor_id:
+        if wants_json:
+            return jsonify({'success': False, 'message': 'Distributor profile not found.'}), 404
+        return redirect(url_for('login'))
+
+    conn = get_db_connection()
+    try:
+        report = apply_prices(conn, distributor_id, session['user_id'], lines=lines, rule=rule, reason=reason)
+    except mysql.connector.Error as err:
+        conn.close()
+        if wants_json:
+            return jsonify({'success': False, 'message': str(err)}), 500
+        return render_distributor_pricing(error=f"Error updating prices: {err}")
+    conn.close()
+
+    if report['summary']['conflicts']:
+        if wants_json:
+            return jsonify({'success': False, 'message': 'Some prices changed since they were read; nothing was applied.',
+                            **report}), 409
+        return render_distributor_pricing(report=report,
+                                          error='Some prices changed while updating; nothing was applied. Please retry.')
+    if wants_json:
+        return jsonify({'success': True, **report})
+    return render_distributor_pricing(report=report)
+
+def render_distributor_pricing(**extra):
+    profile = get_profile('distributor')
+    if not profile:
+        return redirect(url_for('login'))
+    distributor_id = profile['id']
+    
+    search_query = request.args.get('search', '').strip()
+    category = request.args.get('category', '')
+    
+    filters = ["di.distributor_id = %s"]
+    params = [distributor_id]
+    if search_query:
+        filters.append("p.product_name LIKE %s")
+        params.append(f"%{search_query}%")
+    if category:
+        filters.append("p.category = %s")
+        params.append(category)
+    
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    
+    cursor.execute(f"""SELECT di.dist_inventory_id, di.price_version, di.cost_price, {live_quantity_sql('distributor', 'di')} AS quantity,
+                              di.unit_price AS current_price, p.product_name, p.category, p.sku,
+                              ROUND((di.unit_price - di.cost_price) / di.cost_price * 100, 2) AS current_markup,
+                              ROUND(COALESCE(di.cost_price, 0) * 1.10, 2) AS min_price
+                       FROM distributor_inventory di
+                       JOIN product p ON di.product_id = p.product_id
+                       WHERE {' AND '.join(filters)}
+                       ORDER BY p.product_name""", params)
+    products = cursor.fetchall()
+    
+    cursor.execute("""SELECT pch.*, p.product_name
+                      FROM price_change_history pch
+                      JOIN product p ON pch.product_id = p.product_id
+                      WHERE pch.distributor_id = %s
+                      ORDER BY pch.changed_at DESC LIMIT 10""", (distributor_id,))
+    price_history = cursor.fetchall()
+    cursor.close()
+    
+    recommendations = build_recommendations(conn, distributor_id)
+    conn.close()
+    
+    return render_template('distributor_pricing.html',
+                         company_name=profile['company_name'],
+                         products=products,
+                         price_history=price_history,
+                         recommendations=recommendations,
+                         search_query=search_query,
+                         **extra)
+
+@app.route('/distributor_pricing')
+@login_required
+def distributor_pricing():
+    if session.get('user_type') != 'distributor':
+        return redirect(url_for('home'))
+    return render_distributor_pricing()
+
+@app.route('/distributor/price_history/<int:dist_inventory_id>')
+@login_required
+@statement_budget(db_guard_config['read_ms'])
+@conditional_get(scope_versions, distributor_scope, 'private, no-cache')
+def price_history(dist_inventory_id):
+    wants_json = request.args.get('format') == 'json'
+    if session.get('user_type') != 'distributor':
+        if wants_json:
+            return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+        return redirect(url_for('home'))
+    
+    distributor_id = get_profile_id('distributor')
+    points = min(max(request.args.get('points', DEFAULT_POINTS, type=int), MIN_POINTS), MAX_POINTS)
+    try:
+        start = parse_date(request.args.get('start'))
+        end = parse_date(request.args.get('end'))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'start and end must be YYYY-MM-DD'}), 400
+    
+    body = cached_series(fragment_cache, distributor_scope(), get_db_connection,
+                         distributor_id, dist_inventory_id, points, start, end)
+    if wants_json:
+        return app.response_class(body, mimetype='application/json')
+    
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("""SELECT p.product_name, di.unit_price
+                      FROM distributor_inventory di
+                      JOIN product p ON di.product_id = p.product_id
+                      WHERE di.dist_inventory_id = %s AND di.distributor_id = %s""",
+                   (dist_inventory_id, distributor_id))
+    product = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    if not product:
+        return redirect(url_for('distributor_pricing'))
+    
+    series = json.loads(body)
+    period = [datetime.fromtimestamp(series['points'][i][0]) for i in (0, -1)] if series['points'] else None
+    return render_template('distributor_price_history.html', product=product, series=series,
+                         polyline=svg_polyline(series), period=period, points=points,
+                         dist_inventory_id=dist_inventory_id)
+
+@app.route('/distributor/price_recommendations')
+@login_required
+def price_recommendations():
+    if session.get('user_type') != 'distributor':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    distributor_id = get_profile_id('distributor')
+    if not distributor_id:
+        return jsonify({'success': False, 'message': 'Distributor profile not found.'}), 404
+    window_days = min(max(request.args.get('window_days', PRICING_WINDOW_DAYS, type=int), 7), 180)
+    
+    conn = get_db_connection()
+    result = build_recommendations(conn, distributor_id, window_days)
+    conn.close()
+    
+    for rec in result['recommendations']:
+        rec['current_price'] = str(rec['current_price'])
+        rec['suggested_price'] = str(rec['suggested_price'])
+    return jsonify({'success': True, **result})
+
+@app.route('/stock_ledger')
+@login_required
+def stock_ledger():
+    # ?at=... -> stock per product at that time; ?start=...&end=... -> movements in that window
+    owner_type = session.get('user_type')
+    if owner_type not in ('manufacturer', 'distributor'):
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    owner_id = get_profile_id(owner_type)
+    if not owner_id:
+        return jsonify({'success': False, 'message': 'Profile not found.'}), 404
+
+    try:
+        at, start, end = (datetime.fromisoformat(request.args[name]) if request.args.get(name) else None
+                          for name in ('at', 'start', 'end'))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Dates must be ISO formatted (YYYY-MM-DD[THH:MM:SS])'}), 400
+    if start and end and start >= end:
+        return jsonify({'success': False, 'message': 'start must be before end'}), 400
+
+    conn = get_db_connection()
+    if start:
+        end = end or datetime.now()
+        window = movements_between(conn, owner_type, owner_id, start, end)
+        conn.close()
+        return jsonify({'success': True, 'start': start.isoformat(), 'end': end.isoformat(),
+                        'movements': [{'product_id': product_id, **moved}
+                                      for product_id, moved in sorted(window.items())]})
+    at = at or datetime.now()
+    stock = stock_at(conn, owner_type, owner_id, at)
+    conn.close()
+    return jsonify({'success': True, 'at': at.isoformat(),
+                    'stock': [{'product_id': product_id, 'quantity': quantity}
+                              for product_id, quantity in sorted(stock.items())]})
+
 @app.route('/distributor/allocations')
 @login_required
 def distributor_allocations():
@@ -521,20 +1292,15 @@ def distributor_allocations():
 
 @app.route('/distributor/customer_orders')
 @login_required
+@statement_budget(0)   # streamed: rows keep arriving long after the first batch
 def distributor_customer_orders():
     if session.get('user_type') != 'distributor':
         return redirect(url_for('home'))
 
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-
-    # Get distributor ID
-    cursor.execute("SELECT distributor_id FROM distributor WHERE user_id = %s", (session['user_id'],))
-    distributor = cursor.fetchone()
-    distributor_id = distributor['distributor_id']
+    distributor_id = get_profile_id('distributor')
 
     # ✅ Retrieve customer orders for products that this distributor currently has in inventory
-    cursor.execute("""
+    orders = RowStream(get_db_connection, with_archive(f"""
         SELECT 
             co.order_id,
             co.order_date,
@@ -546,9 +1312,9 @@ def distributor_customer_orders():
             p.product_name,
             oi.quantity,
             oi.unit_price,
-            di.quantity_available AS dist_stock
-        FROM customer_order co
-        JOIN order_item oi ON co.order_id = oi.order_id
+            {live_quantity_sql('distributor', 'di')} AS dist_stock
+        FROM customer_order{{suffix}} co
+        JOIN order_item{{suffix}} oi ON co.order_id = oi.order_id
         JOIN product p ON oi.product_id = p.product_id
         JOIN customer c ON co.customer_id = c.customer_id
         JOIN distributor_inventory di 
@@ -556,15 +1322,181 @@ def distributor_customer_orders():
              AND di.distributor_id = oi.seller_id
         WHERE oi.seller_type = 'distributor' 
           AND oi.seller_id = %s
-        ORDER BY co.order_date DESC
-    """, (distributor_id,))
+    """) + "ORDER BY order_date DESC", (distributor_id, distributor_id))
 
-    orders = cursor.fetchall()
+    if wants_ndjson():
+        return ndjson_response(orders)
+    return stream_page('distributor_customer_orders.html', orders=orders)
 
-    cursor.close()
-    conn.close()
 
-    return render_template('distributor_customer_orders.html', orders=orders)
+DISTRIBUTOR_ORDERS_PAGE_SIZE = 20
+
+# Order date filters (first day of the current month without DATE_FORMAT's % codes)
+ORDER_DATE_RANGES = {
+    'today': "co.order_date >= CURDATE()",
+    'week': "co.order_date >= CURDATE() - INTERVAL 7 DAY",
+    'month': "co.order_date >= CURDATE() - INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY",
+    '3months': "co.order_date >= CURDATE() - INTERVAL 3 MONTH"
+}
+
+@app.route('/distributor_orders')
+@login_required
+def distributor_orders():
+    if session.get('user_type') != 'distributor':
+        return redirect(url_for('home'))
+
+    profile = get_profile('distributor')
+    if not profile:
+        return redirect(url_for('login'))
+    distributor_id = profile['id']
+
+    status = request.args.get('status', '')
+    payment_status = request.args.get('payment_status', '')
+    date_range = request.args.get('date_range', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+
+    filters = ["oi.seller_type = 'distributor'", "oi.seller_id = %s"]
+    params = [distributor_id]
+    if status:
+        filters.append("co.order_status = %s")
+        params.append(status)
+    if payment_status:
+        filters.append("co.payment_status = %s")
+        params.append(payment_status)
+    if date_range in ORDER_DATE_RANGES:
+        filters.append(ORDER_DATE_RANGES[date_range])
+    where = ' AND '.join(filters)
+
+    # Loaders run only when their fragment is not already cached
+    def load_orders():
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+
+        # Hot and archived orders; an order lives in exactly one of them
+        cursor.execute("SELECT SUM(total) AS total FROM (" + with_archive(f"""
+                           SELECT COUNT(DISTINCT co.order_id) AS total
+                           FROM customer_order{{suffix}} co
+                           JOIN order_item{{suffix}} oi ON co.order_id = oi.order_id
+                           WHERE {where}""") + ") counts", params * 2)
+        total = int(cursor.fetchone()['total'] or 0)
+
+        cursor.execute(with_archive(f"""
+            (SELECT co.order_id, co.order_date, co.total_amount, co.order_status, co.payment_status,
+                   CONCAT(c.first_name, ' ', c.last_name) AS customer_name,
+                   c.email AS customer_email,
+                   COUNT(oi.order_item_id) AS item_count,
+                   GROUP_CONCAT(CONCAT(p.product_name, ' x', oi.quantity)
+                                ORDER BY p.product_name SEPARATOR '\n') AS products,
+                   (SELECT s.shipment_status FROM shipment{{suffix}} s
+                    WHERE s.order_id = co.order_id ORDER BY s.shipment_date DESC LIMIT 1) AS shipment_status,
+                   (SELECT s.tracking_number FROM shipment{{suffix}} s
+                    WHERE s.order_id = co.order_id ORDER BY s.shipment_date DESC LIMIT 1) AS tracking_number
+            FROM customer_order{{suffix}} co
+            JOIN customer c ON co.customer_id = c.customer_id
+            JOIN order_item{{suffix}} oi ON co.order_id = oi.order_id
+            JOIN product p ON oi.product_id = p.product_id
+            WHERE {where}
+            GROUP BY co.order_id
+            ORDER BY co.order_date DESC
+            LIMIT %s)
+        """) + "ORDER BY order_date DESC LIMIT %s OFFSET %s",
+            (params + [page * DISTRIBUTOR_ORDERS_PAGE_SIZE]) * 2
+            + [DISTRIBUTOR_ORDERS_PAGE_SIZE, (page - 1) * DISTRIBUTOR_ORDERS_PAGE_SIZE])
+        orders = cursor.fetchall()
+
+        cursor.close()
+        conn.close()
+
+        for order in orders:
+            order['products'] = order['products'].split('\n') if order['products'] else []
+        return {'orders': orders,
+                'total_pages': (total + DISTRIBUTOR_ORDERS_PAGE_SIZE - 1) // DISTRIBUTOR_ORDERS_PAGE_SIZE}
+
+    def load_summary():
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+
+        cursor.execute("""
+            SELECT COUNT(DISTINCT x.order_id) AS total_orders,
+                   COALESCE(SUM(x.subtotal), 0) AS total_revenue,
+                   COUNT(DISTINCT CASE WHEN x.order_status IN ('pending', 'processing')
+                                       THEN x.order_id END) AS pending_shipments,
+                   COUNT(DISTINCT CASE WHEN x.order_status = 'delivered' THEN x.order_id END) AS completed_orders,
+                   COUNT(DISTINCT x.customer_id) AS unique_customers,
+                   COALESCE(SUM(CASE WHEN x.order_date >= CURDATE() - INTERVAL DAYOFMONTH(CURDATE()) - 1 DAY
+                                     THEN x.subtotal END), 0) AS monthly_revenue
+            FROM (""" + with_archive("""
+                SELECT co.order_id, co.order_status, co.customer_id, co.order_date, oi.subtotal
+                FROM customer_order{suffix} co
+                JOIN order_item{suffix} oi ON co.order_id = oi.order_id
+                WHERE oi.seller_type = 'distributor' AND oi.seller_id = %s""") + """
+            ) x
+        """, (distributor_id, distributor_id))
+        summary = cursor.fetchone()
+
+        cursor.execute("""
+            SELECT p.product_name
+            FROM (""" + with_archive("""
+                SELECT oi.product_id, oi.quantity FROM order_item{suffix} oi
+                WHERE oi.seller_type = 'distributor' AND oi.seller_id = %s""") + """
+            ) x
+            JOIN product p ON x.product_id = p.product_id
+            GROUP BY p.product_id
+            ORDER BY SUM(x.quantity) DESC
+            LIMIT 1
+        """, (distributor_id, distributor_id))
+        top = cursor.fetchone()
+
+        cursor.close()
+        conn.close()
+
+        summary['top_product'] = top['product_name'] if top else None
+        summary['avg_order_value'] = (summary['total_revenue'] / summary['total_orders']
+                                      if summary['total_orders'] else 0)
+        return summary
+
+    return render_template('distributor_orders.html',
+                         company_name=profile['company_name'],
+                         scope=distributor_scope(),
+                         load_orders=load_orders,
+                         load_summary=load_summary,
+                         status=status,
+                         payment_status=payment_status,
+                         date_range=date_range,
+                         current_page=page)
+
+@app.route('/distributor_analytics')
+@login_required
+def distributor_analytics():
+    if session.get('user_type') != 'distributor':
+        return redirect(url_for('home'))
+
+    profile = get_profile('distributor')
+    if not profile:
+        return redirect(url_for('login'))
+    distributor_id = profile['id']
+
+    period = request.args.get('period', 'week')
+    start_date = request.args.get('start_date', '')
+    end_date = request.args.get('end_date', '')
+
+    # Runs only when the analytics fragment is not already cached
+    def load_analytics():
+        conn = get_db_connection()
+        sales = sales_store.get(conn, 'distributor', distributor_id)
+        analytics = distributor_sales_analytics(conn, 'distributor', distributor_id,
+                                                {'period': period, 'start_date': start_date, 'end_date': end_date},
+                                                sales=sales)
+        conn.close()
+        return analytics
+
+    return render_template('distributor_analytics.html',
+                         company_name=profile['company_name'],
+                         scope=distributor_scope(),
+                         load_analytics=load_analytics,
+                         period=period,
+                         start_date=start_date,
+                         end_date=end_date)
 
 
 # ======================= CUSTOMER ROUTES =======================
@@ -585,10 +1517,12 @@ def customer_dashboard():
     customer_id = cust['customer_id']
     customer_name = f"{cust['first_name']} {cust['last_name']}"
     
-    # Order stats
+    # Order stats, hot and archived orders
     cursor.execute("""SELECT COUNT(*) as total_orders, COALESCE(SUM(total_amount), 0) as total_spent
-                      FROM customer_order
-                      WHERE customer_id = %s""", (customer_id,))
+                      FROM (""" + with_archive("""
+                          SELECT total_amount FROM customer_order{suffix}
+                          WHERE customer_id = %s""") + """
+                      ) x""", (customer_id, customer_id))
     stats = cursor.fetchone()
     
     cursor.close()
@@ -600,69 +1534,187 @@ def customer_dashboard():
                          total_orders=stats['total_orders'] or 0,
                          total_spent=stats['total_spent'] or 0)
 
+SEARCH_PAGE_SIZE = 20
+
 @app.route('/customer/browse_products')
 @login_required
+@statement_budget(db_guard_config['read_ms'])
+@conditional_get(scope_versions, catalog_scope, 'private, max-age=10, must-revalidate', catalog_source)
 def browse_products():
     if session.get('user_type') != 'customer':
         return redirect(url_for('home'))
     
     category = request.args.get('category', '')
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    snapshot = catalog_reader.get()
+    # Breaker tripped: answer from this worker's search index and the snapshot instead of waiting on MySQL
+    degraded = db_breaker.state != CLOSED and snapshot is not None
+
+    # Runs only when the product grid fragment is not already cached
+    def load_listing():
+        if query:
+            if degraded:
+                result = search_products_offline(snapshot, query, category, page, SEARCH_PAGE_SIZE)
+            else:
+                conn = get_db_connection()
+                result = search_products(conn, query, category, page, SEARCH_PAGE_SIZE)
+                conn.close()
+            return {'products': result['results'],
+                    'total_pages': (result['total'] + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE}
+
+        # Serve straight from the shared snapshot when the builder is running
+        if snapshot is not None:
+            return {'products': snapshot.rows(snapshot.select(category)), 'total_pages': 1}
+
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        
+        if category:
+            cursor.execute(f"""
+                SELECT 
+                    p.product_id,
+                    p.product_name,
+                    p.category,
+                    p.description,
+                    m.company_name,
+                    COALESCE(
+                        (SELECT MIN(di.unit_price)
+                        FROM distributor_inventory di
+                        WHERE di.product_id = p.product_id AND {live_quantity_sql('distributor', 'di')} > 0),
+                        p.unit_price
+                    ) AS display_price
+                FROM product p
+                JOIN manufacturer m ON p.manufacturer_id = m.manufacturer_id
+                WHERE p.category = %s
+                ORDER BY p.product_name
+            """, (category,))
+        else:
+            cursor.execute(f"""
+                SELECT 
+                    p.product_id,
+                    p.product_name,
+                    p.category,
+                    p.description,
+                    m.company_name,
+                    COALESCE(
+                        (SELECT MIN(di.unit_price)
+                        FROM distributor_inventory di
+                        WHERE di.product_id = p.product_id AND {live_quantity_sql('distributor', 'di')} > 0),
+                        p.unit_price
+                    ) AS display_price
+                FROM product p
+                JOIN manufacturer m ON p.manufacturer_id = m.manufacturer_id
+                ORDER BY p.product_name
+            """)
+        products = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        return {'products': products, 'total_pages': 1}
+
+    if snapshot is not None:
+        categories = snapshot.categories
+    else:
+        # Get categories (cached reference data)
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        categories = get_categories(cursor)
+        cursor.close()
+        conn.close()
     
-    conn = get_db_connection()
+    return render_template('customer_browse_products.html', 
+                         load_listing=load_listing,
+                         categories=categories, 
+                         selected_category=category,
+                         query=query,
+                         page=page,
+                         snapshot_generation=snapshot.generation if snapshot is not None else None)
+
+# Product cards for ranked search hits, in rank order
+def load_product_cards(cursor, product_ids):
+    if not product_ids:
+        return []
+
+    snapshot = catalog_reader.get()
+    if snapshot is not None:
+        indices = snapshot.index_of(product_ids)
+        if (indices >= 0).all():
+            return snapshot.rows(indices)
+
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    cursor.execute(f"""
+        SELECT 
+            p.product_id,
+            p.product_name,
+            p.category,
+            p.description,
+            m.company_name,
+            COALESCE(
+                (SELECT MIN(di.unit_price)
+                FROM distributor_inventory di
+                WHERE di.product_id = p.product_id AND {live_quantity_sql('distributor', 'di')} > 0),
+                p.unit_price
+            ) AS display_price
+        FROM product p
+        JOIN manufacturer m ON p.manufacturer_id = m.manufacturer_id
+        WHERE p.product_id IN ({placeholders})
+    """, tuple(product_ids))
+    by_id = {row['product_id']: row for row in cursor.fetchall()}
+    return [by_id[pid] for pid in product_ids if pid in by_id]
+
+def search_products(conn, query, category, page, per_page):
+    cursor = conn.cursor()
+    index = ensure_index(cursor)
+    cursor.close()
+
+    result = index.search(query, category=category or None, page=page, per_page=per_page)
+    scores = {hit['product_id']: hit['score'] for hit in result['results']}
+
     cursor = conn.cursor(dictionary=True)
-    
-    if category:
-        cursor.execute("""
-            SELECT 
-                p.product_id,
-                p.product_name,
-                p.category,
-                p.description,
-                m.company_name,
-                COALESCE(
-                    (SELECT MIN(di.unit_price)
-                    FROM distributor_inventory di
-                    WHERE di.product_id = p.product_id AND di.quantity_available > 0),
-                    p.unit_price
-                ) AS display_price
-            FROM product p
-            JOIN manufacturer m ON p.manufacturer_id = m.manufacturer_id
-            WHERE p.category = %s
-            ORDER BY p.product_name
-        """, (category,))
-    else:
-        cursor.execute("""
-            SELECT 
-                p.product_id,
-                p.product_name,
-                p.category,
-                p.description,
-                m.company_name,
-                COALESCE(
-                    (SELECT MIN(di.unit_price)
-                    FROM distributor_inventory di
-                    WHERE di.product_id = p.product_id AND di.quantity_available > 0),
-                    p.unit_price
-                ) AS display_price
-            FROM product p
-            JOIN manufacturer m ON p.manufacturer_id = m.manufacturer_id
-            ORDER BY p.product_name
-        """)
+    cards = load_product_cards(cursor, list(scores))
+    cursor.close()
+    for card in cards:
+        card['score'] = scores[card['product_id']]
+    result['results'] = cards
+    return result
 
-    
-    products = cursor.fetchall()
-    
-    # Get categories
-    cursor.execute("SELECT DISTINCT category FROM product ORDER BY category")
-    categories = [row['category'] for row in cursor.fetchall()]
-    
+# Search without the database: the index as last loaded, cards from the snapshot
+def search_products_offline(snapshot, query, category, page, per_page):
+    if not product_search_index.loaded:
+        raise DatabaseUnavailable(msg='Search index not loaded and the database is unavailable')
+    result = product_search_index.search(query, category=category or None, page=page, per_page=per_page)
+    indices = snapshot.index_of([hit['product_id'] for hit in result['results']])
+    result['results'] = snapshot.rows([index for index in indices if index >= 0])
+    return result
+
+@app.route('/customer/search')
+@login_required
+@statement_budget(db_guard_config['read_ms'])
+def search():
+    query = request.args.get('q', '').strip()
+    category = request.args.get('category', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', SEARCH_PAGE_SIZE, type=int), 1), 100)
+
+    conn = get_db_connection()
+    result = search_products(conn, query, category, page, per_page)
+    conn.close()
+
+    return jsonify({'success': True, 'query': query, **result})
+
+@app.route('/customer/autocomplete')
+@login_required
+@statement_budget(db_guard_config['read_ms'])
+def autocomplete():
+    prefix = request.args.get('q', '')
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    suggestions = ensure_index(cursor).autocomplete(prefix)
     cursor.close()
     conn.close()
-    
-    return render_template('customer_browse_products.html', 
-                         products=products, 
-                         categories=categories, 
-                         selected_category=category)
+
+    return jsonify({'success': True, **suggestions})
 
 @app.route('/customer/place_order', methods=['POST'])
 @login_required
@@ -688,11 +1740,13 @@ def place_order():
         cursor.execute("SELECT customer_id FROM customer WHERE user_id = %s", (session['user_id'],))
         customer_id = cursor.fetchone()['customer_id']
         
-        # Check distributor inventory first
-        cursor.execute("""SELECT di.distributor_id, di.unit_price, di.quantity_available
-                          FROM distributor_inventory di
-                          WHERE di.product_id = %s AND di.quantity_available >= %s
-                          LIMIT 1""", (product_id, quantity))
+        # Check distributor inventory first (hot products count their stock slots)
+        cursor.execute(f"""SELECT di.distributor_id, di.unit_price, di.stock_slots,
+                                  {live_quantity_sql('distributor', 'di')} AS quantity_available
+                           FROM distributor_inventory di
+                           WHERE di.product_id = %s
+                           HAVING quantity_available >= %s
+                           LIMIT 1""", (product_id, quantity))
         
         dist_inv = cursor.fetchone()
         
@@ -700,13 +1754,16 @@ def place_order():
             seller_type = 'distributor'
             seller_id = dist_inv['distributor_id']
             unit_price = dist_inv['unit_price']
+            stock_slots = dist_inv['stock_slots']
         else:
             # Try manufacturer
-            cursor.execute("""SELECT i.manufacturer_id, p.unit_price, i.quantity_available
-                              FROM inventory i
-                              JOIN product p ON i.product_id = p.product_id
-                              WHERE i.product_id = %s AND i.quantity_available >= %s
-                              LIMIT 1""", (product_id, quantity))
+            cursor.execute(f"""SELECT i.manufacturer_id, p.unit_price, i.stock_slots,
+                                      {live_quantity_sql('manufacturer', 'i')} AS quantity_available
+                               FROM inventory i
+                               JOIN product p ON i.product_id = p.product_id
+                               WHERE i.product_id = %s
+                               HAVING quantity_available >= %s
+                               LIMIT 1""", (product_id, quantity))
             
             mfg_inv = cursor.fetchone()
             
@@ -716,6 +1773,15 @@ def place_order():
             seller_type = 'manufacturer'
             seller_id = mfg_inv['manufacturer_id']
             unit_price = mfg_inv['unit_price']
+            stock_slots = mfg_inv['stock_slots']
+        
+        # Take the stock first: the order is only created if the units could be claimed
+        conn.start_transaction()
+        if not take_stock(conn, seller_type, seller_id, product_id, quantity, stock_slots):
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            return jsonify({'success': False, 'message': 'Product not available'})
         
         # Create order
         total_amount = quantity * unit_price
@@ -732,18 +1798,10 @@ def place_order():
                          (order_id, product_id, seller_type, seller_id, quantity, unit_price)
                          VALUES (%s, %s, %s, %s, %s, %s)""",
                      (order_id, product_id, seller_type, seller_id, quantity, unit_price))
-        
-        # Update inventory
-        if seller_type == 'distributor':
-            cursor.execute("""UPDATE distributor_inventory 
-                             SET quantity_available = quantity_available - %s 
-                             WHERE distributor_id = %s AND product_id = %s""",
-                         (quantity, seller_id, product_id))
-        else:
-            cursor.execute("""UPDATE inventory 
-                             SET quantity_available = quantity_available - %s 
-                             WHERE manufacturer_id = %s AND product_id = %s""",
-                         (quantity, seller_id, product_id))
+        record_movements(cursor, [(seller_type, seller_id, product_id, 'sale', -quantity, order_id)])
+        stage_event(cursor, ORDER_CREATED, order_id,
+                    {'product_id': product_id, 'seller_type': seller_type, 'seller_id': seller_id,
+                     'quantity': quantity, 'amount': total_amount})
         
         conn.commit()
         cursor.close()
@@ -770,6 +1828,7 @@ def place_order():
 
 @app.route('/customer/orders')
 @login_required
+@statement_budget(db_guard_config['read_ms'])
 def customer_orders():
     if session.get('user_type') != 'customer':
         return redirect(url_for('home'))
@@ -781,10 +1840,13 @@ def customer_orders():
     cursor.execute("SELECT customer_id FROM customer WHERE user_id = %s", (session['user_id'],))
     customer_id = cursor.fetchone()['customer_id']
     
-    # Get orders
-    cursor.execute("""SELECT * FROM customer_order 
+    # Get orders (recent ones, then closed orders moved to the archive)
+    cursor.execute("""SELECT *, FALSE AS archived FROM customer_order
                       WHERE customer_id = %s
-                      ORDER BY order_date DESC""", (customer_id,))
+                      UNION ALL
+                      SELECT *, TRUE AS archived FROM customer_order_archive
+                      WHERE customer_id = %s
+                      ORDER BY order_date DESC""", (customer_id, customer_id))
     orders = cursor.fetchall()
     
     cursor.close()
@@ -794,6 +1856,7 @@ def customer_orders():
 
 @app.route('/customer/order_details/<int:order_id>')
 @login_required
+@statement_budget(db_guard_config['read_ms'])
 def order_details(order_id):
     if session.get('user_type') != 'customer':
         return redirect(url_for('home'))
@@ -805,10 +1868,13 @@ def order_details(order_id):
     cursor.execute("SELECT customer_id FROM customer WHERE user_id = %s", (session['user_id'],))
     customer_id = cursor.fetchone()['customer_id']
     
-    # Get order
-    cursor.execute("""SELECT * FROM customer_order 
-                      WHERE order_id = %s AND customer_id = %s""", (order_id, customer_id))
-    order = cursor.fetchone()
+    # Get order, from the archive tables once it has been archived
+    for suffix in ('', ARCHIVE_SUFFIX):
+        cursor.execute(f"""SELECT * FROM customer_order{suffix}
+                           WHERE order_id = %s AND customer_id = %s""", (order_id, customer_id))
+        order = cursor.fetchone()
+        if order:
+            break
     
     if not order:
         cursor.close()
@@ -816,14 +1882,14 @@ def order_details(order_id):
         return redirect(url_for('customer_orders'))
     
     # Get order items
-    cursor.execute("""SELECT oi.*, p.product_name, p.category
-                      FROM order_item oi
-                      JOIN product p ON oi.product_id = p.product_id
-                      WHERE oi.order_id = %s""", (order_id,))
+    cursor.execute(f"""SELECT oi.*, p.product_name, p.category
+                       FROM order_item{suffix} oi
+                       JOIN product p ON oi.product_id = p.product_id
+                       WHERE oi.order_id = %s""", (order_id,))
     items = cursor.fetchall()
     
     # Get shipment
-    cursor.execute("""SELECT * FROM shipment WHERE order_id = %s""", (order_id,))
+    cursor.execute(f"""SELECT * FROM shipment{suffix} WHERE order_id = %s""", (order_id,))
     shipment = cursor.fetchone()
     
     cursor.close()
@@ -858,6 +1924,7 @@ def process_payment(order_id):
         # Create payment record
         transaction_id = f"TXN-{order_id}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
         
+        conn.start_transaction()
         cursor.execute("""INSERT INTO payment 
                          (order_id, payment_method, amount, payment_status, transaction_id)
                          VALUES (%s, %s, %s, 'success', %s)""",
@@ -875,6 +1942,9 @@ def process_payment(order_id):
                          (order_id, estimated_delivery_date, tracking_number, carrier, shipment_status)
                          VALUES (%s, DATE_ADD(NOW(), INTERVAL 7 DAY), %s, 'Standard Carrier', 'preparing')""",
                      (order_id, tracking_number))
+        cursor.execute("SELECT DISTINCT seller_type, seller_id FROM order_item WHERE order_id = %s", (order_id,))
+        sellers = [[row['seller_type'], row['seller_id']] for row in cursor.fetchall()]
+        stage_event(cursor, PAYMENT_RECEIVED, order_id, {'amount': order['total_amount'], 'sellers': sellers})
         
         conn.commit()
         cursor.close()
@@ -887,5 +1957,108 @@ def process_payment(order_id):
         conn.close()
         return jsonify({'success': False, 'message': str(e)})
 
+# ======================= REPORT ROUTES =======================
+
+@app.route('/reports/<report_type>', methods=['POST'])
+@login_required
+def submit_report(report_type):
+    role = session.get('user_type')
+    if report_type not in REPORTS or role not in REPORTS[report_type][1]:
+        return jsonify({'success': False, 'message': 'Unknown report.'}), 404
+
+    owner_id = get_profile_id(role)
+    if owner_id is None:
+        return jsonify({'success': False, 'message': 'Profile not found.'}), 404
+
+    params = request.get_json(silent=True) or request.form.to_dict()
+    conn = get_db_connection()
+    try:
+        purge_expired_reports(conn)
+        job_id = report_runner.submit(conn, session['user_id'], report_type, role, owner_id, params)
+    except ReportLimitExceeded as e:
+        return jsonify({'success': False, 'message': str(e)}), 429
+    except mysql.connector.Error as err:
+        return jsonify({'success': False, 'message': str(err)}), 500
+    finally:
+        conn.close()
+
+    return jsonify({'success': True,
+                    'job_id': job_id,
+                    'status_url': url_for('report_status', job_id=job_id)}), 202
+
+@app.route('/reports/jobs')
+@login_required
+def report_jobs():
+    conn = get_db_connection()
+    jobs = report_runner.list_jobs(conn, session['user_id'])
+    conn.close()
+    return jsonify({'jobs': jobs})
+
+@app.route('/reports/jobs/<job_id>')
+@login_required
+def report_status(job_id):
+    conn = get_db_connection()
+    job = report_runner.get(conn, job_id, session['user_id'])
+    conn.close()
+    if job is None:
+        return jsonify({'success': False, 'message': 'Report job not found.'}), 404
+    if job['status'] == 'done' and not job['expired']:
+        job['result_url'] = url_for('report_result', job_id=job_id)
+    return jsonify(job)
+
+@app.route('/reports/jobs/<job_id>/result')
+@login_required
+def report_result(job_id):
+    conn = get_db_connection()
+    job = report_runner.get(conn, job_id, session['user_id'], with_result=True)
+    conn.close()
+    if job is None:
+        return jsonify({'success': False, 'message': 'Report job not found.'}), 404
+    if job['expired']:
+        return jsonify({'success': False, 'message': 'Report result has expired.'}), 410
+    if job['status'] != 'done':
+        return jsonify({'success': False, 'status': job['status'], 'message': job['error']}), 409
+    # Stored as JSON already; send it without re-parsing
+    return app.response_class(job['result'], mimetype='application/json')
+
+# ======================= EXPORT ROUTES =======================
+
+@app.route('/export/<dataset>.<fmt>')
+@login_required
+@statement_budget(0)
+def export_data(dataset, fmt):
+    role = session.get('user_type')
+    if dataset not in EXPORTS or role not in EXPORTS[dataset]['owners']:
+        return jsonify({'success': False, 'message': 'Unknown export.'}), 404
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': f'Unsupported export format: {fmt}'}), 400
+    if fmt != 'csv' and not ARROW_AVAILABLE:
+        return jsonify({'success': False, 'message': 'Parquet and Arrow exports need pyarrow installed.'}), 501
+
+    owner_id = get_profile_id(role)
+    if owner_id is None:
+        return jsonify({'success': False, 'message': 'Profile not found.'}), 404
+
+    filename = f"{dataset}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    response = app.response_class(
+        stream_with_context(export_stream(get_db_connection, dataset, role, owner_id, fmt)),
+        mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+# ======================= CACHE ROUTES =======================
+
+@app.route('/cache/stats')
+def cache_stats():
+    token = monitoring_config['stats_token']
+    if not token or not hmac.compare_digest(request.headers.get('X-Stats-Token', ''), token):
+        return jsonify({'success': False, 'message': 'Not found.'}), 404
+    return jsonify({'reference_data': reference_cache.stats(),
+                    'fragments': fragment_cache.stats(),
+                    'sales_columns': sales_store.stats(),
+                    'audit_log': audit_logger.stats(),
+                    'invalidation_bus': invalidation_bus.stats(),
+                    'db_breaker': db_breaker.stats()})
+
 if __name__ == '__main__':
     app.run(debug=True, host='localhost', port=5000)
@@ -0,0 +1,182 @@
+# audit_log.py - Write-behind audit log: buffered in memory, flushed in multi-row inserts
+#
+# The audit_log table is partitioned by month; run the retention job daily:
+#   python audit_log.py                      # add upcoming partitions, drop expired ones
+#   python audit_log.py --retain-months 6
+
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+
+import mysql.connector
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_FLUSH_INTERVAL = 2.0
+DEFAULT_MAX_BUFFERED = 50000
+DEFAULT_RETAIN_MONTHS = 12
+PARTITIONS_AHEAD = 3
+
+
+class AuditLogger:
+    def __init__(self, connect, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_buffered=DEFAULT_MAX_BUFFERED):
+        self._connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = deque(maxlen=max_buffered)   # oldest events drop first if the DB is down for long
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._conn = None
+        self._started_pid = None
+        self._closed = False
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+
+    def log(self, table_name, operation, user_id=None, old_value=None, new_value=None):
+        # Never touches the DB on the caller's thread
+        self._ensure_started()
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+            self._buffer.append((table_name, operation, user_id, old_value, new_value, datetime.now()))
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def _ensure_started(self):
+        # Once per process, so a pre-fork import still gets a flusher in every worker
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self._conn = None
+            threading.Thread(target=self._run, name='audit-log-flusher', daemon=True).start()
+            atexit.register(self.close)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                if not batch:
+                    return
+                try:
+                    self._write(batch)
+                except mysql.connector.Error as err:
+                    print(f"Audit log flush failed, will retry: {err}")
+                    self.failed_flushes += 1
+                    self._conn = None
+                    with self._lock:
+                        # Put the batch back in front, in order, for the next attempt
+                        self._buffer.extendleft(reversed(batch))
+                    return
+
+    def _write(self, batch):
+        if self._conn is None or not self._conn.is_connected():
+            self._conn = self._connect()
+            if self._conn is None:
+                raise mysql.connector.InterfaceError('no database connection')
+        cursor = self._conn.cursor()
+        try:
+            # executemany turns this into a single multi-row INSERT
+            cursor.executemany("""INSERT INTO audit_log
+                                  (table_name, operation, user_id, old_value, new_value, timestamp)
+                                  VALUES (%s, %s, %s, %s, %s, %s)""", batch)
+            self._conn.commit()
+            self.written += len(batch)
+        finally:
+            cursor.close()
+
+    def close(self):
+        # Final flush on shutdown
+        self._closed = True
+        self._wake.set()
+        self.flush()
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except mysql.connector.Error:
+                pass
+            self._conn = None
+
+    def stats(self):
+        with self._lock:
+            buffered = len(self._buffer)
+        return {
+            'buffered': buffered,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed_flushes': self.failed_flushes,
+        }
+
+
+# ======================= RETENTION =======================
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def maintain_partitions(conn, retain_months=DEFAULT_RETAIN_MONTHS, ahead=PARTITIONS_AHEAD, today=None):
+    # Monthly partitions are named pYYYYMM and hold rows before the 1st of the next month
+    this_month = (today or date.today()).replace(day=1)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""SELECT partition_name FROM information_schema.partitions
+                          WHERE table_schema = DATABASE() AND table_name = 'audit_log'
+                            AND partition_name IS NOT NULL""")
+        existing = {row[0] for row in cursor.fetchall()}
+
+        added = []
+        new_partitions = []
+        for offset in range(ahead + 1):
+            month = _add_months(this_month, offset)
+            name = f'p{month:%Y%m}'
+            if name not in existing:
+                upper = _add_months(month, 1)
+                new_partitions.append(f"PARTITION {name} VALUES LESS THAN (UNIX_TIMESTAMP('{upper:%Y-%m-%d}'))")
+                added.append(name)
+        if new_partitions:
+            cursor.execute(f"""ALTER TABLE audit_log REORGANIZE PARTITION pmax INTO (
+                                   {', '.join(new_partitions)},
+                                   PARTITION pmax VALUES LESS THAN MAXVALUE)""")
+
+        # Dropping a partition is a metadata operation, unlike DELETE ... WHERE timestamp < cutoff
+        cutoff = f'p{_add_months(this_month, -retain_months):%Y%m}'
+        expired = sorted(name for name in existing
+                         if name.startswith('p') and name[1:].isdigit() and name < cutoff)
+        if expired:
+            cursor.execute(f"ALTER TABLE audit_log DROP PARTITION {', '.join(expired)}")
+        return added, expired
+    finally:
+        cursor.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from app import get_db_connection
+
+    parser = argparse.ArgumentParser(description='Audit log partition maintenance')
+    parser.add_argument('--retain-months', type=int, default=DEFAULT_RETAIN_MONTHS)
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    started = time.monotonic()
+    added, dropped = maintain_partitions(conn, args.retain_months)
+    conn.close()
+    print(f"Added partitions: {', '.join(added) or 'none'}; dropped: {', '.join(dropped) or 'none'} "
+          f"({time.monotonic() - started:.2f}s)")
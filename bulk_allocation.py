@@ -0,0 +1,302 @@
+# bulk_allocation.py - Bulk manufacturer -> distributor allocations (JSON / CSV)
+
+import csv
+import io
+from decimal import Decimal
+
+import mysql.connector
+
+from inventory_ledger import record_movements
+from outbox import STOCK_ALLOCATED, stage_event
+from stock_shards import live_quantity_sql, lock_slot_totals, set_slot_total
+
+CHUNK_SIZE = 500
+LOOKUP_BATCH = 1000
+MAX_LINES = 50000
+DISTRIBUTOR_MARKUP = Decimal('1.10')
+
+
+# Same 10% markup the single-line allocate form applies
+def distributor_price(manufacturer_unit_price):
+    return (Decimal(manufacturer_unit_price) * DISTRIBUTOR_MARKUP).quantize(Decimal('0.01'))
+
+
+def _batches(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _placeholders(count):
+    return ', '.join(['%s'] * count)
+
+
+# ======================= PARSING =======================
+
+def parse_json_lines(payload):
+    rows = payload.get('allocations') if isinstance(payload, dict) else payload
+    if not isinstance(rows, list):
+        raise ValueError("Expected a list of allocations or {\"allocations\": [...]}")
+    if len(rows) > MAX_LINES:
+        raise ValueError(f"Too many lines: {len(rows)} (max {MAX_LINES})")
+
+    lines = []
+    for index, row in enumerate(rows, start=1):
+        row = row if isinstance(row, dict) else {}
+        lines.append({
+            'line': index,
+            'distributor_id': row.get('distributor_id'),
+            'product_id': row.get('product_id'),
+            'quantity': row.get('quantity'),
+        })
+    return lines
+
+
+def parse_csv_lines(file_storage):
+    stream = io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(stream)
+    required = {'distributor_id', 'product_id', 'quantity'}
+    if not reader.fieldnames or not required.issubset({f.strip() for f in reader.fieldnames}):
+        raise ValueError("CSV header must contain distributor_id, product_id and quantity")
+
+    lines = []
+    # Line numbers match the file (header is line 1)
+    for row in reader:
+        # Fields past the header land under a None key as a list; they are ignored
+        row = {k.strip(): (v or '').strip() for k, v in row.items() if k}
+        lines.append({
+            'line': reader.line_num,
+            'distributor_id': row.get('distributor_id'),
+            'product_id': row.get('product_id'),
+            'quantity': row.get('quantity'),
+        })
+        if len(lines) > MAX_LINES:
+            raise ValueError(f"Too many lines (max {MAX_LINES})")
+    return lines
+
+
+# ======================= VALIDATION =======================
+
+def _coerce(line):
+    try:
+        line['distributor_id'] = int(line['distributor_id'])
+        line['product_id'] = int(line['product_id'])
+        line['quantity'] = int(line['quantity'])
+    except (TypeError, ValueError):
+        return 'distributor_id, product_id and quantity must be integers'
+    if line['quantity'] <= 0:
+        return 'Quantity must be greater than zero'
+    return None
+
+
+def load_inventory_snapshot(cursor, manufacturer_id, product_ids):
+    # Plain reads: the file is validated without holding locks, and each chunk
+    # re-reads its rows under FOR UPDATE before it writes anything
+    snapshot = {}
+    for batch in _batches(product_ids, LOOKUP_BATCH):
+        cursor.execute(f"""
+            SELECT i.product_id, {live_quantity_sql('manufacturer', 'i')}, p.manufacturing_cost, p.unit_price
+            FROM inventory i
+            JOIN product p ON i.product_id = p.product_id
+            WHERE i.manufacturer_id = %s AND i.product_id IN ({_placeholders(len(batch))})
+        """, (manufacturer_id, *batch))
+        for product_id, quantity_available, manufacturing_cost, unit_price in cursor.fetchall():
+            snapshot[product_id] = {
+                'quantity_available': quantity_available,
+                'cost_price': manufacturing_cost,
+                'unit_price': unit_price,
+            }
+    return snapshot
+
+
+def load_distributor_ids(cursor, distributor_ids):
+    found = set()
+    for batch in _batches(distributor_ids, LOOKUP_BATCH):
+        cursor.execute(f"SELECT distributor_id FROM distributor WHERE distributor_id IN ({_placeholders(len(batch))})",
+                       tuple(batch))
+        found.update(row[0] for row in cursor.fetchall())
+    return found
+
+
+def validate_lines(conn, manufacturer_id, lines):
+    for line in lines:
+        error = _coerce(line)
+        line['status'] = 'error' if error else 'valid'
+        line['message'] = error
+
+    candidates = [line for line in lines if line['status'] == 'valid']
+    product_ids = sorted({line['product_id'] for line in candidates})
+    distributor_ids = sorted({line['distributor_id'] for line in candidates})
+
+    cursor = conn.cursor()
+    try:
+        snapshot = load_inventory_snapshot(cursor, manufacturer_id, product_ids)
+        known_distributors = load_distributor_ids(cursor, distributor_ids)
+    finally:
+        cursor.close()
+
+    # Lines are checked in file order against the running remaining stock. This is a
+    # pre-check only; _apply_chunk repeats it on locked rows
+    remaining = {pid: row['quantity_available'] for pid, row in snapshot.items()}
+    for line in candidates:
+        inv_row = snapshot.get(line['product_id'])
+        if line['distributor_id'] not in known_distributors:
+            line['status'], line['message'] = 'error', 'Distributor not found'
+        elif not inv_row:
+            line['status'], line['message'] = 'error', 'Inventory record not found for this product'
+        elif inv_row['cost_price'] is None:
+            line['status'], line['message'] = 'error', 'Product has no manufacturing cost'
+        elif remaining[line['product_id']] < line['quantity']:
+            line['status'] = 'error'
+            line['message'] = f"Insufficient stock! Only {remaining[line['product_id']]} units left for this file."
+        else:
+            remaining[line['product_id']] -= line['quantity']
+
+    return snapshot
+
+
+# ======================= APPLY =======================
+
+def _apply_chunk(conn, cursor, manufacturer_id, chunk, snapshot):
+    demand = {}
+    for line in chunk:
+        demand[line['product_id']] = demand.get(line['product_id'], 0) + line['quantity']
+
+    conn.start_transaction()
+
+    # Lock this chunk's rows and re-read them; the locks are held until the commit below,
+    # so stock drained or prices changed since validation are caught here
+    product_ids = sorted(demand)
+    cursor.execute(f"""
+        SELECT i.product_id, i.quantity_available, i.stock_slots, p.manufacturing_cost, p.unit_price
+        FROM inventory i
+        JOIN product p ON i.product_id = p.product_id
+        WHERE i.manufacturer_id = %s AND i.product_id IN ({_placeholders(len(product_ids))})
+        FOR UPDATE OF i
+    """, (manufacturer_id, *product_ids))
+    current = {}
+    for product_id, quantity_available, stock_slots, manufacturing_cost, unit_price in cursor.fetchall():
+        current[product_id] = {
+            'quantity_available': quantity_available,
+            'stock_slots': stock_slots,
+            'cost_price': manufacturing_cost,
+            'unit_price': unit_price,
+        }
+    # Orders claim from a sharded product's slots without touching the parent row, whose
+    # quantity is only a mirror: lock the slots as well and count them
+    shards = lock_slot_totals(cursor, 'manufacturer', manufacturer_id,
+                              [pid for pid, row in current.items() if row['stock_slots']])
+    for pid, (slot_ids, total) in shards.items():
+        current[pid]['quantity_available'] = total
+    short = {pid for pid, qty in demand.items()
+             if pid not in current or current[pid]['cost_price'] is None
+             or current[pid]['quantity_available'] < qty}
+    snapshot.update(current)
+
+    accepted = []
+    for line in chunk:
+        if line['product_id'] in short:
+            line['status'], line['message'] = 'error', 'Stock changed since validation'
+        else:
+            accepted.append(line)
+
+    if not accepted:
+        conn.rollback()
+        return
+
+    allocation_rows = []
+    inventory_rows = {}
+    dist_rows = {}
+    for line in accepted:
+        inv_row = snapshot[line['product_id']]
+        price = distributor_price(inv_row['unit_price'])
+        line['unit_price'] = price
+        allocation_rows.append((manufacturer_id, line['distributor_id'], line['product_id'], line['quantity'], price))
+        inventory_rows[line['product_id']] = inventory_rows.get(line['product_id'], 0) + line['quantity']
+        key = (line['distributor_id'], line['product_id'])
+        qty = dist_rows[key][2] + line['quantity'] if key in dist_rows else line['quantity']
+        dist_rows[key] = (line['distributor_id'], line['product_id'], qty, Decimal(inv_row['cost_price']), price)
+
+    cursor.executemany("""
+        INSERT INTO allocation
+            (manufacturer_id, distributor_id, product_id, allocated_quantity, unit_price, status)
+        VALUES (%s, %s, %s, %s, %s, 'completed')
+    """, allocation_rows)
+    # executemany sends one multi-row INSERT, whose auto-increment ids are consecutive from lastrowid
+    first_allocation_id = cursor.lastrowid
+
+    cursor.executemany("""
+        UPDATE inventory
+        SET quantity_available = quantity_available - %s
+        WHERE product_id = %s AND manufacturer_id = %s AND stock_slots = 0
+    """, [(qty, pid, manufacturer_id) for pid, qty in inventory_rows.items() if pid not in shards])
+    for pid, (slot_ids, total) in shards.items():
+        if pid in inventory_rows:
+            set_slot_total(cursor, 'manufacturer', manufacturer_id, pid, slot_ids, total - inventory_rows[pid])
+
+    values = list(dist_rows.values())
+    cursor.execute(f"""
+        INSERT INTO distributor_inventory (distributor_id, product_id, quantity_available, cost_price, unit_price)
+        VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(values))} AS new
+        ON DUPLICATE KEY UPDATE
+            quantity_available = distributor_inventory.quantity_available + new.quantity_available,
+            cost_price = new.cost_price
+    """, [field for row in values for field in row])
+
+    movements = []
+    for offset, (_, distributor_id, product_id, quantity, _) in enumerate(allocation_rows):
+        allocation_id = first_allocation_id + offset
+        movements.append(('manufacturer', manufacturer_id, product_id, 'allocation_out', -quantity, allocation_id))
+        movements.append(('distributor', distributor_id, product_id, 'allocation_in', quantity, allocation_id))
+    record_movements(cursor, movements)
+    stage_event(cursor, STOCK_ALLOCATED, manufacturer_id,
+                {'distributor_ids': sorted({line['distributor_id'] for line in accepted})})
+
+    conn.commit()
+    for line in accepted:
+        line['status'], line['message'] = 'allocated', None
+
+
+def apply_lines(conn, manufacturer_id, lines, snapshot, chunk_size=CHUNK_SIZE):
+    valid = [line for line in lines if line['status'] == 'valid']
+    cursor = conn.cursor()
+    try:
+        for chunk in _batches(valid, chunk_size):
+            try:
+                _apply_chunk(conn, cursor, manufacturer_id, chunk, snapshot)
+            except mysql.connector.Error as err:
+                conn.rollback()
+                for line in chunk:
+                    line['status'], line['message'] = 'error', f'Chunk rolled back: {err.msg}'
+    finally:
+        cursor.close()
+
+
+def build_report(lines):
+    allocated = [line for line in lines if line['status'] == 'allocated']
+    results = []
+    for line in lines:
+        results.append({
+            'line': line['line'],
+            'distributor_id': line['distributor_id'],
+            'product_id': line['product_id'],
+            'quantity': line['quantity'],
+            'status': line['status'],
+            'unit_price': str(line['unit_price']) if line.get('unit_price') is not None else None,
+            'message': line['message'],
+        })
+    return {
+        'summary': {
+            'total_lines': len(lines),
+            'allocated': len(allocated),
+            'failed': len(lines) - len(allocated),
+            'units_allocated': sum(line['quantity'] for line in allocated),
+        },
+        'results': results,
+    }
+
+
+def run_bulk_allocation(conn, manufacturer_id, lines, chunk_size=CHUNK_SIZE):
+    snapshot = validate_lines(conn, manufacturer_id, lines)
+    apply_lines(conn, manufacturer_id, lines, snapshot, chunk_size)
+    return build_report(lines)
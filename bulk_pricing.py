@@ -0,0 +1,266 @@
+# bulk_pricing.py - Set-based distributor repricing with price_change_history
+
+from decimal import ROUND_DOWN, Decimal, InvalidOperation
+
+from outbox import PRICES_UPDATED, stage_event
+
+MAX_LINES = 10000
+# Retail price must stay at least 10% above cost (same floor as the pricing page)
+MIN_MARKUP = Decimal('1.10')
+# markup_percent and the history columns are DECIMAL(5, 2)
+MAX_MARKUP_PERCENT = Decimal('999.99')
+CENT = Decimal('0.01')
+
+RULE_BASES = ('cost_price', 'unit_price')
+
+
+def _money(value):
+    return Decimal(value).quantize(CENT)
+
+
+def price_floor(cost_price):
+    return _money(Decimal(cost_price) * MIN_MARKUP)
+
+
+def price_ceiling(cost_price):
+    # Highest price whose markup still fits markup_percent
+    return (Decimal(cost_price) * (1 + MAX_MARKUP_PERCENT / 100)).quantize(CENT, rounding=ROUND_DOWN)
+
+
+def _markup(cost_price, price):
+    # None without a cost; clamped so an old out-of-range row cannot break the history insert
+    if not cost_price:
+        return None
+    markup = ((Decimal(price) - cost_price) / cost_price * 100).quantize(CENT)
+    return max(min(markup, MAX_MARKUP_PERCENT), -MAX_MARKUP_PERCENT)
+
+
+def _decimal(value, field):
+    try:
+        return Decimal(str(value))
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError(f'{field} must be a number')
+
+
+# ======================= PARSING =======================
+
+def parse_price_lines(rows):
+    # [{"dist_inventory_id": 1, "new_price": "12.50"}, ...]
+    if not isinstance(rows, list):
+        raise ValueError('prices must be a list of {dist_inventory_id, new_price}')
+    if len(rows) > MAX_LINES:
+        raise ValueError(f"Too many lines: {len(rows)} (max {MAX_LINES})")
+    lines = []
+    for index, row in enumerate(rows, start=1):
+        row = row if isinstance(row, dict) else {}
+        try:
+            dist_inventory_id = int(row.get('dist_inventory_id'))
+        except (TypeError, ValueError):
+            raise ValueError(f'Line {index}: dist_inventory_id must be an integer')
+        new_price = _decimal(row.get('new_price'), f'Line {index}: new_price')
+        if new_price <= 0:
+            raise ValueError(f'Line {index}: new_price must be greater than zero')
+        # Optional: the price_version the editor saw; a newer price is a conflict
+        price_version = row.get('price_version')
+        if price_version not in (None, ''):
+            try:
+                price_version = int(price_version)
+            except (TypeError, ValueError):
+                raise ValueError(f'Line {index}: price_version must be an integer')
+        else:
+            price_version = None
+        lines.append({'dist_inventory_id': dist_inventory_id, 'new_price': _money(new_price),
+                      'price_version': price_version})
+    return lines
+
+
+def parse_rule(rule):
+    # {"category": "Footwear", "base": "cost_price", "multiplier": 1.25, "amount": 0}
+    # new price = base * multiplier + amount; percent is shorthand for multiplier = 1 + percent / 100
+    if not isinstance(rule, dict):
+        raise ValueError('rule must be an object')
+    base = rule.get('base', 'unit_price')
+    if base not in RULE_BASES:
+        raise ValueError(f"base must be one of {', '.join(RULE_BASES)}")
+    if rule.get('percent') is not None:
+        multiplier = 1 + _decimal(rule['percent'], 'percent') / 100
+    else:
+        multiplier = _decimal(rule.get('multiplier', 1), 'multiplier')
+    amount = _decimal(rule.get('amount', 0), 'amount')
+    if multiplier <= 0:
+        raise ValueError('multiplier must be greater than zero')
+    return {'category': rule.get('category') or None, 'base': base, 'multiplier': multiplier, 'amount': amount}
+
+
+def parse_pricing_form(form):
+    # The pricing page's bulk form: percentage or fixed change to the current retail price
+    value = _decimal(form.get('update_value'), 'Value')
+    rule = {'category': form.get('category_filter'), 'base': 'unit_price'}
+    if form.get('markup_type') == 'fixed':
+        rule['amount'] = value
+    else:
+        rule['percent'] = value
+    return parse_rule(rule)
+
+
+def parse_price_form(form):
+    # Checked "apply" boxes, each with new_price_<id> / price_version_<id> fields
+    return parse_price_lines([{'dist_inventory_id': dist_inventory_id,
+                               'new_price': form.get(f'new_price_{dist_inventory_id}'),
+                               'price_version': form.get(f'price_version_{dist_inventory_id}')}
+                              for dist_inventory_id in form.getlist('apply')])
+
+
+def parse_pricing_payload(payload):
+    # Either {"prices": [...]} or {"rule": {...}}; returns (lines, rule)
+    if not isinstance(payload, dict):
+        raise ValueError('Expected {"prices": [...]} or {"rule": {...}}')
+    if payload.get('prices') is not None:
+        return parse_price_lines(payload['prices']), None
+    if payload.get('rule') is not None:
+        return None, parse_rule(payload['rule'])
+    raise ValueError('Expected {"prices": [...]} or {"rule": {...}}')
+
+
+# ======================= APPLY =======================
+
+def _load_rows(cursor, distributor_id, lines, rule):
+    # Plain reads: the UPDATE below only applies where price_version is still what was read here.
+    # price_version moves only with unit_price / cost_price, so stock changes never conflict
+    if lines is not None:
+        ids = sorted({line['dist_inventory_id'] for line in lines})
+        cursor.execute(f"""
+            SELECT di.dist_inventory_id, di.product_id, di.cost_price, di.unit_price, di.price_version
+            FROM distributor_inventory di
+            WHERE di.distributor_id = %s AND di.dist_inventory_id IN ({', '.join(['%s'] * len(ids))})
+        """, (distributor_id, *ids))
+    else:
+        category_filter = "AND p.category = %s" if rule['category'] else ""
+        cursor.execute(f"""
+            SELECT di.dist_inventory_id, di.product_id, di.cost_price, di.unit_price, di.price_version
+            FROM distributor_inventory di
+            JOIN product p ON di.product_id = p.product_id
+            WHERE di.distributor_id = %s {category_filter}
+        """, (distributor_id, rule['category']) if rule['category'] else (distributor_id,))
+    return {row[0]: {'product_id': row[1], 'cost_price': row[2], 'unit_price': row[3], 'price_version': row[4]}
+            for row in cursor.fetchall()}
+
+
+def _target_prices(current, lines, rule):
+    # dist_inventory_id -> (new price, expected price_version or None); None price: no base to apply the rule to
+    if lines is not None:
+        # Last line wins when an id is repeated
+        return {line['dist_inventory_id']: (line['new_price'], line['price_version']) for line in lines}
+    return {dist_inventory_id: (None if row[rule['base']] is None
+                                else _money(row[rule['base']] * rule['multiplier'] + rule['amount']), None)
+            for dist_inventory_id, row in current.items()}
+
+
+def _conflict(result, row):
+    result.update(status='conflict', message='Changed by someone else; reload and retry',
+                  current_price=str(row['unit_price']), price_version=row['price_version'])
+
+
+def _hold_back(accepted):
+    # The batch is all-or-nothing: rows that would have been updated are left as they were
+    for _, row, _, result in accepted:
+        result.pop('old_price', None)
+        result.update(status='unchanged', message='Not applied because of conflicts',
+                      price_version=row['price_version'])
+
+
+def _report(results, updated):
+    return {
+        'summary': {
+            'total': len(results),
+            'updated': updated,
+            'rejected': sum(1 for result in results if result['status'] == 'error'),
+            'unchanged': sum(1 for result in results if result['status'] == 'unchanged'),
+            'conflicts': sum(1 for result in results if result['status'] == 'conflict'),
+        },
+        'results': results,
+    }
+
+
+def apply_prices(conn, distributor_id, user_id, lines=None, rule=None, reason=None):
+    # One compare-and-set UPDATE for every accepted row and one multi-row INSERT of their history.
+    # If any row changed since it was read, nothing is applied and the conflicts are reported.
+    results = []
+    accepted = []
+    cursor = conn.cursor()
+    try:
+        current = _load_rows(cursor, distributor_id, lines, rule) if lines or rule else {}
+        for dist_inventory_id, (new_price, expected) in _target_prices(current, lines, rule).items():
+            row = current.get(dist_inventory_id)
+            result = {'dist_inventory_id': dist_inventory_id, 'new_price': str(new_price)}
+            cost_price = row['cost_price'] if row else None
+            if row is None:
+                result.update(status='error', message='Inventory item not found')
+            elif expected is not None and expected != row['price_version']:
+                _conflict(result, row)
+            elif new_price is None:
+                result.update(status='error', message=f"No {rule['base']} to base the new price on")
+            elif cost_price is not None and new_price < price_floor(cost_price):
+                result.update(status='error',
+                              message=f"Below minimum price ₹{price_floor(cost_price)} (cost + 10%)")
+            elif cost_price and new_price > price_ceiling(cost_price):
+                result.update(status='error',
+                              message=f"Above maximum price ₹{price_ceiling(cost_price)} "
+                                      f"(markup over {MAX_MARKUP_PERCENT}%)")
+            elif new_price == row['unit_price']:
+                result.update(status='unchanged', message=None)
+            else:
+                result.update(status='updated', message=None, old_price=str(row['unit_price']),
+                              price_version=row['price_version'] + 1)
+                accepted.append((dist_inventory_id, row, new_price, result))
+            results.append(result)
+
+        if any(result['status'] == 'conflict' for result in results):
+            _hold_back(accepted)
+            return _report(results, 0)
+        if not accepted:
+            return _report(results, 0)
+
+        conn.start_transaction()
+        try:
+            cursor.execute(f"""
+                UPDATE distributor_inventory di
+                JOIN (VALUES {', '.join(['ROW(%s, %s, %s)'] * len(accepted))})
+                     AS np (dist_inventory_id, new_price, price_version)
+                  ON di.dist_inventory_id = np.dist_inventory_id AND di.price_version = np.price_version
+                SET di.unit_price = np.new_price
+                WHERE di.distributor_id = %s
+            """, [field for dist_inventory_id, row, new_price, _ in accepted
+                  for field in (dist_inventory_id, new_price, row['price_version'])] + [distributor_id])
+
+            if cursor.rowcount != len(accepted):
+                # Lost a race with another writer: undo, and report every row that moved on
+                conn.rollback()
+                latest = _load_rows(cursor, distributor_id,
+                                    [{'dist_inventory_id': item[0]} for item in accepted], None)
+                _hold_back(accepted)
+                for dist_inventory_id, row, _, result in accepted:
+                    now = latest.get(dist_inventory_id)
+                    if now is None or now['price_version'] != row['price_version']:
+                        _conflict(result, now or row)
+                return _report(results, 0)
+
+            history = [(dist_inventory_id, distributor_id, row['product_id'], row['unit_price'], new_price,
+                        _markup(row['cost_price'], row['unit_price']), _markup(row['cost_price'], new_price),
+                        reason, user_id)
+                       for dist_inventory_id, row, new_price, _ in accepted]
+            cursor.execute(f"""
+                INSERT INTO price_change_history
+                    (dist_inventory_id, distributor_id, product_id, old_price, new_price,
+                     old_markup_percent, new_markup_percent, change_reason, changed_by)
+                VALUES {', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s, %s)'] * len(history))}
+            """, [field for row in history for field in row])
+            stage_event(cursor, PRICES_UPDATED, distributor_id, {'count': len(accepted)})
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        cursor.close()
+
+    return _report(results, len(accepted))
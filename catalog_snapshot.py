@@ -0,0 +1,320 @@
+# catalog_snapshot.py - Array-backed catalog snapshot shared by workers through mmap
+#
+# One builder process writes the file (atomically replaced); every web worker
+# maps it read-only, so all workers share the same page-cache copy.
+#
+#   python catalog_snapshot.py            # rebuild whenever the catalog changes
+#   python catalog_snapshot.py --once     # build one snapshot and exit
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from stock_shards import live_quantity_sql
+
+MAGIC = b'PCSNAP01'
+HEADER = struct.Struct('<8sQdI')          # magic, generation, built_at, product count
+SECTION = struct.Struct('<QQ')            # offset, length (bytes)
+SECTIONS = (
+    'product_id',          # int32[n]
+    'name_offsets',        # uint32[n + 1] into names
+    'names',               # utf-8 blob
+    'desc_offsets',        # uint32[n + 1] into descriptions
+    'descriptions',        # utf-8 blob
+    'category_code',       # int16[n], -1 = no category
+    'category_offsets',    # uint32[c + 1] into category_names
+    'category_names',      # utf-8 blob
+    'manufacturer_code',   # int32[n] into manufacturer table
+    'mfr_offsets',         # uint32[m + 1] into mfr_names
+    'mfr_names',           # utf-8 blob
+    'best_price_cents',    # int64[n], cheapest in-stock distributor price or list price
+    'stock',               # int64[n], distributor + manufacturer units available
+)
+DTYPES = {
+    'product_id': np.int32,
+    'name_offsets': np.uint32,
+    'desc_offsets': np.uint32,
+    'category_code': np.int16,
+    'category_offsets': np.uint32,
+    'manufacturer_code': np.int32,
+    'mfr_offsets': np.uint32,
+    'best_price_cents': np.int64,
+    'stock': np.int64,
+}
+ALIGN = 8
+# Periodic rebuilds (run_builder max_age) keep a healthy snapshot well under this
+DEFAULT_MAX_AGE = 900.0
+
+
+# ======================= BUILDER =======================
+
+def _string_table(values):
+    encoded = [(value or '').encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, b''.join(encoded)
+
+
+def load_catalog_rows(cursor):
+    cursor.execute(f"""
+        SELECT
+            p.product_id,
+            p.product_name,
+            p.description,
+            p.category,
+            m.company_name,
+            CAST(ROUND(COALESCE(
+                (SELECT MIN(di.unit_price)
+                 FROM distributor_inventory di
+                 WHERE di.product_id = p.product_id AND {live_quantity_sql('distributor', 'di')} > 0),
+                p.unit_price
+            ) * 100) AS SIGNED) AS best_price_cents,
+            CAST(COALESCE((SELECT SUM({live_quantity_sql('distributor', 'di')}) FROM distributor_inventory di
+                           WHERE di.product_id = p.product_id), 0)
+               + COALESCE((SELECT SUM({live_quantity_sql('manufacturer', 'i')}) FROM inventory i
+                           WHERE i.product_id = p.product_id), 0) AS SIGNED) AS stock
+        FROM product p
+        JOIN manufacturer m ON p.manufacturer_id = m.manufacturer_id
+        ORDER BY p.product_name
+    """)
+    return cursor.fetchall()
+
+
+def write_snapshot(rows, path, generation=0):
+    categories = sorted({row[3] for row in rows if row[3] is not None})
+    category_index = {name: code for code, name in enumerate(categories)}
+    manufacturers = sorted({row[4] for row in rows})
+    manufacturer_index = {name: code for code, name in enumerate(manufacturers)}
+
+    name_offsets, names = _string_table(row[1] for row in rows)
+    desc_offsets, descriptions = _string_table(row[2] for row in rows)
+    category_offsets, category_names = _string_table(categories)
+    mfr_offsets, mfr_names = _string_table(manufacturers)
+
+    sections = {
+        'product_id': np.array([row[0] for row in rows], dtype=np.int32),
+        'name_offsets': name_offsets,
+        'names': names,
+        'desc_offsets': desc_offsets,
+        'descriptions': descriptions,
+        'category_code': np.array([category_index.get(row[3], -1) for row in rows], dtype=np.int16),
+        'category_offsets': category_offsets,
+        'category_names': category_names,
+        'manufacturer_code': np.array([manufacturer_index[row[4]] for row in rows], dtype=np.int32),
+        'mfr_offsets': mfr_offsets,
+        'mfr_names': mfr_names,
+        'best_price_cents': np.array([row[5] for row in rows], dtype=np.int64),
+        'stock': np.array([row[6] for row in rows], dtype=np.int64),
+    }
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+
+    offset = HEADER.size + SECTION.size * len(SECTIONS)
+    layout = []
+    for name in SECTIONS:
+        offset = (offset + ALIGN - 1) // ALIGN * ALIGN
+        data = sections[name]
+        raw = data if isinstance(data, bytes) else data.tobytes()
+        layout.append((offset, raw))
+        offset += len(raw)
+
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, generation, time.time(), len(rows)))
+        for section_offset, raw in layout:
+            f.write(SECTION.pack(section_offset, len(raw)))
+        for section_offset, raw in layout:
+            f.write(b'\0' * (section_offset - f.tell()))
+            f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+
+    # Readers holding the old mapping keep it; new opens see the new file
+    os.replace(tmp_path, path)
+
+
+def build_snapshot(conn, path):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM change_version_log")
+        generation = cursor.fetchone()[0]
+        rows = load_catalog_rows(cursor)
+    finally:
+        cursor.close()
+    write_snapshot(rows, path, generation)
+    return generation, len(rows)
+
+
+# ======================= READER =======================
+
+class CatalogSnapshot:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.generation, self.built_at, self.count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a catalog snapshot')
+
+        # Every section is a zero-copy view into the shared mapping
+        buf = memoryview(self._mm)
+        self._sections = {}
+        for index, name in enumerate(SECTIONS):
+            offset, length = SECTION.unpack_from(self._mm, HEADER.size + index * SECTION.size)
+            view = buf[offset:offset + length]
+            self._sections[name] = np.frombuffer(view, dtype=DTYPES[name]) if name in DTYPES else view
+
+        self.product_id = self._sections['product_id']
+        self.category_code = self._sections['category_code']
+        self.manufacturer_code = self._sections['manufacturer_code']
+        self.best_price_cents = self._sections['best_price_cents']
+        self.stock = self._sections['stock']
+        self.categories = self._decode_table('category_offsets', 'category_names')
+        self._manufacturers = self._decode_table('mfr_offsets', 'mfr_names')
+        # Product id lookup order, once per mapped generation
+        self._id_order = np.argsort(self.product_id, kind='stable')
+        self._sorted_ids = self.product_id[self._id_order]
+
+    def _decode_table(self, offsets_name, blob_name):
+        offsets, blob = self._sections[offsets_name], self._sections[blob_name]
+        return [bytes(blob[offsets[i]:offsets[i + 1]]).decode('utf-8') for i in range(len(offsets) - 1)]
+
+    def _string(self, offsets_name, blob_name, index):
+        offsets = self._sections[offsets_name]
+        return bytes(self._sections[blob_name][offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+    def product_name(self, index):
+        return self._string('name_offsets', 'names', index)
+
+    def description(self, index):
+        return self._string('desc_offsets', 'descriptions', index)
+
+    def category(self, index):
+        code = self.category_code[index]
+        return self.categories[code] if code >= 0 else None
+
+    def select(self, category=None):
+        # Row indices in catalog (product name) order
+        if not category:
+            return np.arange(self.count)
+        try:
+            code = self.categories.index(category)
+        except ValueError:
+            return np.arange(0)
+        return np.flatnonzero(self.category_code == code)
+
+    def index_of(self, product_ids):
+        # Map product ids to row indices (-1 when missing)
+        product_ids = np.asarray(product_ids, dtype=np.int32)
+        if self.count == 0:
+            return np.full(len(product_ids), -1)
+        pos = np.minimum(np.searchsorted(self._sorted_ids, product_ids), self.count - 1)
+        return np.where(self._sorted_ids[pos] == product_ids, self._id_order[pos], -1)
+
+    def row(self, index):
+        return {
+            'product_id': int(self.product_id[index]),
+            'product_name': self.product_name(index),
+            'category': self.category(index),
+            'description': self.description(index),
+            'company_name': self._manufacturers[self.manufacturer_code[index]],
+            'display_price': int(self.best_price_cents[index]) / 100,
+            'stock': int(self.stock[index]),
+        }
+
+    def rows(self, indices):
+        return [self.row(i) for i in indices]
+
+
+class SnapshotReader:
+    # Per-worker handle; remaps when the builder replaces the file. A snapshot
+    # older than max_age (builder stopped or failing) is not served: callers
+    # fall back to the database until a fresh one appears.
+
+    def __init__(self, path, check_interval=5.0, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self._snapshot = None
+        self._identity = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        snapshot = self._current()
+        if snapshot is not None and time.time() - snapshot.built_at > self.max_age:
+            return None
+        return snapshot
+
+    def _current(self):
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return self._snapshot
+        with self._lock:
+            self._last_check = now
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                self._snapshot, self._identity = None, None
+                return None
+            identity = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if identity != self._identity:
+                try:
+                    self._snapshot = CatalogSnapshot(self.path)
+                    self._identity = identity
+                except (OSError, ValueError, struct.error) as err:
+                    print(f"Catalog snapshot unavailable: {err}")
+                    self._snapshot, self._identity = None, None
+            return self._snapshot
+
+
+# ======================= BUILDER PROCESS =======================
+
+def run_builder(connect, path, interval=5.0, max_age=300.0):
+    conn = None
+    last_generation = None
+    last_build = 0.0
+    while True:
+        try:
+            if conn is None or not conn.is_connected():
+                conn = connect()
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(MAX(version), 0) FROM change_version_log")
+            generation = cursor.fetchone()[0]
+            cursor.close()
+            # Rebuild on catalog change, and periodically to pick up direct DB edits
+            if generation != last_generation or time.monotonic() - last_build > max_age:
+                started = time.monotonic()
+                generation, count = build_snapshot(conn, path)
+                last_generation, last_build = generation, time.monotonic()
+                print(f"Catalog snapshot generation {generation}: {count} products "
+                      f"in {last_build - started:.2f}s")
+        except Exception as err:
+            print(f"Catalog snapshot build failed: {err}")
+            conn = None
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from app import get_db_connection, snapshot_config
+
+    parser = argparse.ArgumentParser(description='Build the shared catalog snapshot')
+    parser.add_argument('--path', default=snapshot_config['path'])
+    parser.add_argument('--interval', type=float, default=5.0)
+    parser.add_argument('--once', action='store_true')
+    args = parser.parse_args()
+
+    if args.once:
+        conn = get_db_connection()
+        generation, count = build_snapshot(conn, args.path)
+        conn.close()
+        print(f"Wrote {count} products (generation {generation}) to {args.path}")
+    else:
+        run_builder(get_db_connection, args.path, args.interval)
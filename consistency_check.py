@@ -0,0 +1,281 @@
+# consistency_check.py - Parallel, throttled reconciliation of stock, order totals and paid orders
+#
+# Every check scans one table by primary-key ranges; the ranges run in a pool of
+# worker processes, each with its own read-only READ COMMITTED connection, and each
+# worker sleeps after a chunk in proportion to how long the chunk took (--duty), so
+# the scan stays a bounded share of the server's time. Discrepancies are written as
+# JSON lines plus a SQL file of fixes to review and run.
+#
+#   python consistency_check.py                                  # every check
+#   python consistency_check.py --check order_totals --workers 2 --duty 0.1
+#   python consistency_check.py --out var/reconcile --chunk 20000
+
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from decimal import Decimal
+
+import mysql.connector
+
+from order_archive import ARCHIVE_SUFFIX
+from stock_shards import PARENTS, live_quantity_sql
+
+DEFAULT_WORKERS = 4
+DEFAULT_CHUNK = 10000          # primary-key values per range
+DEFAULT_DUTY = 0.25            # fraction of each worker's wall time spent querying
+STATEMENT_TIMEOUT_MS = 30000
+
+# Per-process connection, opened by the pool initializer
+_conn = None
+_duty = DEFAULT_DUTY
+
+
+def _sql_value(value):
+    # Fix statements only ever carry ids, counts, amounts and our own enum strings
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (int, Decimal)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# ======================= CHECKS =======================
+# Each check takes (cursor, table suffix, low, high, context) and returns discrepancy dicts
+
+def check_stock(owner_type):
+    # Live stock must equal ledger adjustments (opening balances, counts, edits)
+    # + allocations in - allocations out - units sold since the ledger opened
+    table, owner_column = PARENTS[owner_type]
+    pk = 'inventory_id' if owner_type == 'manufacturer' else 'dist_inventory_id'
+    allocation_column = 'manufacturer_id' if owner_type == 'manufacturer' else 'distributor_id'
+    direction = -1 if owner_type == 'manufacturer' else 1
+
+    def sold_sql(suffix):
+        return f"""(SELECT COALESCE(SUM(oi.quantity), 0)
+                    FROM order_item{suffix} oi JOIN customer_order{suffix} co ON co.order_id = oi.order_id
+                    WHERE oi.product_id = t.product_id AND oi.seller_type = '{owner_type}'
+                      AND oi.seller_id = t.{owner_column} AND co.order_date >= %(since)s)"""
+
+    def run(cursor, suffix, low, high, context):
+        if context['ledger_start'] is None:
+            return []
+        cursor.execute(f"""
+            SELECT t.{pk}, t.{owner_column}, t.product_id, quantity, adjusted, allocated, sold
+            FROM (
+                SELECT t.{pk}, t.{owner_column}, t.product_id,
+                       {live_quantity_sql(owner_type, 't')} AS quantity,
+                       (SELECT COALESCE(SUM(m.quantity), 0) FROM inventory_movement m
+                        WHERE m.owner_type = '{owner_type}' AND m.owner_id = t.{owner_column}
+                          AND m.product_id = t.product_id AND m.movement_type = 'adjustment') AS adjusted,
+                       (SELECT COALESCE(SUM(a.allocated_quantity), 0) FROM allocation a
+                        WHERE a.product_id = t.product_id AND a.{allocation_column} = t.{owner_column}
+                          AND a.status = 'completed' AND a.allocation_date >= %(since)s) AS allocated,
+                       {sold_sql('')} + {sold_sql(ARCHIVE_SUFFIX)} AS sold
+                FROM {table} t
+                WHERE t.{pk} BETWEEN %(low)s AND %(high)s
+            ) t
+            WHERE quantity <> adjusted + {direction} * allocated - sold
+        """, {'low': low, 'high': high, 'since': context['ledger_start']})
+        found = []
+        for row_id, owner_id, product_id, quantity, adjusted, allocated, sold in cursor.fetchall():
+            expected = int(adjusted) + direction * int(allocated) - int(sold)
+            difference = int(quantity) - expected
+            found.append({
+                'check': f'{owner_type}_stock', 'table': table, 'id': row_id,
+                'owner_id': owner_id, 'product_id': product_id, 'quantity': int(quantity),
+                'expected': expected, 'adjusted': int(adjusted), 'allocated': int(allocated), 'sold': int(sold),
+                # The counted stock is taken as true; the unexplained difference is booked to the ledger
+                'fix': (f"INSERT INTO inventory_movement (owner_type, owner_id, product_id, movement_type, quantity) "
+                        f"VALUES ({_sql_value(owner_type)}, {owner_id}, {product_id}, 'adjustment', {difference});"),
+            })
+        return found
+    return run
+
+
+def check_order_totals(cursor, suffix, low, high, context):
+    cursor.execute(f"""
+        SELECT co.order_id, co.total_amount, COALESCE(SUM(oi.subtotal), 0) AS items_total, COUNT(oi.order_item_id)
+        FROM customer_order{suffix} co
+        LEFT JOIN order_item{suffix} oi ON oi.order_id = co.order_id
+        WHERE co.order_id BETWEEN %s AND %s
+        GROUP BY co.order_id
+        HAVING co.total_amount <> items_total
+    """, (low, high))
+    return [{
+        'check': 'order_totals', 'table': f'customer_order{suffix}', 'id': order_id,
+        'total_amount': str(total_amount), 'items_total': str(items_total), 'items': items,
+        'fix': (f"UPDATE customer_order{suffix} SET total_amount = {_sql_value(items_total)} "
+                f"WHERE order_id = {order_id};" if items else None),
+    } for order_id, total_amount, items_total, items in cursor.fetchall()]
+
+
+def check_paid_orders(cursor, suffix, low, high, context):
+    cursor.execute(f"""
+        SELECT co.order_id,
+               EXISTS (SELECT 1 FROM payment{suffix} p
+                       WHERE p.order_id = co.order_id AND p.payment_status = 'success') AS has_payment,
+               EXISTS (SELECT 1 FROM shipment{suffix} s WHERE s.order_id = co.order_id) AS has_shipment
+        FROM customer_order{suffix} co
+        WHERE co.order_id BETWEEN %s AND %s AND co.payment_status = 'paid'
+        HAVING NOT has_payment OR NOT has_shipment
+    """, (low, high))
+    found = []
+    for order_id, has_payment, has_shipment in cursor.fetchall():
+        if not has_payment:
+            # No successful payment on record: back to pending for follow-up rather than invent one
+            fix = (f"UPDATE customer_order{suffix} SET payment_status = 'pending' "
+                   f"WHERE order_id = {order_id} AND payment_status = 'paid';")
+        else:
+            fix = (f"INSERT INTO shipment{suffix} (order_id, estimated_delivery_date, tracking_number, carrier, "
+                   f"shipment_status) VALUES ({order_id}, DATE_ADD(CURDATE(), INTERVAL 7 DAY), "
+                   f"'TRACK-{order_id}-RECON', 'Standard Carrier', 'preparing');")
+        found.append({
+            'check': 'paid_orders', 'table': f'customer_order{suffix}', 'id': order_id,
+            'has_payment': bool(has_payment), 'has_shipment': bool(has_shipment), 'fix': fix,
+        })
+    return found
+
+
+# check name -> (table, primary key, function, table suffixes scanned)
+CHECKS = {
+    'manufacturer_stock': ('inventory', 'inventory_id', check_stock('manufacturer'), ('',)),
+    'distributor_stock': ('distributor_inventory', 'dist_inventory_id', check_stock('distributor'), ('',)),
+    'order_totals': ('customer_order', 'order_id', check_order_totals, ('', ARCHIVE_SUFFIX)),
+    'paid_orders': ('customer_order', 'order_id', check_paid_orders, ('', ARCHIVE_SUFFIX)),
+}
+
+
+# ======================= WORKERS =======================
+
+def _init_worker(db_config, duty):
+    global _conn, _duty
+    _conn = mysql.connector.connect(**db_config)
+    _duty = duty
+    cursor = _conn.cursor()
+    # Short statement snapshots, no writes, and a ceiling on any single chunk query
+    cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED")
+    cursor.execute("SET SESSION TRANSACTION READ ONLY")
+    cursor.execute("SET SESSION MAX_EXECUTION_TIME = %s", (STATEMENT_TIMEOUT_MS,))
+    cursor.close()
+
+
+def run_chunk(check, suffix, low, high, context):
+    # Returns (check, suffix, low, high, discrepancies, error); a failed range is reported, not fatal
+    started = time.monotonic()
+    cursor = _conn.cursor()
+    try:
+        found, error = CHECKS[check][2](cursor, suffix, low, high, context), None
+    except mysql.connector.Error as err:
+        found, error = [], str(err)
+    finally:
+        cursor.close()
+    elapsed = time.monotonic() - started
+    if _duty < 1:
+        time.sleep(elapsed * (1 - _duty) / _duty)
+    return check, suffix, low, high, found, error
+
+
+# ======================= COORDINATOR =======================
+
+def plan_ranges(conn, checks, chunk):
+    cursor = conn.cursor()
+    try:
+        tasks = []
+        for check in checks:
+            table, pk, _, suffixes = CHECKS[check]
+            for suffix in suffixes:
+                cursor.execute(f"SELECT MIN({pk}), MAX({pk}) FROM {table}{suffix}")
+                low, high = cursor.fetchone()
+                if low is None:
+                    continue
+                tasks.extend((check, suffix, start, min(start + chunk - 1, high))
+                             for start in range(low, high + 1, chunk))
+
+        cursor.execute("SELECT MIN(created_at) FROM inventory_movement")
+        context = {'ledger_start': cursor.fetchone()[0]}
+        return tasks, context
+    finally:
+        cursor.close()
+
+
+def reconcile(db_config, checks=None, workers=DEFAULT_WORKERS, chunk=DEFAULT_CHUNK, duty=DEFAULT_DUTY,
+              on_discrepancy=None, progress=None):
+    checks = list(checks or CHECKS)
+    conn = mysql.connector.connect(**db_config)
+    try:
+        tasks, context = plan_ranges(conn, checks, chunk)
+    finally:
+        conn.close()
+
+    started = time.monotonic()
+    counts = {check: 0 for check in checks}
+    failed = []
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(db_config, duty)) as pool:
+        futures = [pool.submit(run_chunk, *task, context) for task in tasks]
+        for future in as_completed(futures):
+            check, suffix, low, high, found, error = future.result()
+            done += 1
+            if error:
+                failed.append({'check': check, 'table_suffix': suffix, 'low': low, 'high': high, 'error': error})
+            counts[check] += len(found)
+            for discrepancy in found:
+                if on_discrepancy:
+                    on_discrepancy(discrepancy)
+            if progress:
+                progress(done, len(tasks), check, suffix, low, high)
+
+    return {
+        'chunks': len(tasks),
+        'discrepancies': counts,
+        'failed_chunks': failed,
+        'ledger_start': context['ledger_start'],
+        'elapsed_seconds': round(time.monotonic() - started, 1),
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from app import db_config
+
+    parser = argparse.ArgumentParser(description='Reconcile stock, order totals and paid orders')
+    parser.add_argument('--check', action='append', choices=sorted(CHECKS),
+                        help='Run only this check (repeatable); default all')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--chunk', type=int, default=DEFAULT_CHUNK)
+    parser.add_argument('--duty', type=float, default=DEFAULT_DUTY,
+                        help='Share of wall time each worker may spend querying (0-1]')
+    parser.add_argument('--host', help='Read from this host instead, e.g. a replica')
+    parser.add_argument('--out', default=os.path.join('var', 'reconcile'))
+    args = parser.parse_args()
+
+    config = dict(db_config, host=args.host) if args.host else db_config
+    os.makedirs(args.out, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    report_path = os.path.join(args.out, f'discrepancies-{stamp}.jsonl')
+    fixes_path = os.path.join(args.out, f'fixes-{stamp}.sql')
+
+    with open(report_path, 'w') as report, open(fixes_path, 'w') as fixes:
+        fixes.write(f"-- Reconciliation fixes generated {datetime.now():%Y-%m-%d %H:%M:%S}; review before running\n")
+        fixes.write("USE product_chain_distribution;\n")
+
+        def record(discrepancy):
+            report.write(json.dumps(discrepancy, default=str) + '\n')
+            if discrepancy['fix']:
+                fixes.write(f"-- {discrepancy['check']} {discrepancy['table']} #{discrepancy['id']}\n")
+                fixes.write(discrepancy['fix'] + '\n')
+
+        def progress(done, total, check, suffix, low, high):
+            if done % 100 == 0 or done == total:
+                print(f"{done}/{total} chunks ({check}{suffix} {low}-{high})")
+
+        summary = reconcile(config, args.check, max(args.workers, 1), max(args.chunk, 1),
+                            min(max(args.duty, 0.01), 1.0), record, progress)
+
+    print(json.dumps(summary, default=str, indent=2))
+    print(f"Discrepancies: {report_path}\nFixes: {fixes_path}")
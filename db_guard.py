@@ -0,0 +1,143 @@
+# db_guard.py - Per-route statement time budgets and a database circuit breaker
+#
+# Routes declare how long their queries may run:
+#   @statement_budget(2000)      # ms; 0 = no server-side limit
+# get_db_connection() turns the budget into SET SESSION max_execution_time (the
+# server aborts read-only SELECTs past it) and a client read timeout a little
+# above it, so a slow server costs a worker seconds, not minutes. A budget of 0
+# (exports, streamed listings) sets neither, and its errors do not count
+# against the breaker: a lost connection an hour into a stream says little
+# about the server now.
+#
+# The breaker counts consecutive failed requests (connect errors, statement
+# timeouts, lost connections). Once open, connections fail fast with
+# DatabaseUnavailable until reset_timeout has passed; then one trial request
+# is let through and its outcome closes or re-opens the breaker.
+
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_request_context
+from mysql.connector import errorcode
+from mysql.connector.errors import OperationalError
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 15.0
+DEFAULT_READ_TIMEOUT_SLACK = 2   # seconds on top of the statement budget
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+# Errors that mean the server is slow or unreachable, not that the query is wrong
+OVERLOAD_ERRNOS = {
+    errorcode.ER_QUERY_TIMEOUT,
+    errorcode.ER_CON_COUNT_ERROR,
+    errorcode.ER_TOO_MANY_USER_CONNECTIONS,
+    errorcode.CR_CONNECTION_ERROR,
+    errorcode.CR_CONN_HOST_ERROR,
+    errorcode.CR_SERVER_GONE_ERROR,
+    errorcode.CR_SERVER_LOST,
+    errorcode.CR_SERVER_LOST_EXTENDED,
+}
+
+
+class DatabaseUnavailable(OperationalError):
+    # A mysql.connector.Error, so existing `except mysql.connector.Error` paths still apply
+    pass
+
+
+def is_overload(err):
+    return isinstance(err, DatabaseUnavailable) or getattr(err, 'errno', None) in OVERLOAD_ERRNOS
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        return self._state
+
+    def allow(self):
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            # One trial per reset_timeout window; the rest keep failing fast
+            self._state = HALF_OPEN
+            self._opened_at = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self.trips += 1
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def retry_after(self):
+        # Seconds until the next trial request is allowed
+        with self._lock:
+            if self._state == CLOSED:
+                return 0
+            return max(math.ceil(self.reset_timeout - (time.monotonic() - self._opened_at)), 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_timeout_seconds': self.reset_timeout,
+                'trips': self.trips,
+                'rejected': self.rejected,
+            }
+
+
+# ======================= BUDGETS =======================
+
+def statement_budget(ms):
+    def decorator(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            g.db_budget_ms = ms
+            return f(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def request_budget(default_ms):
+    # Budget of the current route in ms, or None outside a request (CLI tools, background threads)
+    if not has_request_context():
+        return None
+    return g.get('db_budget_ms', default_ms)
+
+
+def read_timeout(budget_ms, slack=DEFAULT_READ_TIMEOUT_SLACK):
+    # Client-side seconds per read, or None for an unlimited budget (keep the connector default)
+    if not budget_ms:
+        return None
+    return math.ceil(budget_ms / 1000) + slack
+
+
+def counts_against_breaker():
+    # Budget-0 routes stream for as long as they need; their failures are not a health signal
+    return g.get('db_budget_ms') != 0
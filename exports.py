@@ -0,0 +1,223 @@
+# exports.py - Streaming CSV / Parquet / Arrow exports of allocations, orders and price history
+#
+# Rows are read in keyset chunks ("key > last key ORDER BY key LIMIT n"), each
+# its own short autocommit query, so a large export never holds a long
+# transaction or a whole result set.
+
+import csv
+import io
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet / Arrow exports are optional
+    pa = None
+    pq = None
+
+from order_archive import ARCHIVE_SUFFIX
+
+ARROW_AVAILABLE = pa is not None
+
+EXPORT_CHUNK_ROWS = 5000
+
+# name -> owner filter per role, FROM clause, and (column, expression, type);
+# the first column is the keyset key
+EXPORTS = {
+    'allocations': {
+        'owners': {
+            'manufacturer': "a.manufacturer_id = %s",
+            'distributor': "a.distributor_id = %s",
+        },
+        'from': """allocation a
+                   JOIN product p ON a.product_id = p.product_id
+                   JOIN manufacturer m ON a.manufacturer_id = m.manufacturer_id
+                   JOIN distributor d ON a.distributor_id = d.distributor_id""",
+        'columns': [
+            ('allocation_id', 'a.allocation_id', 'int'),
+            ('allocation_date', 'a.allocation_date', 'timestamp'),
+            ('product_id', 'a.product_id', 'int'),
+            ('product_name', 'p.product_name', 'text'),
+            ('manufacturer', 'm.company_name', 'text'),
+            ('distributor', 'd.company_name', 'text'),
+            ('allocated_quantity', 'a.allocated_quantity', 'int'),
+            ('unit_price', 'a.unit_price', 'money'),
+            ('total_amount', 'a.total_amount', 'money'),
+            ('status', 'a.status', 'text'),
+        ],
+    },
+    'orders': {
+        'owners': {
+            'manufacturer': "oi.seller_type = 'manufacturer' AND oi.seller_id = %s",
+            'distributor': "oi.seller_type = 'distributor' AND oi.seller_id = %s",
+        },
+        # Read from the hot tables, then again from the archive ({suffix}); an order archived
+        # while the export runs can show up in both passes
+        'archived': True,
+        'from': """order_item{suffix} oi
+                   JOIN customer_order{suffix} co ON oi.order_id = co.order_id
+                   JOIN product p ON oi.product_id = p.product_id""",
+        'columns': [
+            ('order_item_id', 'oi.order_item_id', 'int'),
+            ('order_id', 'co.order_id', 'int'),
+            ('order_date', 'co.order_date', 'timestamp'),
+            ('customer_id', 'co.customer_id', 'int'),
+            ('product_id', 'oi.product_id', 'int'),
+            ('product_name', 'p.product_name', 'text'),
+            ('quantity', 'oi.quantity', 'int'),
+            ('unit_price', 'oi.unit_price', 'money'),
+            ('subtotal', 'oi.subtotal', 'money'),
+            ('order_status', 'co.order_status', 'text'),
+            ('payment_status', 'co.payment_status', 'text'),
+        ],
+    },
+    'price_history': {
+        'owners': {
+            'distributor': "pch.distributor_id = %s",
+        },
+        'from': """price_change_history pch
+                   JOIN product p ON pch.product_id = p.product_id""",
+        'columns': [
+            ('price_history_id', 'pch.price_history_id', 'int'),
+            ('changed_at', 'pch.changed_at', 'timestamp'),
+            ('product_id', 'pch.product_id', 'int'),
+            ('product_name', 'p.product_name', 'text'),
+            ('old_price', 'pch.old_price', 'money'),
+            ('new_price', 'pch.new_price', 'money'),
+            ('old_markup_percent', 'pch.old_markup_percent', 'percent'),
+            ('new_markup_percent', 'pch.new_markup_percent', 'percent'),
+            ('change_reason', 'pch.change_reason', 'text'),
+        ],
+    },
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+
+def export_query(name, role, suffix=''):
+    spec = EXPORTS[name]
+    key = spec['columns'][0][1]
+    select = ',\n               '.join(f"{expr} AS {column}" for column, expr, _ in spec['columns'])
+    return f"""
+        SELECT {select}
+        FROM {spec['from'].format(suffix=suffix)}
+        WHERE {spec['owners'][role]} AND {key} > %s
+        ORDER BY {key}
+        LIMIT %s
+    """
+
+
+def iter_chunks(connect, name, role, owner_id, chunk_size=EXPORT_CHUNK_ROWS):
+    # Lists of row tuples, one keyset page at a time
+    suffixes = ('', ARCHIVE_SUFFIX) if EXPORTS[name].get('archived') else ('',)
+    conn = connect()
+    try:
+        for suffix in suffixes:
+            sql = export_query(name, role, suffix)
+            last_key = 0
+            while True:
+                cursor = conn.cursor()
+                cursor.execute(sql, (owner_id, last_key, chunk_size))
+                rows = cursor.fetchall()
+                cursor.close()
+                if rows:
+                    yield rows
+                if len(rows) < chunk_size:
+                    break
+                last_key = rows[-1][0]
+    finally:
+        conn.close()
+
+
+# ======================= CSV =======================
+
+def csv_stream(name, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column for column, _, _ in EXPORTS[name]['columns']])
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+# ======================= PARQUET / ARROW =======================
+
+def _arrow_type(kind):
+    return {
+        'int': pa.int64(),
+        'money': pa.decimal128(12, 2),
+        'percent': pa.decimal128(5, 2),
+        'timestamp': pa.timestamp('s'),
+        'text': pa.string(),
+    }[kind]
+
+
+def arrow_schema(name):
+    return pa.schema([(column, _arrow_type(kind)) for column, _, kind in EXPORTS[name]['columns']])
+
+
+class _ChunkSink:
+    # Write-only file object; whatever pyarrow has written is drained after every batch
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _record_batch(schema, rows):
+    columns = list(zip(*rows))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema)
+
+
+def arrow_stream(name, chunks, fmt):
+    # One Parquet row group / Arrow record batch per chunk
+    schema = arrow_schema(name)
+    sink = _ChunkSink()
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema, compression='snappy')
+    else:
+        writer = pa.ipc.new_stream(pa.PythonFile(sink, mode='w'), schema)
+    for rows in chunks:
+        writer.write_batch(_record_batch(schema, rows))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def export_stream(connect, name, role, owner_id, fmt):
+    chunks = iter_chunks(connect, name, role, owner_id)
+    if fmt == 'csv':
+        return csv_stream(name, chunks)
+    return arrow_stream(name, chunks, fmt)
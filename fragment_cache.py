@@ -0,0 +1,119 @@
+# fragment_cache.py - LRU cache of pre-rendered HTML fragments keyed on scope + data version
+#
+# In templates:
+#   {% cache 'orders_table', scope, status, page %} ...expensive block... {% endcache %}
+# The first argument names the fragment, the second is the data scope
+# ('catalog', 'distributor:<id>', ...); anything after that varies the key.
+# Pass row loaders (not rows) into the template so a hit skips the query too.
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 300
+
+
+class FragmentCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL_SECONDS, version_fn=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version_fn = version_fn    # scope -> version tag, or None when unknown
+        self._entries = OrderedDict()   # key -> (expires_at, html, size)
+        self._lock = threading.Lock()
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, html):
+        size = sys.getsizeof(html)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (time.monotonic() + self.ttl, html, size)
+            self.bytes_used += size
+            # Least recently used first
+            while self.bytes_used > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes_used -= entry[2]
+
+    def get_or_render(self, name, scope, variant, render):
+        version = self.version_fn(scope) if self.version_fn and scope else None
+        if version is None:
+            # No safe version stamp yet: render without caching
+            return render()
+        key = (name, scope, version, variant)
+        html = self.get(key)
+        if html is not None:
+            self.hits += 1
+            return html
+        self.misses += 1
+        html = render()
+        self.set(key, html)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes_used = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes_used': self.bytes_used,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'ttl_seconds': self.ttl,
+            }
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render_cached', [nodes.List(args)]),
+                               [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, parts, caller):
+        cache = self.environment.fragment_cache
+        if cache is None or len(parts) < 2:
+            return caller()
+        name, scope, *variant = parts
+        return cache.get_or_render(name, scope, tuple(variant), caller)
@@ -0,0 +1,121 @@
+# http_cache.py - ETag / Last-Modified support driven by per-scope version stamps
+
+import glob
+import hashlib
+import math
+import os
+import threading
+import time
+from email.utils import formatdate
+from functools import wraps
+
+from flask import make_response, request, session
+
+from invalidation_bus import (DISTRIBUTOR_ORDERS_CHANGED, DISTRIBUTOR_STOCK_CHANGED, MANUFACTURER_ORDERS_CHANGED,
+                              MANUFACTURER_STOCK_CHANGED, ORDER_PLACED, PRICE_CHANGED, PRODUCT_ADDED)
+
+# Scopes touched by each invalidation event
+EVENT_SCOPES = {
+    PRODUCT_ADDED: lambda entity_id: ['catalog', f'manufacturer:{entity_id}'],
+    MANUFACTURER_STOCK_CHANGED: lambda entity_id: ['catalog', f'manufacturer:{entity_id}'],
+    DISTRIBUTOR_STOCK_CHANGED: lambda entity_id: ['catalog', f'distributor:{entity_id}'],
+    PRICE_CHANGED: lambda entity_id: ['catalog', f'distributor:{entity_id}'],
+    ORDER_PLACED: lambda entity_id: ['catalog'],
+    MANUFACTURER_ORDERS_CHANGED: lambda entity_id: [f'manufacturer:{entity_id}'],
+    DISTRIBUTOR_ORDERS_CHANGED: lambda entity_id: [f'distributor:{entity_id}'],
+}
+
+
+def _build_id(root):
+    # Changes whenever code or templates are redeployed, so old ETags stop matching
+    paths = glob.glob(os.path.join(root, '*.py')) + glob.glob(os.path.join(root, 'templates', '*.html'))
+    latest = max((os.path.getmtime(path) for path in paths), default=0)
+    return format(int(latest), 'x')
+
+
+class ScopeVersions:
+    def __init__(self, bus, root):
+        self._bus = bus
+        self._lock = threading.Lock()
+        self._versions = {}   # scope -> (version, applied_at)
+        self._started_at = time.time()
+        self.build_id = _build_id(root)
+        bus.add_listener(self._on_event)
+
+    def _on_event(self, version, event_type, entity_id):
+        scopes = EVENT_SCOPES.get(event_type)
+        if not scopes:
+            return
+        now = time.time()
+        with self._lock:
+            for scope in scopes(entity_id):
+                current = self._versions.get(scope)
+                if current is None or version > current[0]:
+                    self._versions[scope] = (version, now)
+
+    def stamp(self, scope):
+        # (version tag, last modified) or None when no safe stamp is known yet
+        with self._lock:
+            known = self._versions.get(scope)
+        if known:
+            return f'v{known[0]}', known[1]
+        # Scope unchanged since this worker started: the global watermark bounds it
+        watermark = self._bus.watermark
+        if watermark is None:
+            return None
+        return f'g{watermark}', self._started_at
+
+    def version(self, scope):
+        stamp = self.stamp(scope)
+        return stamp[0] if stamp else None
+
+    def etag_for(self, scope, variant):
+        stamp = self.stamp(scope)
+        if stamp is None:
+            return None, None
+        tag, last_modified = stamp
+        digest = hashlib.sha1(f'{self.build_id}|{scope}|{tag}|{variant}'.encode()).hexdigest()[:20]
+        return digest, math.ceil(last_modified)
+
+
+def conditional_get(versions, scope_fn, cache_control, source_fn=None):
+    # Answers 304 before the view runs any listing query. source_fn, when given,
+    # returns (tag, modified_at) for data the view reads besides the scope
+    # (e.g. a catalog snapshot); its tag goes into the ETag.
+    def decorator(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            scope = scope_fn()
+            variant = f"{request.full_path}|{session.get('user_type')}"
+            source_modified = None
+            if scope is not None and source_fn is not None:
+                source_tag, source_modified = source_fn()
+                variant = f'{variant}|{source_tag}'
+            etag, last_modified = (None, None) if scope is None else versions.etag_for(scope, variant)
+            if etag is not None and source_modified is not None:
+                last_modified = max(last_modified, math.ceil(source_modified))
+
+            if etag is not None:
+                not_modified = False
+                if request.if_none_match:
+                    not_modified = request.if_none_match.contains(etag)
+                elif request.if_modified_since is not None:
+                    not_modified = last_modified <= request.if_modified_since.timestamp()
+                if not_modified:
+                    response = make_response('', 304)
+                    _set_validators(response, etag, last_modified, cache_control)
+                    return response
+
+            response = make_response(f(*args, **kwargs))
+            if etag is not None and response.status_code == 200:
+                _set_validators(response, etag, last_modified, cache_control)
+            return response
+        return wrapped
+    return decorator
+
+
+def _set_validators(response, etag, last_modified, cache_control):
+    response.set_etag(etag)
+    response.headers['Last-Modified'] = formatdate(last_modified, usegmt=True)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Cookie')
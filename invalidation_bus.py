@@ -0,0 +1,236 @@
+# invalidation_bus.py - Cross-worker cache invalidation over a DB change-version log
+#
+# Events are written to change_version_log only by the outbox relay (outbox.py)
+# and by the distributor triggers in schema_improvements.sql; workers poll it
+# and apply what they have not seen.
+
+import glob
+import json
+import os
+import socket
+import threading
+import time
+
+import mysql.connector
+
+# Event types (entity_id meaning in brackets)
+PRODUCT_ADDED = 'product_added'                            # manufacturer_id
+MANUFACTURER_STOCK_CHANGED = 'manufacturer_stock_changed'  # manufacturer_id
+DISTRIBUTOR_STOCK_CHANGED = 'distributor_stock_changed'    # distributor_id
+PRICE_CHANGED = 'price_changed'                            # distributor_id
+ORDER_PLACED = 'order_placed'                              # product_id
+MANUFACTURER_ORDERS_CHANGED = 'manufacturer_orders_changed'  # manufacturer_id
+DISTRIBUTOR_ORDERS_CHANGED = 'distributor_orders_changed'    # distributor_id
+DISTRIBUTORS_CHANGED = 'distributors_changed'              # None
+
+EVENT_TYPES = {PRODUCT_ADDED, MANUFACTURER_STOCK_CHANGED, DISTRIBUTOR_STOCK_CHANGED,
+               PRICE_CHANGED, ORDER_PLACED, MANUFACTURER_ORDERS_CHANGED, DISTRIBUTOR_ORDERS_CHANGED,
+               DISTRIBUTORS_CHANGED}
+
+DEFAULT_POLL_INTERVAL = 2.0
+FETCH_BATCH = 1000
+# A version below the watermark that is still missing may belong to a transaction
+# that has not committed yet; it is re-checked this long before being given up
+GAP_TIMEOUT = 60.0
+
+
+# ======================= LOCAL TRANSPORT =======================
+
+class UnixSocketTransport:
+    # Each worker binds a datagram socket in a shared directory; publishers
+    # send the event to every socket so peers apply it without waiting to poll.
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, f'bus-{os.getpid()}.sock')
+        self._sock = None
+
+    def start(self, on_event):
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.path)
+
+        def listen():
+            while True:
+                try:
+                    data = self._sock.recv(65536)
+                    event = json.loads(data)
+                    on_event(event['version'], event['event_type'], event.get('entity_id'))
+                except (OSError, ValueError, KeyError):
+                    continue
+
+        threading.Thread(target=listen, name='invalidation-bus', daemon=True).start()
+
+    def broadcast(self, version, event_type, entity_id):
+        payload = json.dumps({'version': version, 'event_type': event_type, 'entity_id': entity_id}).encode()
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            for peer in glob.glob(os.path.join(self.directory, 'bus-*.sock')):
+                if peer == self.path:
+                    continue
+                try:
+                    sender.sendto(payload, peer)
+                except ConnectionRefusedError:
+                    # Worker is gone; clean up its socket file
+                    try:
+                        os.unlink(peer)
+                    except OSError:
+                        pass
+                except OSError:
+                    continue
+        finally:
+            sender.close()
+
+
+# ======================= BUS =======================
+
+class InvalidationBus:
+    def __init__(self, connect, poll_interval=DEFAULT_POLL_INTERVAL, transport=None):
+        self._connect = connect
+        self.poll_interval = poll_interval
+        self.transport = transport
+        self._handlers = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._conn = None
+        self._watermark = None
+        self._gaps = {}   # skipped version -> monotonic time first seen
+        self._last_poll = 0.0
+        self._applied = set()
+        self._started_pid = None
+        self.events_applied = 0
+        self.polls = 0
+
+    def subscribe(self, event_type, handler=None):
+        if event_type not in EVENT_TYPES:
+            raise ValueError(f'Unknown invalidation event type: {event_type}')
+
+        def register(fn):
+            self._handlers.setdefault(event_type, []).append(fn)
+            return fn
+        return register(handler) if handler else register
+
+    def add_listener(self, listener):
+        # Called with (version, event_type, entity_id) for every applied event
+        self._listeners.append(listener)
+        return listener
+
+    @property
+    def watermark(self):
+        return self._watermark
+
+    def start(self):
+        # Idempotent per process, so it is safe to call after a pre-fork import
+        if self._started_pid == os.getpid():
+            return
+        self._started_pid = os.getpid()
+        if self.transport:
+            self.transport.start(self._apply)
+
+    def _apply(self, version, event_type, entity_id):
+        with self._lock:
+            if version in self._applied:
+                return
+            self._applied.add(version)
+            if len(self._applied) > 10000:
+                floor = max(self._applied) - 5000
+                self._applied = {v for v in self._applied if v > floor}
+        for listener in self._listeners:
+            listener(version, event_type, entity_id)
+        for handler in self._handlers.get(event_type, []):
+            handler(entity_id)
+        self.events_applied += 1
+
+    def _poll_connection(self):
+        if self._conn is None or not self._conn.is_connected():
+            self._conn = self._connect()
+        return self._conn
+
+    def poll(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_poll < self.poll_interval:
+            return 0
+        if not self._lock.acquire(blocking=False):
+            return 0  # another thread is already polling
+        try:
+            self._last_poll = now
+            self.polls += 1
+            conn = self._poll_connection()
+            if conn is None:
+                return 0
+            cursor = conn.cursor()
+            try:
+                # Cheap check: one index lookup on the primary key
+                cursor.execute("SELECT COALESCE(MAX(version), 0) FROM change_version_log")
+                latest = cursor.fetchone()[0]
+                if self._watermark is None:
+                    # Fresh worker: its caches are empty, nothing to replay
+                    self._watermark = latest
+                    return 0
+                if latest <= self._watermark and not self._gaps:
+                    return 0
+                events = []
+                if latest > self._watermark:
+                    cursor.execute("""
+                        SELECT version, event_type, entity_id FROM change_version_log
+                        WHERE version > %s ORDER BY version LIMIT %s
+                    """, (self._watermark, FETCH_BATCH))
+                    events = cursor.fetchall()
+                late = self._fetch_gaps(cursor, events, now)
+            finally:
+                cursor.close()
+        except mysql.connector.Error:
+            self._conn = None
+            return 0
+        finally:
+            self._lock.release()
+
+        for version, event_type, entity_id in late + events:
+            self._apply(version, event_type, entity_id)
+        if events:
+            self._watermark = events[-1][0]
+        return len(late) + len(events)
+
+    def _fetch_gaps(self, cursor, events, now):
+        # Versions are allocated at insert but become visible at commit, so they can
+        # appear out of order; remember the holes and look them up again later
+        expected = self._watermark + 1
+        for version, _, _ in events:
+            # A huge hole is a pruned range, not transactions in flight
+            if version - expected <= FETCH_BATCH:
+                for missing in range(expected, version):
+                    self._gaps.setdefault(missing, now)
+            expected = version + 1
+        self._gaps = {version: seen for version, seen in self._gaps.items() if now - seen < GAP_TIMEOUT}
+        if not self._gaps:
+            return []
+        versions = sorted(self._gaps)
+        cursor.execute(f"""SELECT version, event_type, entity_id FROM change_version_log
+                           WHERE version IN ({', '.join(['%s'] * len(versions))})""", versions)
+        late = cursor.fetchall()
+        for version, _, _ in late:
+            self._gaps.pop(version, None)
+        return late
+
+    def stats(self):
+        return {
+            'watermark': self._watermark,
+            'pending_gaps': len(self._gaps),
+            'events_applied': self.events_applied,
+            'polls': self.polls,
+            'transport': type(self.transport).__name__ if self.transport else None,
+        }
+
+
+def prune_change_log(conn, keep_hours=24):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM change_version_log WHERE created_at < NOW() - INTERVAL %s HOUR LIMIT 10000",
+                       (keep_hours,))
+        deleted = cursor.rowcount
+        conn.commit()
+        return deleted
+    finally:
+        cursor.close()
@@ -0,0 +1,248 @@
+# inventory_adjustment.py - Bulk inventory adjustments / cycle counts (JSON / CSV)
+#
+# Lines are an absolute count ("set") or a change ("delta") per product, plus an
+# optional new reorder_level. Each chunk is loaded into a per-connection
+# temporary staging table and applied with set-based statements: one join-update
+# of the inventory rows, one ledger insert, and (for manufacturers) one
+# reorder_log insert for everything left at or under its reorder level. The
+# per-row reorder trigger is switched off for the batch with @bulk_inventory_adjustment.
+# Sharded products (stock_shards.py) are counted and rewritten in their stock slots;
+# their parent quantity is only a mirror.
+
+import csv
+import io
+
+import mysql.connector
+
+from outbox import STOCK_ADJUSTED, stage_event
+from stock_shards import PARENTS, live_quantity_sql, lock_slot_totals, set_slot_total
+
+CHUNK_SIZE = 1000
+MAX_LINES = 50000
+MODES = ('set', 'delta')
+STAGE_TABLE = 'inventory_adjustment_stage'
+
+
+# ======================= PARSING =======================
+
+def _line(index, row, default_mode):
+    return {
+        'line': index,
+        'product_id': row.get('product_id'),
+        'quantity': row.get('quantity'),
+        'reorder_level': row.get('reorder_level'),
+        'mode': row.get('mode') or default_mode,
+    }
+
+
+def parse_json_lines(payload, default_mode='set'):
+    # [{product_id, quantity, reorder_level?, mode?}, ...] or {"mode": ..., "adjustments": [...]}
+    if isinstance(payload, dict):
+        default_mode = payload.get('mode') or default_mode
+        rows = payload.get('adjustments')
+    else:
+        rows = payload
+    if not isinstance(rows, list):
+        raise ValueError("Expected a list of adjustments or {\"adjustments\": [...]}")
+    if len(rows) > MAX_LINES:
+        raise ValueError(f"Too many lines: {len(rows)} (max {MAX_LINES})")
+    return [_line(index, row if isinstance(row, dict) else {}, default_mode)
+            for index, row in enumerate(rows, start=1)]
+
+
+def parse_csv_lines(file_storage, default_mode='set'):
+    stream = io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(stream)
+    fields = {(f or '').strip() for f in reader.fieldnames or ()}
+    if 'product_id' not in fields or not fields & {'quantity', 'reorder_level'}:
+        raise ValueError("CSV header must contain product_id and quantity and/or reorder_level")
+
+    lines = []
+    # Line numbers match the file (header is line 1)
+    for row in reader:
+        # Fields past the header land under a None key as a list; they are ignored
+        row = {k.strip(): (v or '').strip() or None for k, v in row.items() if k}
+        lines.append(_line(reader.line_num, row, default_mode))
+        if len(lines) > MAX_LINES:
+            raise ValueError(f"Too many lines (max {MAX_LINES})")
+    return lines
+
+
+# ======================= VALIDATION =======================
+
+def _coerce(line):
+    if line['mode'] not in MODES:
+        return "mode must be 'set' or 'delta'"
+    try:
+        line['product_id'] = int(line['product_id'])
+        line['quantity'] = int(line['quantity']) if line['quantity'] not in (None, '') else None
+        line['reorder_level'] = int(line['reorder_level']) if line['reorder_level'] not in (None, '') else None
+    except (TypeError, ValueError):
+        return 'product_id, quantity and reorder_level must be integers'
+    if line['quantity'] is None and line['reorder_level'] is None:
+        return 'Nothing to change: give a quantity and/or a reorder_level'
+    if line['mode'] == 'set' and line['quantity'] is not None and line['quantity'] < 0:
+        return 'Quantity cannot be negative'
+    if line['reorder_level'] is not None and line['reorder_level'] < 0:
+        return 'Reorder level cannot be negative'
+    return None
+
+
+def validate_lines(lines):
+    seen = set()
+    for line in lines:
+        error = _coerce(line)
+        if not error and line['product_id'] in seen:
+            error = 'Product appears more than once in this file'
+        line['status'] = 'error' if error else 'valid'
+        line['message'] = error
+        line['old_quantity'] = line['new_quantity'] = None
+        if not error:
+            seen.add(line['product_id'])
+
+
+# ======================= APPLY =======================
+
+def _create_stage(cursor):
+    cursor.execute(f"""
+        CREATE TEMPORARY TABLE {STAGE_TABLE} (
+            product_id INT NOT NULL PRIMARY KEY,
+            line INT NOT NULL,
+            mode ENUM('set', 'delta') NOT NULL,
+            quantity INT NULL,
+            reorder_level INT NULL,
+            old_quantity INT NULL,
+            new_quantity INT NULL
+        )
+    """)
+
+
+def _apply_chunk(conn, cursor, owner_type, owner_id, chunk):
+    table, owner_column = PARENTS[owner_type]
+    by_product = {line['product_id']: line for line in chunk}
+
+    conn.start_transaction()
+    cursor.execute(f"""INSERT INTO {STAGE_TABLE} (product_id, line, mode, quantity, reorder_level)
+                       VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(chunk))}""",
+                   [field for line in chunk
+                    for field in (line['product_id'], line['line'], line['mode'], line['quantity'],
+                                  line['reorder_level'])])
+
+    # Lock the target rows in primary key order (and the stock slots of sharded ones, whose
+    # parent quantity is only a mirror), then record what each line will do
+    cursor.execute(f"""SELECT t.product_id, t.stock_slots FROM {table} t
+                       JOIN {STAGE_TABLE} s ON t.product_id = s.product_id
+                       WHERE t.{owner_column} = %s
+                       ORDER BY t.product_id
+                       FOR UPDATE OF t""", (owner_id,))
+    shards = lock_slot_totals(cursor, owner_type, owner_id,
+                              [product_id for product_id, stock_slots in cursor.fetchall() if stock_slots])
+    live_quantity = live_quantity_sql(owner_type, 't')
+    cursor.execute(f"""UPDATE {STAGE_TABLE} s
+                       JOIN {table} t ON t.product_id = s.product_id AND t.{owner_column} = %s
+                       SET s.old_quantity = {live_quantity},
+                           s.new_quantity = CASE
+                               WHEN s.quantity IS NULL THEN {live_quantity}
+                               WHEN s.mode = 'set' THEN s.quantity
+                               ELSE {live_quantity} + s.quantity END""", (owner_id,))
+
+    cursor.execute(f"""SELECT product_id, old_quantity, new_quantity FROM {STAGE_TABLE}
+                       WHERE old_quantity IS NULL OR new_quantity < 0""")
+    for product_id, old_quantity, new_quantity in cursor.fetchall():
+        line = by_product[product_id]
+        line['status'] = 'error'
+        line['message'] = ('Product is not in your inventory' if old_quantity is None
+                           else f'Only {old_quantity} units on hand; cannot remove {-line["quantity"]}')
+    cursor.execute(f"DELETE FROM {STAGE_TABLE} WHERE old_quantity IS NULL OR new_quantity < 0")
+
+    # Sharded rows get their new count written to the slots; the parent update leaves their mirror alone
+    if shards:
+        cursor.execute(f"""SELECT product_id, new_quantity FROM {STAGE_TABLE}
+                           WHERE product_id IN ({', '.join(['%s'] * len(shards))})""", tuple(shards))
+        for product_id, new_quantity in cursor.fetchall():
+            set_slot_total(cursor, owner_type, owner_id, product_id, shards[product_id][0], new_quantity)
+
+    # One set-based update; per-row reorder checks are skipped and done once below
+    cursor.execute("SET @bulk_inventory_adjustment = 1")
+    cursor.execute(f"""UPDATE {table} t
+                       JOIN {STAGE_TABLE} s ON t.product_id = s.product_id
+                       SET t.quantity_available = IF(t.stock_slots > 0, t.quantity_available, s.new_quantity),
+                           t.reorder_level = COALESCE(s.reorder_level, t.reorder_level)
+                       WHERE t.{owner_column} = %s""", (owner_id,))
+    cursor.execute("SET @bulk_inventory_adjustment = NULL")
+
+    cursor.execute(f"""INSERT INTO inventory_movement
+                           (owner_type, owner_id, product_id, movement_type, quantity, reference_id)
+                       SELECT %s, %s, product_id, 'adjustment', new_quantity - old_quantity, NULL
+                       FROM {STAGE_TABLE}
+                       WHERE new_quantity <> old_quantity""", (owner_type, owner_id))
+    if owner_type == 'manufacturer':
+        cursor.execute(f"""INSERT INTO reorder_log (product_id, manufacturer_id, quantity_needed, status)
+                           SELECT t.product_id, t.manufacturer_id, t.reorder_level * 2 - s.new_quantity,
+                                  'pending'
+                           FROM inventory t
+                           JOIN {STAGE_TABLE} s ON t.product_id = s.product_id
+                           WHERE t.manufacturer_id = %s AND s.new_quantity <= t.reorder_level""",
+                       (owner_id,))
+
+    cursor.execute(f"SELECT product_id, old_quantity, new_quantity FROM {STAGE_TABLE}")
+    applied = cursor.fetchall()
+    if applied:
+        stage_event(cursor, STOCK_ADJUSTED, owner_id, {'owner_type': owner_type, 'count': len(applied)})
+    conn.commit()
+
+    for product_id, old_quantity, new_quantity in applied:
+        line = by_product[product_id]
+        line['status'], line['old_quantity'], line['new_quantity'] = 'adjusted', old_quantity, new_quantity
+    cursor.execute(f"DELETE FROM {STAGE_TABLE}")
+
+
+def apply_lines(conn, owner_type, owner_id, lines, chunk_size=CHUNK_SIZE):
+    valid = [line for line in lines if line['status'] == 'valid']
+    if not valid:
+        return
+    cursor = conn.cursor()
+    try:
+        _create_stage(cursor)
+        for start in range(0, len(valid), chunk_size):
+            chunk = valid[start:start + chunk_size]
+            try:
+                _apply_chunk(conn, cursor, owner_type, owner_id, chunk)
+            except mysql.connector.Error as err:
+                conn.rollback()
+                cursor.execute("SET @bulk_inventory_adjustment = NULL")
+                cursor.execute(f"DELETE FROM {STAGE_TABLE}")
+                for line in chunk:
+                    line['status'], line['message'] = 'error', f'Chunk rolled back: {err.msg}'
+        cursor.execute(f"DROP TEMPORARY TABLE {STAGE_TABLE}")
+    finally:
+        cursor.close()
+
+
+def build_report(lines):
+    adjusted = [line for line in lines if line['status'] == 'adjusted']
+    return {
+        'summary': {
+            'total_lines': len(lines),
+            'adjusted': len(adjusted),
+            'failed': len(lines) - len(adjusted),
+            'net_units': sum(line['new_quantity'] - line['old_quantity'] for line in adjusted),
+        },
+        'results': [{
+            'line': line['line'],
+            'product_id': line['product_id'],
+            'mode': line['mode'],
+            'quantity': line['quantity'],
+            'reorder_level': line['reorder_level'],
+            'old_quantity': line['old_quantity'],
+            'new_quantity': line['new_quantity'],
+            'status': line['status'],
+            'message': line['message'],
+        } for line in lines],
+    }
+
+
+def run_bulk_adjustment(conn, owner_type, owner_id, lines, chunk_size=CHUNK_SIZE):
+    validate_lines(lines)
+    apply_lines(conn, owner_type, owner_id, lines, chunk_size)
+    return build_report(lines)
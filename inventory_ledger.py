@@ -0,0 +1,164 @@
+# inventory_ledger.py - Append-only stock movement ledger with periodic snapshots
+#
+# Every stock change is also written to inventory_movement as a signed
+# quantity. Snapshots hold, per (owner, product, movement type), the running
+# total up to a movement id; "stock at X" or "movements between A and B" read
+# one snapshot plus the movements after it, never the whole ledger.
+#
+#   python inventory_ledger.py                # snapshot every hour
+#   python inventory_ledger.py --once
+
+import time
+from datetime import datetime
+
+MOVEMENT_TYPES = ('allocation_out', 'allocation_in', 'sale', 'adjustment', 'return')
+
+DEFAULT_SNAPSHOT_INTERVAL = 3600
+# Movements younger than this are left for the next snapshot, so a transaction
+# still in flight can't commit a movement id below the snapshot's last id
+SNAPSHOT_LAG_SECONDS = 60
+
+
+def record_movements(cursor, movements):
+    # (owner_type, owner_id, product_id, movement_type, signed quantity, reference_id) tuples, one INSERT
+    movements = [movement for movement in movements if movement[4]]
+    if not movements:
+        return
+    cursor.execute(f"""INSERT INTO inventory_movement
+                           (owner_type, owner_id, product_id, movement_type, quantity, reference_id)
+                       VALUES {', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(movements))}""",
+                   [field for movement in movements for field in movement])
+
+
+# ======================= SNAPSHOTS =======================
+
+def _latest_snapshot(cursor, at=None):
+    # (snapshot_id, last_movement_id) of the newest snapshot covering only movements before `at`
+    if at is None:
+        cursor.execute("""SELECT snapshot_id, last_movement_id FROM inventory_snapshot
+                          ORDER BY snapshot_id DESC LIMIT 1""")
+    else:
+        cursor.execute("""SELECT snapshot_id, last_movement_id FROM inventory_snapshot
+                          WHERE covered_until <= %s
+                          ORDER BY covered_until DESC, snapshot_id DESC LIMIT 1""", (at,))
+    row = cursor.fetchone()
+    return (row[0], row[1]) if row else (None, 0)
+
+
+def take_snapshot(conn, lag_seconds=SNAPSHOT_LAG_SECONDS):
+    # Previous snapshot + the movements since it, folded in SQL
+    cursor = conn.cursor()
+    conn.start_transaction()
+    try:
+        cursor.execute("SELECT NOW() - INTERVAL %s SECOND", (lag_seconds,))
+        covered_until = cursor.fetchone()[0]
+        previous_id, previous_last = _latest_snapshot(cursor)
+        cursor.execute("""SELECT COALESCE(MAX(movement_id), 0) FROM inventory_movement
+                          WHERE movement_id > %s AND created_at < %s""", (previous_last, covered_until))
+        last_movement_id = max(cursor.fetchone()[0], previous_last)
+
+        cursor.execute("""INSERT INTO inventory_snapshot (covered_until, last_movement_id)
+                          VALUES (%s, %s)""", (covered_until, last_movement_id))
+        snapshot_id = cursor.lastrowid
+        cursor.execute("""
+            INSERT INTO inventory_snapshot_item (snapshot_id, owner_type, owner_id, product_id, movement_type, total)
+            SELECT %s, owner_type, owner_id, product_id, movement_type, SUM(total)
+            FROM (
+                SELECT owner_type, owner_id, product_id, movement_type, total
+                FROM inventory_snapshot_item WHERE snapshot_id = %s
+                UNION ALL
+                SELECT owner_type, owner_id, product_id, movement_type, SUM(quantity)
+                FROM inventory_movement
+                WHERE movement_id > %s AND movement_id <= %s
+                GROUP BY owner_type, owner_id, product_id, movement_type
+            ) AS running
+            GROUP BY owner_type, owner_id, product_id, movement_type
+        """, (snapshot_id, previous_id or 0, previous_last, last_movement_id))
+        items = cursor.rowcount
+        conn.commit()
+        return snapshot_id, items
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+# ======================= QUERIES =======================
+
+def running_totals(conn, owner_type, owner_id, at=None):
+    # {product_id: {movement_type: total}} of all movements up to `at` (now when None)
+    cursor = conn.cursor()
+    try:
+        snapshot_id, last_movement_id = _latest_snapshot(cursor, at)
+        totals = {}
+        if snapshot_id is not None:
+            cursor.execute("""SELECT product_id, movement_type, total FROM inventory_snapshot_item
+                              WHERE snapshot_id = %s AND owner_type = %s AND owner_id = %s""",
+                           (snapshot_id, owner_type, owner_id))
+            for product_id, movement_type, total in cursor.fetchall():
+                totals.setdefault(product_id, {})[movement_type] = int(total)
+
+        time_filter = "AND created_at <= %s" if at is not None else ""
+        cursor.execute(f"""SELECT product_id, movement_type, SUM(quantity) FROM inventory_movement
+                           WHERE owner_type = %s AND owner_id = %s AND movement_id > %s {time_filter}
+                           GROUP BY product_id, movement_type""",
+                       (owner_type, owner_id, last_movement_id) + ((at,) if at is not None else ()))
+        for product_id, movement_type, total in cursor.fetchall():
+            by_type = totals.setdefault(product_id, {})
+            by_type[movement_type] = by_type.get(movement_type, 0) + int(total)
+        return totals
+    finally:
+        cursor.close()
+
+
+def stock_at(conn, owner_type, owner_id, at):
+    return {product_id: sum(by_type.values())
+            for product_id, by_type in running_totals(conn, owner_type, owner_id, at).items()}
+
+
+def movements_between(conn, owner_type, owner_id, start, end):
+    # Per product and movement type: units moved in (start, end]
+    before = running_totals(conn, owner_type, owner_id, start)
+    after = running_totals(conn, owner_type, owner_id, end)
+    window = {}
+    for product_id, by_type in after.items():
+        earlier = before.get(product_id, {})
+        moved = {movement_type: total - earlier.get(movement_type, 0) for movement_type, total in by_type.items()}
+        moved = {movement_type: total for movement_type, total in moved.items() if total}
+        if moved:
+            window[product_id] = moved
+    return window
+
+
+def run_snapshots(connect, interval=DEFAULT_SNAPSHOT_INTERVAL):
+    while True:
+        conn = connect()
+        try:
+            snapshot_id, items = take_snapshot(conn)
+            print(f"{datetime.now():%Y-%m-%d %H:%M:%S} snapshot {snapshot_id}: {items} items")
+        except Exception as err:
+            print(f"Inventory snapshot failed: {err}")
+        finally:
+            if conn is not None:
+                conn.close()
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from app import get_db_connection
+
+    parser = argparse.ArgumentParser(description='Take inventory ledger snapshots')
+    parser.add_argument('--interval', type=float, default=DEFAULT_SNAPSHOT_INTERVAL)
+    parser.add_argument('--once', action='store_true')
+    args = parser.parse_args()
+
+    if args.once:
+        conn = get_db_connection()
+        snapshot_id, items = take_snapshot(conn)
+        conn.close()
+        print(f"Snapshot {snapshot_id}: {items} items")
+    else:
+        run_snapshots(get_db_connection, args.interval)
@@ -0,0 +1,110 @@
+# order_archive.py - Moves closed orders out of the hot order tables into *_archive tables
+#
+# customer_order and its children (order_item, shipment, payment) keep only
+# open and recent orders; closed orders older than N months are copied to the
+# archive tables and deleted from the hot ones, a small batch per transaction.
+#
+#   python order_archive.py                 # archive closed orders older than 6 months
+#   python order_archive.py --months 12 --batch-size 200
+
+import time
+
+DEFAULT_ARCHIVE_MONTHS = 6
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_PAUSE = 0.2
+
+# Children first on delete, parent first on insert
+CHILD_TABLES = ('order_item', 'shipment', 'payment')
+ARCHIVE_SUFFIX = '_archive'
+
+# Delivered and paid, or cancelled: nothing will update these orders again
+CLOSED_ORDER = ("((co.order_status = 'delivered' AND co.payment_status = 'paid')"
+                " OR co.order_status = 'cancelled')")
+
+
+def with_archive(sql):
+    # The same SELECT over the hot and the archive tables, for all-time reads.
+    # {suffix} follows each order table name; bind the parameters once per branch.
+    return '\nUNION ALL\n'.join(sql.format(suffix=suffix) for suffix in ('', ARCHIVE_SUFFIX))
+
+
+def copy_columns(conn, table):
+    # Stored columns shared by a hot table and its archive; generated ones are recomputed on insert.
+    # extra alone can't tell them apart: DEFAULT CURRENT_TIMESTAMP columns show DEFAULT_GENERATED
+    cursor = conn.cursor()
+    cursor.execute("""SELECT column_name FROM information_schema.columns
+                      WHERE table_schema = DATABASE() AND table_name = %s
+                        AND generation_expression = ''
+                      ORDER BY ordinal_position""", (table,))
+    columns = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return ', '.join(columns)
+
+
+def archive_batch(conn, columns, cutoff, after_id, batch_size):
+    # One short transaction; returns the archived order ids
+    cursor = conn.cursor()
+    conn.start_transaction()
+    try:
+        # SKIP LOCKED: orders a request is touching right now wait for the next run
+        cursor.execute(f"""SELECT co.order_id FROM customer_order co
+                           WHERE co.order_id > %s AND co.order_date < %s AND {CLOSED_ORDER}
+                           ORDER BY co.order_id
+                           LIMIT %s
+                           FOR UPDATE SKIP LOCKED""", (after_id, cutoff, batch_size))
+        order_ids = [row[0] for row in cursor.fetchall()]
+        if not order_ids:
+            conn.rollback()
+            return []
+
+        placeholders = ', '.join(['%s'] * len(order_ids))
+        for table in ('customer_order',) + CHILD_TABLES:
+            cursor.execute(f"""INSERT INTO {table}{ARCHIVE_SUFFIX} ({columns[table]})
+                               SELECT {columns[table]} FROM {table}
+                               WHERE order_id IN ({placeholders})""", order_ids)
+        for table in CHILD_TABLES + ('customer_order',):
+            cursor.execute(f"DELETE FROM {table} WHERE order_id IN ({placeholders})", order_ids)
+        conn.commit()
+        return order_ids
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def archive_orders(conn, months=DEFAULT_ARCHIVE_MONTHS, batch_size=DEFAULT_BATCH_SIZE, pause=DEFAULT_PAUSE):
+    cursor = conn.cursor()
+    cursor.execute("SELECT NOW() - INTERVAL %s MONTH", (months,))
+    cutoff = cursor.fetchone()[0]
+    cursor.close()
+
+    columns = {table: copy_columns(conn, table) for table in ('customer_order',) + CHILD_TABLES}
+    archived = 0
+    after_id = 0
+    while True:
+        order_ids = archive_batch(conn, columns, cutoff, after_id, batch_size)
+        if not order_ids:
+            return archived
+        archived += len(order_ids)
+        after_id = order_ids[-1]
+        # Let replication and other writers catch up between batches
+        time.sleep(pause)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from app import get_db_connection
+
+    parser = argparse.ArgumentParser(description='Archive closed orders older than N months')
+    parser.add_argument('--months', type=int, default=DEFAULT_ARCHIVE_MONTHS)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=DEFAULT_PAUSE)
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    started = time.monotonic()
+    count = archive_orders(conn, args.months, args.batch_size, args.pause)
+    conn.close()
+    print(f"Archived {count} orders older than {args.months} months in {time.monotonic() - started:.1f}s")
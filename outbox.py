@@ -0,0 +1,283 @@
+# outbox.py - Transactional outbox for business change events
+#
+# Request handlers append a compact event row to outbox_event inside the same
+# transaction as the write itself (stage_event), so an event exists exactly when
+# the change committed and the request does nothing else. A single relay process
+# tails the outbox by event id and, per batch, in one transaction:
+#   - writes the cache invalidation events (change_version_log, deduplicated per
+#     batch) that every web worker polls; PRODUCT_ADDED also re-indexes search,
+#   - maintains the seller_daily_sales rollup,
+#   - advances its stored watermark.
+#
+#   python outbox.py                 # relay every 0.5s
+#   python outbox.py --once
+#
+# Without a separate relay process, each web worker runs one in a daemon
+# thread (OutboxRelay.start); the watermark row lock keeps them in turn, and
+# the ids still pending behind the watermark are stored on that same row.
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from invalidation_bus import (DISTRIBUTOR_ORDERS_CHANGED, DISTRIBUTOR_STOCK_CHANGED, MANUFACTURER_ORDERS_CHANGED,
+                              MANUFACTURER_STOCK_CHANGED, ORDER_PLACED, PRICE_CHANGED, PRODUCT_ADDED)
+
+# Outbox event types (entity_id meaning, payload keys)
+PRODUCT_CREATED = 'product_created'      # manufacturer_id, {product_id[, count]}
+STOCK_ALLOCATED = 'stock_allocated'      # manufacturer_id, {distributor_ids}
+STOCK_ADJUSTED = 'stock_adjusted'        # owner id, {owner_type, product_id | count}
+ORDER_CREATED = 'order_created'          # order_id, {product_id, seller_type, seller_id, quantity, amount}
+PAYMENT_RECEIVED = 'payment_received'    # order_id, {amount, sellers: [[seller_type, seller_id]]}
+PRICES_UPDATED = 'prices_updated'        # distributor_id, {count}
+
+OUTBOX_EVENTS = {PRODUCT_CREATED, STOCK_ALLOCATED, STOCK_ADJUSTED, ORDER_CREATED, PAYMENT_RECEIVED, PRICES_UPDATED}
+
+RELAY_NAME = 'relay'
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_RELAY_INTERVAL = 0.5
+# An id skipped by the watermark may belong to a transaction that has not
+# committed yet; it is re-checked this long before being treated as rolled back.
+# Skipped ids are kept on the watermark row, so whichever relay holds it next
+# picks them up, even after the relay that saw the hole has exited.
+GAP_TIMEOUT = 60.0
+
+
+def stage_event(cursor, event_type, entity_id=None, payload=None):
+    # Call inside the business transaction, before its commit
+    if event_type not in OUTBOX_EVENTS:
+        raise ValueError(f'Unknown outbox event type: {event_type}')
+    cursor.execute("INSERT INTO outbox_event (event_type, entity_id, payload) VALUES (%s, %s, %s)",
+                   (event_type, entity_id, json.dumps(payload, default=str) if payload else None))
+
+
+# ======================= DERIVED DATA =======================
+
+def invalidations(events):
+    # Cache invalidation events for a batch, first occurrence order, duplicates dropped
+    derived = []
+    for _, event_type, entity_id, payload, _ in events:
+        if event_type == PRODUCT_CREATED:
+            derived.append((PRODUCT_ADDED, entity_id))
+        elif event_type == STOCK_ALLOCATED:
+            derived.append((MANUFACTURER_STOCK_CHANGED, entity_id))
+            derived.extend((DISTRIBUTOR_STOCK_CHANGED, distributor_id)
+                           for distributor_id in payload['distributor_ids'])
+        elif event_type == STOCK_ADJUSTED:
+            derived.append((DISTRIBUTOR_STOCK_CHANGED if payload.get('owner_type') == 'distributor'
+                            else MANUFACTURER_STOCK_CHANGED, entity_id))
+        elif event_type == ORDER_CREATED:
+            derived.append((ORDER_PLACED, payload['product_id']))
+            derived.append((MANUFACTURER_STOCK_CHANGED if payload['seller_type'] == 'manufacturer'
+                            else DISTRIBUTOR_STOCK_CHANGED, payload['seller_id']))
+        elif event_type == PAYMENT_RECEIVED:
+            # Sellers' order lists and sales analytics show the payment status
+            derived.extend((MANUFACTURER_ORDERS_CHANGED if seller_type == 'manufacturer'
+                            else DISTRIBUTOR_ORDERS_CHANGED, seller_id)
+                           for seller_type, seller_id in payload.get('sellers', ()))
+        elif event_type == PRICES_UPDATED:
+            derived.append((PRICE_CHANGED, entity_id))
+    return list(dict.fromkeys(derived))
+
+
+def update_rollups(cursor, events):
+    # seller_daily_sales: orders / units / revenue by order day, paid_revenue by payment day
+    totals = {}
+
+    def add(key, orders=0, units=0, revenue=0, paid=0):
+        row = totals.setdefault(key, [0, 0, 0, 0])
+        row[0] += orders
+        row[1] += units
+        row[2] += revenue
+        row[3] += paid
+
+    for _, event_type, _, payload, created_at in events:
+        if event_type == ORDER_CREATED:
+            add((payload['seller_type'], payload['seller_id'], created_at.date()),
+                orders=1, units=payload['quantity'], revenue=float(payload['amount']))
+
+    paid_on = {entity_id: created_at.date() for _, event_type, entity_id, _, created_at in events
+               if event_type == PAYMENT_RECEIVED}
+    if paid_on:
+        order_ids = sorted(paid_on)
+        cursor.execute(f"""SELECT order_id, seller_type, seller_id, SUM(quantity * unit_price)
+                           FROM order_item WHERE order_id IN ({', '.join(['%s'] * len(order_ids))})
+                           GROUP BY order_id, seller_type, seller_id""", order_ids)
+        for order_id, seller_type, seller_id, amount in cursor.fetchall():
+            add((seller_type, seller_id, paid_on[order_id]), paid=float(amount))
+
+    if not totals:
+        return 0
+    cursor.execute(f"""
+        INSERT INTO seller_daily_sales (seller_type, seller_id, sale_date, orders, units, revenue, paid_revenue)
+        VALUES {', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(totals))} AS new
+        ON DUPLICATE KEY UPDATE
+            orders = seller_daily_sales.orders + new.orders,
+            units = seller_daily_sales.units + new.units,
+            revenue = seller_daily_sales.revenue + new.revenue,
+            paid_revenue = seller_daily_sales.paid_revenue + new.paid_revenue
+    """, [field for key, row in totals.items() for field in (*key, row[0], row[1], round(row[2], 2), round(row[3], 2))])
+    return len(totals)
+
+
+# ======================= RELAY =======================
+
+class OutboxRelay:
+    def __init__(self, connect, batch_size=DEFAULT_BATCH_SIZE, transport=None, name=RELAY_NAME):
+        self._connect = connect
+        self.batch_size = batch_size
+        self.transport = transport
+        self.name = name
+        self._started_pid = None
+        self._lock = threading.Lock()
+        self.relayed = 0
+
+    def start(self, interval=DEFAULT_RELAY_INTERVAL):
+        # Background relay thread, once per process (safe after a pre-fork import)
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            threading.Thread(target=self.run, args=(interval,), name='outbox-relay', daemon=True).start()
+
+    def _fetch(self, cursor, watermark, gaps):
+        # gaps: skipped event_id -> wall-clock time first seen, shared through the watermark row
+        cursor.execute("""SELECT event_id, event_type, entity_id, payload, created_at FROM outbox_event
+                          WHERE event_id > %s ORDER BY event_id LIMIT %s""", (watermark, self.batch_size))
+        events = cursor.fetchall()
+        now = time.time()
+        expected = watermark + 1
+        for event in events:
+            # A huge hole is a pruned range or a fresh watermark, not transactions in flight
+            if event[0] - expected <= self.batch_size:
+                for event_id in range(expected, event[0]):
+                    gaps.setdefault(event_id, now)
+            expected = event[0] + 1
+
+        gaps = {event_id: seen for event_id, seen in gaps.items() if now - seen < GAP_TIMEOUT}
+        if gaps:
+            gap_ids = sorted(gaps)
+            cursor.execute(f"""SELECT event_id, event_type, entity_id, payload, created_at FROM outbox_event
+                               WHERE event_id IN ({', '.join(['%s'] * len(gap_ids))})""", gap_ids)
+            events = cursor.fetchall() + events
+        for event in events:
+            gaps.pop(event[0], None)
+        return [(event_id, event_type, entity_id, json.loads(payload) if payload else None, created_at)
+                for event_id, event_type, entity_id, payload, created_at in events], gaps
+
+    def relay_batch(self, conn):
+        cursor = conn.cursor()
+        conn.start_transaction()
+        try:
+            # Row lock on the watermark keeps a second relay from interleaving
+            cursor.execute("""SELECT last_event_id, pending_gaps FROM outbox_consumer
+                              WHERE consumer = %s FOR UPDATE""", (self.name,))
+            row = cursor.fetchone()
+            watermark = row[0] if row else 0
+            stored = {event_id: seen for event_id, seen in json.loads(row[1])} if row and row[1] else {}
+            events, gaps = self._fetch(cursor, watermark, dict(stored))
+            if not events and gaps == stored:
+                conn.rollback()
+                return 0
+
+            derived = invalidations(events)
+            first_version = None
+            if derived:
+                cursor.execute(f"""INSERT INTO change_version_log (event_type, entity_id)
+                                   VALUES {', '.join(['(%s, %s)'] * len(derived))}""",
+                               [field for event in derived for field in event])
+                first_version = cursor.lastrowid
+            update_rollups(cursor, events)
+            cursor.execute("""INSERT INTO outbox_consumer (consumer, last_event_id, pending_gaps)
+                              VALUES (%s, %s, %s) AS new
+                              ON DUPLICATE KEY UPDATE last_event_id = new.last_event_id,
+                                                      pending_gaps = new.pending_gaps""",
+                           (self.name, max([watermark] + [event[0] for event in events]),
+                            json.dumps(sorted(gaps.items())) if gaps else None))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        self.relayed += len(events)
+        # Workers would see the versions on their next poll anyway; this just makes it immediate
+        if self.transport and derived:
+            for offset, (event_type, entity_id) in enumerate(derived):
+                self.transport.broadcast(first_version + offset, event_type, entity_id)
+        return len(events)
+
+    def run_once(self):
+        conn = self._connect()
+        try:
+            total = 0
+            while True:
+                relayed = self.relay_batch(conn)
+                total += relayed
+                if relayed < self.batch_size:
+                    return total
+        finally:
+            conn.close()
+
+    def run(self, interval=DEFAULT_RELAY_INTERVAL):
+        conn = None
+        while True:
+            try:
+                if conn is None:
+                    conn = self._connect()
+                while self.relay_batch(conn) >= self.batch_size:
+                    pass
+            except Exception as err:
+                print(f"{datetime.now():%Y-%m-%d %H:%M:%S} outbox relay failed, reconnecting: {err}")
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                conn = None
+            time.sleep(interval)
+
+
+def prune_outbox(conn, keep_hours=24):
+    # Relayed events older than keep_hours
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""DELETE FROM outbox_event
+                          WHERE event_id <= (SELECT COALESCE(MIN(last_event_id), 0) FROM outbox_consumer)
+                            AND created_at < NOW() - INTERVAL %s HOUR
+                          LIMIT 10000""", (keep_hours,))
+        deleted = cursor.rowcount
+        conn.commit()
+        return deleted
+    finally:
+        cursor.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from app import bus_config, get_db_connection
+    from invalidation_bus import UnixSocketTransport
+
+    parser = argparse.ArgumentParser(description='Relay outbox events to caches and rollups')
+    parser.add_argument('--interval', type=float, default=DEFAULT_RELAY_INTERVAL)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--once', action='store_true')
+    parser.add_argument('--prune-hours', type=int, help='Delete relayed events older than this and exit')
+    args = parser.parse_args()
+
+    if args.prune_hours is not None:
+        conn = get_db_connection()
+        print(f"Pruned {prune_outbox(conn, args.prune_hours)} outbox events")
+        conn.close()
+    else:
+        transport = UnixSocketTransport(bus_config['socket_dir']) if bus_config['socket_dir'] else None
+        relay = OutboxRelay(get_db_connection, args.batch_size, transport)
+        if args.once:
+            print(f"Relayed {relay.run_once()} outbox events")
+        else:
+            relay.run(args.interval)
@@ -0,0 +1,120 @@
+# price_history.py - Downsampled price_change_history series for charting
+#
+# Long histories are reduced to a point budget with largest-triangle-three-buckets
+# (LTTB), which keeps the visually important peaks and dips; computed series are
+# cached per distributor scope, so a new price change invalidates them.
+
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+
+DEFAULT_POINTS = 500
+MIN_POINTS = 3
+MAX_POINTS = 5000
+
+
+def lttb(x, y, threshold):
+    # Indices of the points kept; first and last are always kept
+    count = len(x)
+    if threshold >= count or threshold < MIN_POINTS:
+        return np.arange(count)
+
+    # Interior points split into threshold - 2 buckets
+    edges = np.linspace(1, count - 1, threshold - 1).astype(np.int64)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = count - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], max(edges[bucket + 1], edges[bucket] + 1)
+        # Third vertex: the average of the next bucket (or the last point)
+        if bucket + 2 < len(edges):
+            next_start, next_end = edges[bucket + 1], max(edges[bucket + 2], edges[bucket + 1] + 1)
+            avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        # Twice the triangle area for every candidate in the bucket
+        area = np.abs((x[previous] - avg_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (avg_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        kept[bucket + 1] = previous
+    return kept
+
+
+def load_price_series(cursor, distributor_id, dist_inventory_id, start=None, end=None):
+    filters = ["distributor_id = %s", "dist_inventory_id = %s"]
+    params = [distributor_id, dist_inventory_id]
+    if start:
+        filters.append("changed_at >= %s")
+        params.append(start)
+    if end:
+        # end is a date picked in the form; include the whole of that day
+        filters.append("changed_at < %s")
+        params.append(end + timedelta(days=1))
+    cursor.execute(f"""
+        SELECT UNIX_TIMESTAMP(changed_at), old_price, new_price
+        FROM price_change_history
+        WHERE {' AND '.join(filters)}
+        ORDER BY changed_at, price_history_id
+    """, params)
+    rows = cursor.fetchall()
+    times = np.array([int(row[0]) for row in rows], dtype=np.int64)
+    prices = np.array([float(row[2]) for row in rows])
+    initial_price = float(rows[0][1]) if rows else None
+    return times, prices, initial_price
+
+
+def price_series(cursor, distributor_id, dist_inventory_id, points=DEFAULT_POINTS, start=None, end=None):
+    times, prices, initial_price = load_price_series(cursor, distributor_id, dist_inventory_id, start, end)
+    kept = lttb(times.astype(float), prices, points)
+    return {
+        'dist_inventory_id': dist_inventory_id,
+        'initial_price': initial_price,
+        'total_points': len(times),
+        'returned_points': len(kept),
+        'min_price': float(prices.min()) if len(prices) else None,
+        'max_price': float(prices.max()) if len(prices) else None,
+        # [unix seconds, price] pairs keep the payload small
+        'points': [[int(times[i]), round(float(prices[i]), 2)] for i in kept],
+    }
+
+
+def cached_series(cache, scope, connect, distributor_id, dist_inventory_id, points=DEFAULT_POINTS,
+                  start=None, end=None):
+    # JSON text cached under the distributor's version stamp; a hit needs no connection at all
+    def build():
+        conn = connect()
+        cursor = conn.cursor()
+        try:
+            return json.dumps(price_series(cursor, distributor_id, dist_inventory_id, points, start, end))
+        finally:
+            cursor.close()
+            conn.close()
+    variant = (dist_inventory_id, points, str(start or ''), str(end or ''))
+    return cache.get_or_render('price_series', scope, variant, build)
+
+
+def svg_polyline(series, width=800, height=240, padding=10):
+    # Step chart coordinates for an inline <polyline points="...">
+    points = series['points']
+    if not points:
+        return ''
+    t0, t1 = points[0][0], points[-1][0]
+    low, high = series['min_price'], series['max_price']
+    span_t = (t1 - t0) or 1
+    span_p = (high - low) or 1
+    coords = []
+    previous_y = None
+    for t, price in points:
+        x = padding + (t - t0) / span_t * (width - 2 * padding)
+        y = height - padding - (price - low) / span_p * (height - 2 * padding)
+        if previous_y is not None:
+            coords.append(f'{x:.1f},{previous_y:.1f}')
+        coords.append(f'{x:.1f},{y:.1f}')
+        previous_y = y
+    return ' '.join(coords)
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d') if value else None
@@ -0,0 +1,145 @@
+# price_recommender.py - Velocity-based retail price suggestions for a distributor's inventory
+#
+# For every SKU: units sold per day over the window (from the seller's columnar
+# sales), days of stock cover left, distance from reorder_level, and how recently
+# the price was last changed. Short cover raises the price, excess cover lowers it,
+# within a per-run step limit and never below the cost_price * 1.10 floor.
+
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+
+from bulk_pricing import price_ceiling, price_floor
+from sales_columns import STATUS_CODES, sales_store
+from stock_shards import live_quantity_sql
+
+DEFAULT_WINDOW_DAYS = 30
+TARGET_COVER_DAYS = 30
+MAX_STEP = 0.10          # at most +/-10% per recommendation
+SENSITIVITY = 0.08       # price change per doubling / halving of cover
+COOLDOWN_DAYS = 7        # changes within this many days are damped
+MIN_CHANGE = 0.01        # suggestions under 1% are dropped
+
+
+def load_pricing_inputs(cursor, distributor_id):
+    cursor.execute(f"""
+        SELECT di.dist_inventory_id, di.product_id, di.price_version, {live_quantity_sql('distributor', 'di')},
+               COALESCE(di.reorder_level, 0), di.cost_price, di.unit_price, p.product_name
+        FROM distributor_inventory di
+        JOIN product p ON di.product_id = p.product_id
+        WHERE di.distributor_id = %s
+        ORDER BY di.dist_inventory_id
+    """, (distributor_id,))
+    inventory_rows = cursor.fetchall()
+
+    # Most recent price change per SKU
+    cursor.execute("""
+        SELECT dist_inventory_id, MAX(changed_at)
+        FROM price_change_history
+        WHERE distributor_id = %s
+        GROUP BY dist_inventory_id
+    """, (distributor_id,))
+    change_rows = cursor.fetchall()
+    return inventory_rows, change_rows
+
+
+def units_sold(sales, product_ids, window_days, now):
+    # Units per product over the window, aligned with product_ids; cancelled orders excluded
+    with sales.lock:
+        selected = sales.mask(now - timedelta(days=window_days), None)
+        selected &= sales['status'] != STATUS_CODES['cancelled']
+        sold_products = sales['product_id'][selected]
+        sold_quantity = sales['quantity'][selected]
+    if not len(sold_products):
+        return np.zeros(len(product_ids))
+    sold_ids, inverse = np.unique(sold_products, return_inverse=True)
+    totals = np.bincount(inverse, weights=sold_quantity, minlength=len(sold_ids))
+    position = np.searchsorted(sold_ids, product_ids)
+    position = np.minimum(position, len(sold_ids) - 1)
+    return np.where(sold_ids[position] == product_ids, totals[position], 0.0)
+
+
+def compute_recommendations(inventory_rows, change_rows, sold, window_days=DEFAULT_WINDOW_DAYS,
+                            target_cover_days=TARGET_COVER_DAYS, now=None):
+    now = now or datetime.now()
+    if not inventory_rows:
+        return []
+    dist_inventory_ids = np.array([row[0] for row in inventory_rows], dtype=np.int64)
+    quantity = np.array([row[3] for row in inventory_rows], dtype=float)
+    reorder_level = np.array([row[4] for row in inventory_rows], dtype=float)
+    price = np.array([float(row[6]) for row in inventory_rows])
+
+    velocity = sold / window_days
+    # Zero velocity means unlimited cover; capped so log() stays finite
+    cover_days = np.where(velocity > 0, quantity / np.maximum(velocity, 1e-9), 10 * target_cover_days)
+    cover_days = np.clip(cover_days, 0.5, 10 * target_cover_days)
+
+    # log2(target / cover): +1 when cover is half the target, -1 when it is double
+    adjustment = SENSITIVITY * np.log2(target_cover_days / cover_days)
+    # At or under reorder level, never cut the price
+    adjustment = np.where(quantity <= reorder_level, np.maximum(adjustment, 0), adjustment)
+    # Nothing left to sell: leave it alone
+    adjustment = np.where(quantity <= 0, 0, adjustment)
+
+    last_change = {row[0]: row[1] for row in change_rows}
+    days_since_change = np.array([(now - last_change[i]).total_seconds() / 86400 if i in last_change else np.inf
+                                  for i in dist_inventory_ids.tolist()])
+    adjustment = np.where(days_since_change < COOLDOWN_DAYS, adjustment / 2, adjustment)
+    adjustment = np.clip(adjustment, -MAX_STEP, MAX_STEP)
+
+    # The same Decimal floor and ceiling "Apply Selected Prices" enforces; float rounding can land a paisa
+    # past them. Without a cost there is neither
+    floor = np.array([float(price_floor(row[5])) if row[5] else 0.0 for row in inventory_rows])
+    ceiling = np.array([float(price_ceiling(row[5])) if row[5] else np.inf for row in inventory_rows])
+    suggested = np.minimum(np.maximum(np.round(price * (1 + adjustment), 2), floor), ceiling)
+    change = np.divide(suggested - price, price, out=np.zeros_like(price), where=price > 0)
+
+    recommendations = []
+    for i in np.flatnonzero(np.abs(change) >= MIN_CHANGE):
+        row = inventory_rows[i]
+        if cover_days[i] < target_cover_days:
+            reason = 'Selling fast' if quantity[i] > reorder_level[i] else 'Below reorder level'
+        else:
+            reason = 'No recent sales' if velocity[i] == 0 else 'Slow moving'
+        recommendations.append({
+            'dist_inventory_id': int(row[0]),
+            'product_id': int(row[1]),
+            'price_version': int(row[2]),
+            'product_name': row[7],
+            'quantity': int(quantity[i]),
+            'current_price': Decimal(row[6]),
+            'suggested_price': Decimal(f'{suggested[i]:.2f}'),
+            'change_percent': round(float(change[i]) * 100, 1),
+            'units_per_day': round(float(velocity[i]), 2),
+            'cover_days': None if velocity[i] == 0 else round(float(cover_days[i]), 1),
+            'days_since_change': None if np.isinf(days_since_change[i]) else int(days_since_change[i]),
+            'reason': reason,
+        })
+    recommendations.sort(key=lambda rec: -abs(rec['change_percent']))
+    return recommendations
+
+
+def build_recommendations(conn, distributor_id, window_days=DEFAULT_WINDOW_DAYS,
+                          target_cover_days=TARGET_COVER_DAYS):
+    started = time.monotonic()
+    now = datetime.now()
+    cursor = conn.cursor()
+    try:
+        inventory_rows, change_rows = load_pricing_inputs(cursor, distributor_id)
+    finally:
+        cursor.close()
+
+    sales = sales_store.get(conn, 'distributor', distributor_id)
+    product_ids = np.array([row[1] for row in inventory_rows], dtype=np.int64)
+    sold = units_sold(sales, product_ids, window_days, now)
+    recommendations = compute_recommendations(inventory_rows, change_rows, sold, window_days,
+                                              target_cover_days, now)
+    return {
+        'window_days': window_days,
+        'target_cover_days': target_cover_days,
+        'skus': len(inventory_rows),
+        'recommendations': recommendations,
+        'elapsed_ms': round((time.monotonic() - started) * 1000, 1),
+    }
@@ -0,0 +1,299 @@
+# product_import.py - Streaming bulk product catalog import for manufacturers (CSV / JSONL)
+#
+# The upload is parsed row by row and applied in chunks: each chunk's valid rows
+# go in as one multi-row product INSERT and one inventory INSERT, and the chunk
+# commits together with the import's checkpoint (last file line handled). A
+# failed import is resumed by uploading the same file with its import_id; lines
+# up to the checkpoint are skipped, and generated SKUs come out the same.
+
+import csv
+import io
+import json
+import re
+import time
+from decimal import Decimal, InvalidOperation
+
+import mysql.connector
+
+from inventory_ledger import record_movements
+from outbox import PRODUCT_CREATED, stage_event
+
+CHUNK_SIZE = 1000
+MIN_INITIAL_QUANTITY = 100          # same rule as the single add-product form
+DEFAULT_REORDER_LEVEL = 100
+MAX_REPORTED_ERRORS = 1000          # per-row errors past this are only counted
+
+REQUIRED_COLUMNS = ('product_name', 'unit_price', 'initial_quantity')
+SKU_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,49}$')
+
+
+class ImportNotFound(Exception):
+    pass
+
+
+# ======================= PARSING =======================
+
+def iter_csv_rows(file_storage):
+    # (line number, row dict); the header is line 1
+    stream = io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(stream)
+    fields = {(f or '').strip() for f in reader.fieldnames or ()}
+    if not set(REQUIRED_COLUMNS).issubset(fields):
+        raise ValueError(f"CSV header must contain {', '.join(REQUIRED_COLUMNS)}")
+    for row in reader:
+        yield reader.line_num, {(k or '').strip(): (v or '').strip() for k, v in row.items() if k}
+
+
+def iter_jsonl_rows(file_storage):
+    stream = io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig')
+    for line_number, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else {'_error': 'Line is not a JSON object'}
+
+
+def iter_rows(file_storage):
+    name = (file_storage.filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')) or file_storage.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return iter_jsonl_rows(file_storage)
+    return iter_csv_rows(file_storage)
+
+
+# ======================= VALIDATION =======================
+
+def _text(row, name, limit, required=False):
+    value = row.get(name)
+    value = str(value).strip() if value is not None else ''
+    if required and not value:
+        raise ValueError(f'{name} is required')
+    if len(value) > limit:
+        raise ValueError(f'{name} is longer than {limit} characters')
+    return value or None
+
+
+def _decimal(row, name, required=False):
+    value = row.get(name)
+    if value is None or str(value).strip() == '':
+        if required:
+            raise ValueError(f'{name} is required')
+        return None
+    try:
+        amount = Decimal(str(value).strip()).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f'{name} must be a number')
+    if amount < 0:
+        raise ValueError(f'{name} cannot be negative')
+    return amount
+
+
+def _int(row, name, default=None):
+    value = row.get(name)
+    if value is None or str(value).strip() == '':
+        if default is None:
+            raise ValueError(f'{name} is required')
+        return default
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+
+
+def generate_sku(manufacturer_id, import_id, line, category):
+    # Deterministic, so a resumed import produces the same SKU for the same line
+    prefix = re.sub(r'[^A-Z0-9]', '', (category or '').upper())[:3] or 'GEN'
+    return f'{prefix}-{manufacturer_id}-{import_id}-{line}'
+
+
+def validate_row(row, manufacturer_id, import_id, line):
+    if '_error' in row:
+        raise ValueError(row['_error'])
+    product = {
+        'sku': _text(row, 'sku', 50),
+        'product_name': _text(row, 'product_name', 100, required=True),
+        'description': _text(row, 'description', 65535),
+        'category': _text(row, 'category', 50),
+        'unit_price': _decimal(row, 'unit_price', required=True),
+        'manufacturing_cost': _decimal(row, 'manufacturing_cost'),
+        'weight': _decimal(row, 'weight'),
+        'dimensions': _text(row, 'dimensions', 50),
+        'initial_quantity': _int(row, 'initial_quantity'),
+        'reorder_level': _int(row, 'reorder_level', DEFAULT_REORDER_LEVEL),
+    }
+    if product['unit_price'] <= 0:
+        raise ValueError('unit_price must be greater than zero')
+    if product['initial_quantity'] < MIN_INITIAL_QUANTITY:
+        raise ValueError(f'initial_quantity must be {MIN_INITIAL_QUANTITY} or more')
+    if product['reorder_level'] < 0:
+        raise ValueError('reorder_level cannot be negative')
+    if product['sku'] is None:
+        product['sku'] = generate_sku(manufacturer_id, import_id, line, product['category'])
+    elif not SKU_PATTERN.match(product['sku']):
+        raise ValueError('sku may only contain letters, digits, ".", "_" and "-"')
+    return product
+
+
+# ======================= IMPORT JOBS =======================
+
+def start_import(conn, manufacturer_id, filename):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""INSERT INTO product_import (manufacturer_id, filename, status)
+                          VALUES (%s, %s, 'running')""", (manufacturer_id, filename))
+        return {'import_id': cursor.lastrowid, 'last_line': 0, 'inserted': 0, 'failed': 0}
+    finally:
+        cursor.close()
+
+
+def resume_import(conn, manufacturer_id, import_id):
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""SELECT import_id, last_line, inserted, failed, status FROM product_import
+                          WHERE import_id = %s AND manufacturer_id = %s""", (import_id, manufacturer_id))
+        job = cursor.fetchone()
+        if not job:
+            raise ImportNotFound(f'Import {import_id} not found')
+        if job['status'] == 'completed':
+            raise ValueError(f'Import {import_id} already completed')
+        cursor.execute("UPDATE product_import SET status = 'running', error = NULL WHERE import_id = %s",
+                       (import_id,))
+        return job
+    finally:
+        cursor.close()
+
+
+def _finish(conn, import_id, status, error=None):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""UPDATE product_import SET status = %s, error = %s, finished_at = NOW()
+                          WHERE import_id = %s""", (status, error, import_id))
+    finally:
+        cursor.close()
+
+
+# ======================= APPLY =======================
+
+def _existing_skus(cursor, manufacturer_id, skus):
+    cursor.execute(f"""SELECT sku FROM product
+                       WHERE manufacturer_id = %s AND sku IN ({', '.join(['%s'] * len(skus))})""",
+                   (manufacturer_id, *skus))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def apply_chunk(conn, cursor, manufacturer_id, import_id, chunk, invalid, last_line):
+    # chunk: [(line, product)] of valid rows, invalid: rows of this chunk that failed validation.
+    # Returns (inserted, [(line, message)] of rows rejected here).
+    rejected = []
+    conn.start_transaction()
+    try:
+        if chunk:
+            taken = _existing_skus(cursor, manufacturer_id, [product['sku'] for _, product in chunk])
+            rejected = [(line, f"SKU {product['sku']} already exists") for line, product in chunk
+                        if product['sku'] in taken]
+            chunk = [(line, product) for line, product in chunk if product['sku'] not in taken]
+        if chunk:
+            cursor.execute(f"""
+                INSERT INTO product (manufacturer_id, sku, product_name, description, category, unit_price,
+                                     manufacturing_cost, weight, dimensions)
+                VALUES {', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s, %s)'] * len(chunk))}
+            """, [field for _, p in chunk
+                  for field in (manufacturer_id, p['sku'], p['product_name'], p['description'], p['category'],
+                                p['unit_price'], p['manufacturing_cost'], p['weight'], p['dimensions'])])
+            # One multi-row INSERT: auto-increment ids are consecutive from lastrowid
+            first_product_id = cursor.lastrowid
+            product_ids = range(first_product_id, first_product_id + len(chunk))
+
+            cursor.execute(f"""
+                INSERT INTO inventory (product_id, manufacturer_id, quantity_available, reorder_level)
+                VALUES {', '.join(['(%s, %s, %s, %s)'] * len(chunk))}
+            """, [field for product_id, (_, p) in zip(product_ids, chunk)
+                  for field in (product_id, manufacturer_id, p['initial_quantity'], p['reorder_level'])])
+            record_movements(cursor, [('manufacturer', manufacturer_id, product_id, 'adjustment',
+                                       p['initial_quantity'], None)
+                                      for product_id, (_, p) in zip(product_ids, chunk)])
+            stage_event(cursor, PRODUCT_CREATED, manufacturer_id,
+                        {'product_id': first_product_id, 'count': len(chunk)})
+
+        cursor.execute("""UPDATE product_import
+                          SET last_line = %s, inserted = inserted + %s, failed = failed + %s
+                          WHERE import_id = %s""", (last_line, len(chunk), invalid + len(rejected), import_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(chunk), rejected
+
+
+def run_import(conn, manufacturer_id, rows, filename=None, import_id=None, chunk_size=CHUNK_SIZE):
+    # rows: iterable of (line, row dict); returns the import report
+    started = time.monotonic()
+    job = (resume_import(conn, manufacturer_id, import_id) if import_id
+           else start_import(conn, manufacturer_id, filename))
+    import_id, resume_after = job['import_id'], job['last_line']
+
+    errors = []
+    counts = {'inserted': 0, 'failed': 0, 'skipped': 0}
+
+    def reject(line, message):
+        counts['failed'] += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({'line': line, 'message': message})
+
+    cursor = conn.cursor()
+    pending = {'chunk': [], 'invalid': 0, 'last_line': resume_after}
+
+    def flush():
+        inserted, rejected = apply_chunk(conn, cursor, manufacturer_id, import_id, pending['chunk'],
+                                         pending['invalid'], pending['last_line'])
+        counts['inserted'] += inserted
+        for line, message in rejected:
+            reject(line, message)
+        pending['chunk'], pending['invalid'] = [], 0
+
+    seen_skus = set()
+    status, failure = 'completed', None
+    try:
+        for line, row in rows:
+            if line <= resume_after:
+                counts['skipped'] += 1
+                continue
+            pending['last_line'] = line
+            try:
+                product = validate_row(row, manufacturer_id, import_id, line)
+                if product['sku'] in seen_skus:
+                    raise ValueError(f"SKU {product['sku']} appears more than once in this import")
+                seen_skus.add(product['sku'])
+                pending['chunk'].append((line, product))
+            except ValueError as e:
+                reject(line, str(e))
+                pending['invalid'] += 1
+            if len(pending['chunk']) + pending['invalid'] >= chunk_size:
+                flush()
+        if pending['chunk'] or pending['invalid']:
+            flush()
+    except (mysql.connector.Error, ValueError, csv.Error) as err:
+        # Bad header or undecodable bytes in the stream, or the database; the last chunk rolled back
+        status, failure = 'failed', str(err)
+    finally:
+        cursor.close()
+    _finish(conn, import_id, status, failure)
+
+    elapsed = time.monotonic() - started
+    processed = counts['inserted'] + counts['failed']
+    return {
+        'import_id': import_id,
+        'status': status,
+        'error': failure,
+        'summary': {
+            **counts,
+            'resumed_after_line': resume_after,
+            'total_inserted': job['inserted'] + counts['inserted'],
+            'elapsed_seconds': round(elapsed, 2),
+            'rows_per_second': round(processed / elapsed, 1) if elapsed > 0 else None,
+        },
+        'errors': errors,
+        'errors_truncated': counts['failed'] > len(errors),
+    }
@@ -0,0 +1,118 @@
+# ref_cache.py - In-process TTL cache for dropdown and category reference data
+
+import threading
+import time
+
+from stock_shards import live_quantity_sql
+
+DEFAULT_TTL_SECONDS = 300
+
+
+class TTLCache:
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS):
+        self.ttl = ttl
+        self._data = {}
+        self._generation = 0   # bumped by every invalidation
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_or_load(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        # Load outside the lock so a slow query doesn't block other keys
+        value = loader()
+        with self._lock:
+            # An invalidation during the load may mean the value is already stale: serve it, don't keep it
+            if self._generation == generation:
+                self._data[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def invalidate_prefix(self, prefix):
+        with self._lock:
+            self._generation += 1
+            stale = [key for key in self._data if key[:len(prefix)] == prefix]
+            for key in stale:
+                del self._data[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'ttl_seconds': self.ttl,
+            }
+
+
+reference_cache = TTLCache()
+
+
+# ======================= LOADERS =======================
+
+def get_distributors(cursor):
+    def load():
+        cursor.execute("SELECT distributor_id, company_name FROM distributor ORDER BY company_name")
+        return cursor.fetchall()
+    return reference_cache.get_or_load(('distributors',), load)
+
+
+def get_manufacturer_products(cursor, manufacturer_id):
+    def load():
+        cursor.execute(f"""
+            SELECT p.product_id, p.product_name, {live_quantity_sql('manufacturer', 'i')} AS quantity_available
+            FROM product p
+            LEFT JOIN inventory i ON p.product_id = i.product_id
+            WHERE p.manufacturer_id = %s
+            ORDER BY p.product_name
+        """, (manufacturer_id,))
+        return cursor.fetchall()
+    return reference_cache.get_or_load(('manufacturer_products', manufacturer_id), load)
+
+
+def get_categories(cursor):
+    def load():
+        cursor.execute("SELECT DISTINCT category FROM product ORDER BY category")
+        return [row['category'] for row in cursor.fetchall()]
+    return reference_cache.get_or_load(('categories',), load)
+
+
+# ======================= INVALIDATION =======================
+
+def invalidate_distributors():
+    reference_cache.invalidate(('distributors',))
+
+
+def invalidate_manufacturer_products(manufacturer_id=None):
+    if manufacturer_id is None:
+        reference_cache.invalidate_prefix(('manufacturer_products',))
+    else:
+        reference_cache.invalidate(('manufacturer_products', manufacturer_id))
+
+
+def invalidate_categories():
+    reference_cache.invalidate(('categories',))
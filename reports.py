@@ -0,0 +1,297 @@
+# reports.py - Report queries and a background job runner backed by a process pool
+#
+# Jobs are recorded in report_job so any web worker can answer status polls;
+# the report itself runs in a pool process with its own DB connection and
+# stores its JSON result on the job row until it expires.
+
+import json
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+import mysql.connector
+
+from order_archive import with_archive
+from sales_columns import SellerSales, month_starts, period_bounds
+from stock_shards import live_quantity_sql
+
+DEFAULT_MAX_WORKERS = 2
+DEFAULT_PER_USER_LIMIT = 2
+DEFAULT_RESULT_TTL = 900       # seconds a finished result stays fetchable
+DEFAULT_STALE_AFTER = 1800     # seconds before an unfinished job counts as lost
+
+
+class ReportLimitExceeded(Exception):
+    pass
+
+
+# ======================= REPORTS =======================
+# Each report takes (connection, seller role, seller id, params) and returns JSON-able data
+
+def monthly_order_summary(conn, role, owner_id, params):
+    cursor = conn.cursor(dictionary=True)
+    # Format string bound as a parameter: '%%' in the SQL text would reach MySQL as-is.
+    # Hot and archived orders; an order lives in exactly one of them
+    cursor.execute("""
+        SELECT DATE_FORMAT(x.order_date, %s) AS order_month,
+               COUNT(DISTINCT x.order_id) AS total_orders,
+               SUM(x.subtotal) AS total_sales,
+               SUM(x.subtotal) / COUNT(DISTINCT x.order_id) AS avg_order_value,
+               COUNT(DISTINCT x.customer_id) AS unique_customers
+        FROM (""" + with_archive("""
+            SELECT co.order_id, co.order_date, co.customer_id, oi.subtotal
+            FROM customer_order{suffix} co
+            JOIN order_item{suffix} oi ON co.order_id = oi.order_id
+            WHERE oi.seller_type = %s AND oi.seller_id = %s""") + """
+        ) x
+        GROUP BY order_month
+        ORDER BY order_month DESC
+    """, ('%Y-%m', role, owner_id, role, owner_id))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def sales_by_product(conn, role, owner_id, params):
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT p.product_id,
+               p.product_name,
+               p.category,
+               COUNT(x.order_item_id) AS total_orders,
+               SUM(x.quantity) AS total_quantity_sold,
+               SUM(x.subtotal) AS total_revenue,
+               AVG(x.unit_price) AS avg_selling_price,
+               MIN(x.unit_price) AS min_price,
+               MAX(x.unit_price) AS max_price
+        FROM (""" + with_archive("""
+            SELECT oi.order_item_id, oi.product_id, oi.quantity, oi.subtotal, oi.unit_price
+            FROM order_item{suffix} oi
+            WHERE oi.seller_type = %s AND oi.seller_id = %s""") + """
+        ) x
+        JOIN product p ON x.product_id = p.product_id
+        GROUP BY p.product_id, p.product_name, p.category
+        ORDER BY total_revenue DESC
+    """, (role, owner_id) * 2)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def distributor_analytics(conn, role, distributor_id, params, sales=None):
+    if sales is None:
+        # One-off load (report process); web workers pass their incrementally kept copy
+        sales = SellerSales('distributor', distributor_id)
+        cursor = conn.cursor()
+        sales.refresh(cursor)
+        cursor.close()
+
+    try:
+        # An explicit date range overrides the period
+        start, end = period_bounds(None, datetime.strptime(params.get('start_date', ''), '%Y-%m-%d').date(),
+                                   datetime.strptime(params.get('end_date', ''), '%Y-%m-%d').date())
+    except ValueError:
+        start, end = period_bounds(params.get('period', 'week'))
+    last_month, this_month = month_starts()
+
+    with sales.lock:
+        selected = sales.mask(start, end)
+        totals = sales.totals(selected)
+        top_products = sales.top_products(selected)
+        top_customers = sales.top_customers(selected)
+        revenue_by_category = sales.revenue_by_category(selected)
+        order_stats = sales.status_breakdown(selected)
+        this_month_revenue = sales.revenue_between(this_month)
+        last_month_revenue = sales.revenue_between(last_month, this_month)
+
+    cursor = conn.cursor()
+    cursor.execute(f"""SELECT COALESCE(SUM({live_quantity_sql('distributor', 'di')}), 0)
+                       FROM distributor_inventory di WHERE di.distributor_id = %s""", (distributor_id,))
+    units_in_stock = cursor.fetchone()[0]
+    cursor.close()
+
+    total_revenue = totals['revenue']
+    total_orders = totals['orders']
+    active_days = totals['active_days'] or 1
+    return {
+        'total_revenue': total_revenue,
+        'monthly_revenue': this_month_revenue,
+        'total_orders': total_orders,
+        'total_customers': totals['customers'],
+        'avg_order_value': total_revenue / total_orders if total_orders else 0,
+        'repeat_customer_rate': (round(totals['repeat_customers'] / totals['customers'] * 100, 1)
+                                 if totals['customers'] else 0),
+        'top_products': top_products,
+        'top_customers': top_customers,
+        'revenue_by_category': revenue_by_category,
+        'avg_daily_revenue': total_revenue / active_days,
+        'avg_orders_per_day': round(total_orders / active_days, 1),
+        'growth_rate': (round((this_month_revenue - last_month_revenue) / last_month_revenue * 100, 1)
+                        if last_month_revenue else 0),
+        'inventory_turnover': round(totals['units_sold'] / units_in_stock, 2) if units_in_stock else 0,
+        'order_stats': order_stats
+    }
+
+
+# report type -> (function, seller roles allowed to run it)
+REPORTS = {
+    'monthly_order_summary': (monthly_order_summary, {'manufacturer', 'distributor'}),
+    'sales_by_product': (sales_by_product, {'manufacturer', 'distributor'}),
+    'distributor_analytics': (distributor_analytics, {'distributor'}),
+}
+
+
+# ======================= JOB RUNNER =======================
+
+def run_report_job(db_config, job_id, report_type, role, owner_id, params, result_ttl):
+    # Entry point inside the pool process
+    conn = mysql.connector.connect(**db_config)
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("UPDATE report_job SET status = 'running', started_at = NOW() WHERE job_id = %s",
+                       (job_id,))
+        conn.commit()
+        try:
+            result = REPORTS[report_type][0](conn, role, owner_id, params)
+        except Exception as err:
+            cursor.execute("""UPDATE report_job
+                              SET status = 'failed', error = %s, finished_at = NOW(),
+                                  expires_at = NOW() + INTERVAL %s SECOND
+                              WHERE job_id = %s""", (str(err)[:500], result_ttl, job_id))
+        else:
+            cursor.execute("""UPDATE report_job
+                              SET status = 'done', result = %s, finished_at = NOW(),
+                                  expires_at = NOW() + INTERVAL %s SECOND
+                              WHERE job_id = %s""", (json.dumps(result, default=str), result_ttl, job_id))
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+class ReportJobRunner:
+    def __init__(self, db_config, max_workers=DEFAULT_MAX_WORKERS, per_user_limit=DEFAULT_PER_USER_LIMIT,
+                 result_ttl=DEFAULT_RESULT_TTL, stale_after=DEFAULT_STALE_AFTER):
+        self.db_config = db_config
+        self.max_workers = max_workers
+        self.per_user_limit = per_user_limit
+        self.result_ttl = result_ttl
+        self.stale_after = stale_after
+        self._executor = None
+        self._pid = None
+
+    def _pool(self):
+        # Created lazily per process; spawn keeps the web worker's threads and sockets out of the children
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            self._pid = os.getpid()
+        return self._executor
+
+    def submit(self, conn, user_id, report_type, role, owner_id, params):
+        if report_type not in REPORTS or role not in REPORTS[report_type][1]:
+            raise KeyError(report_type)
+
+        job_id = uuid.uuid4().hex
+        cursor = conn.cursor()
+        try:
+            conn.start_transaction()
+            # Lock the user row so concurrent submits can't both slip under the cap
+            cursor.execute("SELECT user_id FROM users WHERE user_id = %s FOR UPDATE", (user_id,))
+            cursor.fetchall()
+            cursor.execute("""SELECT COUNT(*) FROM report_job
+                              WHERE user_id = %s AND status IN ('queued', 'running')
+                                AND created_at > NOW() - INTERVAL %s SECOND""", (user_id, self.stale_after))
+            active = cursor.fetchone()[0]
+            if active >= self.per_user_limit:
+                conn.rollback()
+                raise ReportLimitExceeded(f'{active} report(s) already running; limit is {self.per_user_limit}.')
+            cursor.execute("""INSERT INTO report_job (job_id, user_id, report_type, params)
+                              VALUES (%s, %s, %s, %s)""", (job_id, user_id, report_type, json.dumps(params)))
+            conn.commit()
+        except mysql.connector.Error:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        try:
+            future = self._pool().submit(run_report_job, self.db_config, job_id, report_type, role, owner_id,
+                                         params, self.result_ttl)
+        except (BrokenProcessPool, RuntimeError) as err:
+            self._executor = None
+            self._mark_failed(conn, job_id, f'Could not start report: {err}')
+        else:
+            future.add_done_callback(lambda f: self._on_done(job_id, f))
+        return job_id
+
+    def _on_done(self, job_id, future):
+        # The job records its own outcome; this only covers a crash before it could
+        err = future.exception()
+        if err is None:
+            return
+        if isinstance(err, BrokenProcessPool):
+            self._executor = None
+        try:
+            conn = mysql.connector.connect(**self.db_config)
+        except mysql.connector.Error:
+            return
+        try:
+            self._mark_failed(conn, job_id, f'Report crashed: {err}')
+        finally:
+            conn.close()
+
+    def _mark_failed(self, conn, job_id, message):
+        cursor = conn.cursor()
+        cursor.execute("""UPDATE report_job
+                          SET status = 'failed', error = %s, finished_at = NOW(),
+                              expires_at = NOW() + INTERVAL %s SECOND
+                          WHERE job_id = %s AND status IN ('queued', 'running')""",
+                       (message[:500], self.result_ttl, job_id))
+        conn.commit()
+        cursor.close()
+
+    def get(self, conn, job_id, user_id, with_result=False):
+        columns = "job_id, report_type, status, error, created_at, started_at, finished_at, expires_at"
+        if with_result:
+            columns += ", result"
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(f"""SELECT {columns},
+                                  expires_at IS NOT NULL AND expires_at < NOW() AS expired,
+                                  status IN ('queued', 'running')
+                                      AND created_at < NOW() - INTERVAL %s SECOND AS lost
+                           FROM report_job WHERE job_id = %s AND user_id = %s""",
+                       (self.stale_after, job_id, user_id))
+        job = cursor.fetchone()
+        cursor.close()
+        if job is None:
+            return None
+        job['expired'] = bool(job['expired'])
+        if job.pop('lost'):
+            # The worker running it died; report it instead of leaving the client polling forever
+            job['status'], job['error'] = 'failed', 'Report did not finish in time.'
+        return job
+
+    def list_jobs(self, conn, user_id, limit=20):
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""SELECT job_id, report_type, status, created_at, finished_at, expires_at
+                          FROM report_job
+                          WHERE user_id = %s AND (expires_at IS NULL OR expires_at >= NOW())
+                          ORDER BY created_at DESC LIMIT %s""", (user_id, limit))
+        jobs = cursor.fetchall()
+        cursor.close()
+        return jobs
+
+
+def purge_expired_reports(conn, batch=1000):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM report_job WHERE expires_at < NOW() LIMIT %s", (batch,))
+        deleted = cursor.rowcount
+        conn.commit()
+        return deleted
+    finally:
+        cursor.close()
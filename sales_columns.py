@@ -0,0 +1,301 @@
+# sales_columns.py - Columnar (NumPy) copy of a seller's order items for vectorized analytics
+#
+# Each seller's order_item + customer_order rows (hot and archived) are held as parallel arrays and
+# appended incrementally ("order_item_id > last loaded id"); analytics are
+# group-bys over those arrays instead of repeated SQL aggregations.
+
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+
+from order_archive import with_archive
+
+ORDER_STATUSES = ('pending', 'processing', 'shipped', 'delivered', 'cancelled')
+STATUS_CODES = {status: code for code, status in enumerate(ORDER_STATUSES)}
+
+COLUMNS = {
+    'order_item_id': np.int64,
+    'order_id': np.int64,
+    'customer_id': np.int64,
+    'product_id': np.int64,
+    'category': np.int32,          # code into SellerSales.categories
+    'order_time': np.int64,        # seconds, from datetime64[s]
+    'quantity': np.int64,
+    'unit_price_cents': np.int64,
+    'subtotal_cents': np.int64,
+    'status': np.int8,             # code into ORDER_STATUSES
+}
+
+FETCH_BATCH = 10000
+DEFAULT_REFRESH_INTERVAL = 5.0
+DEFAULT_REBUILD_INTERVAL = 600.0   # appends miss status changes on old orders; reload fully this often
+MAX_SELLERS = 256
+
+
+def _cents(value):
+    return int((value or 0) * 100)
+
+
+def _money(cents):
+    return (Decimal(int(cents)) / 100).quantize(Decimal('0.01'))
+
+
+def _seconds(value):
+    return np.datetime64(value, 's').astype(np.int64)
+
+
+class SellerSales:
+    def __init__(self, seller_type, seller_id):
+        self.seller_type = seller_type
+        self.seller_id = seller_id
+        self.size = 0
+        self.last_item_id = 0
+        self.categories = []
+        self._category_codes = {}
+        self.products = {}     # product_id -> product name
+        self.customers = {}    # customer_id -> (name, email)
+        self._arrays = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self.loaded_at = time.monotonic()
+        self.refreshed_at = 0.0
+        # Held while appending and while computing analytics, so readers see equal-length columns
+        self.lock = threading.RLock()
+
+    def __getitem__(self, name):
+        return self._arrays[name][:self.size]
+
+    # ----------------------- loading -----------------------
+
+    def refresh(self, cursor):
+        # Append order items added since the last refresh (tuple cursor)
+        with self.lock:
+            return self._refresh(cursor)
+
+    def _refresh(self, cursor):
+        # Archived orders keep their ids, so one keyset covers both branches
+        cursor.execute(with_archive("""
+            SELECT oi.order_item_id, co.order_id, co.customer_id, oi.product_id, p.category,
+                   co.order_date, oi.quantity, oi.unit_price, oi.subtotal, co.order_status,
+                   p.product_name, CONCAT(c.first_name, ' ', c.last_name), c.email
+            FROM order_item{suffix} oi
+            JOIN customer_order{suffix} co ON oi.order_id = co.order_id
+            JOIN customer c ON co.customer_id = c.customer_id
+            JOIN product p ON oi.product_id = p.product_id
+            WHERE oi.seller_type = %s AND oi.seller_id = %s AND oi.order_item_id > %s
+        """) + "ORDER BY 1", (self.seller_type, self.seller_id, self.last_item_id) * 2)
+        appended = 0
+        while True:
+            rows = cursor.fetchmany(FETCH_BATCH)
+            if not rows:
+                break
+            self._append(rows)
+            appended += len(rows)
+        self.refreshed_at = time.monotonic()
+        return appended
+
+    def _category_code(self, category):
+        code = self._category_codes.get(category)
+        if code is None:
+            code = self._category_codes[category] = len(self.categories)
+            self.categories.append(category)
+        return code
+
+    def _append(self, rows):
+        count = len(rows)
+        needed = self.size + count
+        capacity = len(self._arrays['order_item_id'])
+        if needed > capacity:
+            # Geometric growth keeps appends amortised O(1)
+            new_capacity = max(needed, capacity * 2, 1024)
+            for name, array in self._arrays.items():
+                grown = np.empty(new_capacity, dtype=array.dtype)
+                grown[:self.size] = array[:self.size]
+                self._arrays[name] = grown
+
+        for row in rows:
+            self.products[row[3]] = row[10]
+            self.customers[row[2]] = (row[11], row[12])
+        values = {
+            'order_item_id': [row[0] for row in rows],
+            'order_id': [row[1] for row in rows],
+            'customer_id': [row[2] for row in rows],
+            'product_id': [row[3] for row in rows],
+            'category': [self._category_code(row[4]) for row in rows],
+            'order_time': np.array([row[5] for row in rows], dtype='datetime64[s]').astype(np.int64),
+            'quantity': [row[6] for row in rows],
+            'unit_price_cents': [_cents(row[7]) for row in rows],
+            'subtotal_cents': [_cents(row[8]) for row in rows],
+            'status': [STATUS_CODES.get(row[9], len(ORDER_STATUSES) - 1) for row in rows],
+        }
+        for name, column in values.items():
+            self._arrays[name][self.size:needed] = column
+        self.size = needed
+        self.last_item_id = rows[-1][0]
+
+    # ----------------------- analytics -----------------------
+
+    def mask(self, start=None, end=None):
+        # Rows with start <= order_date < end (naive datetimes, as MySQL returns them)
+        times = self['order_time']
+        selected = np.ones(self.size, dtype=bool)
+        if start is not None:
+            selected &= times >= _seconds(start)
+        if end is not None:
+            selected &= times < _seconds(end)
+        return selected
+
+    def _unique_orders(self, selected):
+        # Index of one row per order within the selection
+        order_ids = self['order_id'][selected]
+        _, first = np.unique(order_ids, return_index=True)
+        return first
+
+    def totals(self, selected):
+        subtotal = self['subtotal_cents'][selected]
+        times = self['order_time'][selected]
+        first = self._unique_orders(selected)
+        order_customers = self['customer_id'][selected][first]
+        customer_ids, orders_per_customer = np.unique(order_customers, return_counts=True)
+        return {
+            'revenue': _money(subtotal.sum()),
+            'units_sold': int(self['quantity'][selected].sum()),
+            'orders': len(first),
+            'customers': len(customer_ids),
+            'repeat_customers': int((orders_per_customer > 1).sum()),
+            'active_days': int((times.max() - times.min()) // 86400) + 1 if len(times) else 0,
+        }
+
+    def revenue_between(self, start=None, end=None):
+        return _money(self['subtotal_cents'][self.mask(start, end)].sum())
+
+    def top_products(self, selected, limit=5):
+        product_ids, inverse = np.unique(self['product_id'][selected], return_inverse=True)
+        units = np.bincount(inverse, weights=self['quantity'][selected], minlength=len(product_ids))
+        revenue = np.bincount(inverse, weights=self['subtotal_cents'][selected], minlength=len(product_ids))
+        top = np.argsort(-units, kind='stable')[:limit]
+        return [{'product_id': int(product_ids[i]),
+                 'product_name': self.products.get(int(product_ids[i])),
+                 'units_sold': int(units[i]),
+                 'revenue': _money(revenue[i])} for i in top]
+
+    def top_customers(self, selected, limit=5):
+        customer_ids, inverse = np.unique(self['customer_id'][selected], return_inverse=True)
+        spent = np.bincount(inverse, weights=self['subtotal_cents'][selected], minlength=len(customer_ids))
+        first = self._unique_orders(selected)
+        order_counts = np.bincount(inverse[first], minlength=len(customer_ids))
+        top = np.argsort(-spent, kind='stable')[:limit]
+        customers = []
+        for i in top:
+            name, email = self.customers.get(int(customer_ids[i]), (None, None))
+            customers.append({'customer_id': int(customer_ids[i]), 'name': name, 'email': email,
+                              'order_count': int(order_counts[i]), 'total_spent': _money(spent[i])})
+        return customers
+
+    def revenue_by_category(self, selected):
+        codes = self['category'][selected]
+        revenue = np.bincount(codes, weights=self['subtotal_cents'][selected], minlength=len(self.categories))
+        units = np.bincount(codes, weights=self['quantity'][selected], minlength=len(self.categories))
+        lines = np.bincount(codes, minlength=len(self.categories))
+        price_sum = np.bincount(codes, weights=self['unit_price_cents'][selected], minlength=len(self.categories))
+        total = revenue.sum()
+        rows = []
+        for code in np.argsort(-revenue, kind='stable'):
+            if lines[code] == 0:
+                continue
+            rows.append({'category': self.categories[code],
+                         'units_sold': int(units[code]),
+                         'revenue': _money(revenue[code]),
+                         'percentage': round(float(revenue[code] / total * 100), 1) if total else 0,
+                         'avg_price': _money(round(price_sum[code] / lines[code]))})
+        return rows
+
+    def status_breakdown(self, selected):
+        first = self._unique_orders(selected)
+        counts = np.bincount(self['status'][selected][first], minlength=len(ORDER_STATUSES))
+        return [{'status': status, 'count': int(counts[code])}
+                for code, status in enumerate(ORDER_STATUSES) if counts[code]]
+
+    def revenue_by_month(self, selected, limit=12):
+        months = self['order_time'][selected].astype('datetime64[s]').astype('datetime64[M]')
+        month_values, inverse = np.unique(months, return_inverse=True)
+        revenue = np.bincount(inverse, weights=self['subtotal_cents'][selected], minlength=len(month_values))
+        first = self._unique_orders(selected)
+        orders = np.bincount(inverse[first], minlength=len(month_values))
+        # Most recent months first
+        return [{'month': str(month_values[i]), 'revenue': _money(revenue[i]), 'orders': int(orders[i])}
+                for i in range(len(month_values) - 1, max(len(month_values) - 1 - limit, -1), -1)]
+
+
+# ======================= PERIODS =======================
+
+def period_bounds(period, start_date=None, end_date=None, now=None):
+    # (start, end) datetimes for a named period or an explicit date range
+    now = now or datetime.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if start_date and end_date:
+        return (datetime.combine(start_date, datetime.min.time()),
+                datetime.combine(end_date, datetime.min.time()) + timedelta(days=1))
+    if period == 'today':
+        return today, None
+    if period == 'week':
+        return today - timedelta(days=7), None
+    if period == 'month':
+        return today.replace(day=1), None
+    if period == 'quarter':
+        return today.replace(month=(today.month - 1) // 3 * 3 + 1, day=1), None
+    if period == 'year':
+        return today.replace(month=1, day=1), None
+    return None, None
+
+
+def month_starts(now=None):
+    # (start of last month, start of this month)
+    this_month = (now or datetime.now()).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    last_month = (this_month - timedelta(days=1)).replace(day=1)
+    return last_month, this_month
+
+
+# ======================= STORE =======================
+
+class SalesColumnStore:
+    # Per-process cache of SellerSales, refreshed on access
+
+    def __init__(self, refresh_interval=DEFAULT_REFRESH_INTERVAL, rebuild_interval=DEFAULT_REBUILD_INTERVAL,
+                 max_sellers=MAX_SELLERS):
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.max_sellers = max_sellers
+        self._sellers = {}
+        self._lock = threading.Lock()
+
+    def get(self, conn, seller_type, seller_id):
+        key = (seller_type, seller_id)
+        now = time.monotonic()
+        with self._lock:
+            sales = self._sellers.pop(key, None)
+            if sales is None or now - sales.loaded_at > self.rebuild_interval:
+                sales = SellerSales(seller_type, seller_id)
+            # Most recently used last
+            self._sellers[key] = sales
+            while len(self._sellers) > self.max_sellers:
+                self._sellers.pop(next(iter(self._sellers)))
+
+        # Refresh under the seller's own lock so other sellers aren't blocked
+        with sales.lock:
+            if now - sales.refreshed_at > self.refresh_interval:
+                cursor = conn.cursor()
+                try:
+                    sales.refresh(cursor)
+                finally:
+                    cursor.close()
+        return sales
+
+    def stats(self):
+        with self._lock:
+            return {'sellers': len(self._sellers),
+                    'rows': sum(sales.size for sales in self._sellers.values())}
+
+
+sales_store = SalesColumnStore()
@@ -27,3 +27,380 @@ BEGIN
 END //
 
 DELIMITER ;
+
+-- =====================================================
+-- CACHE INVALIDATION BUS
+-- Append-only change log; each row's version is the global change
+-- version that web workers poll (SELECT MAX(version)) to drop stale
+-- in-process cache entries. Rows older than a day can be pruned.
+-- Distributors are created and edited outside the app's request paths
+-- (sign-up scripts, admin SQL), so triggers publish distributors_changed
+-- for every write; workers drop their cached distributor dropdown on the
+-- next poll instead of waiting for the TTL. (Rows removed by an ON
+-- DELETE CASCADE do not fire triggers; those still fall back to the TTL.)
+-- =====================================================
+CREATE TABLE IF NOT EXISTS change_version_log (
+    version BIGINT AUTO_INCREMENT PRIMARY KEY,
+    event_type VARCHAR(50) NOT NULL,
+    entity_id INT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_created_at (created_at)
+);
+
+DROP TRIGGER IF EXISTS after_distributor_insert_changed;
+DROP TRIGGER IF EXISTS after_distributor_update_changed;
+DROP TRIGGER IF EXISTS after_distributor_delete_changed;
+
+DELIMITER //
+
+CREATE TRIGGER after_distributor_insert_changed
+AFTER INSERT ON distributor
+FOR EACH ROW
+BEGIN
+    INSERT INTO change_version_log (event_type, entity_id) VALUES ('distributors_changed', NEW.distributor_id);
+END//
+
+CREATE TRIGGER after_distributor_update_changed
+AFTER UPDATE ON distributor
+FOR EACH ROW
+BEGIN
+    IF NOT (NEW.company_name <=> OLD.company_name) THEN
+        INSERT INTO change_version_log (event_type, entity_id) VALUES ('distributors_changed', NEW.distributor_id);
+    END IF;
+END//
+
+CREATE TRIGGER after_distributor_delete_changed
+AFTER DELETE ON distributor
+FOR EACH ROW
+BEGIN
+    INSERT INTO change_version_log (event_type, entity_id) VALUES ('distributors_changed', OLD.distributor_id);
+END//
+
+DELIMITER ;
+
+-- =====================================================
+-- PRODUCT SEARCH
+-- Products are searched through the app's in-process index, which
+-- catches up incrementally with "product_id > last indexed id".
+-- =====================================================
+CREATE INDEX idx_product_category_name ON product(category, product_name);
+
+-- =====================================================
+-- BACKGROUND REPORT JOBS
+-- One row per submitted report; the pool process that runs it stores
+-- the JSON result here until expires_at, after which it is purged.
+-- =====================================================
+CREATE TABLE IF NOT EXISTS report_job (
+    job_id CHAR(32) PRIMARY KEY,
+    user_id INT NOT NULL,
+    report_type VARCHAR(50) NOT NULL,
+    params JSON,
+    status ENUM('queued', 'running', 'done', 'failed') NOT NULL DEFAULT 'queued',
+    result LONGTEXT NULL,
+    error VARCHAR(500) NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP NULL,
+    finished_at TIMESTAMP NULL,
+    expires_at TIMESTAMP NULL,
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+    INDEX idx_user_status (user_id, status),
+    INDEX idx_expires_at (expires_at)
+);
+
+-- =====================================================
+-- WRITE-BEHIND AUDIT LOG
+-- Login audit rows are buffered by the app (audit_log.py) and written in
+-- multi-row inserts, so the synchronous trigger goes away. The table is
+-- range-partitioned by month; `python audit_log.py` adds upcoming
+-- partitions and drops expired ones. Partitioned InnoDB tables cannot
+-- have foreign keys, and the primary key must include the partition column.
+-- =====================================================
+DROP TRIGGER IF EXISTS after_user_login;
+
+ALTER TABLE audit_log DROP FOREIGN KEY audit_log_ibfk_1;
+ALTER TABLE audit_log
+    MODIFY timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    DROP PRIMARY KEY,
+    ADD PRIMARY KEY (log_id, timestamp);
+ALTER TABLE audit_log
+    PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp)) (
+        PARTITION p202609 VALUES LESS THAN (UNIX_TIMESTAMP('2026-10-01')),
+        PARTITION pmax VALUES LESS THAN MAXVALUE
+    );
+
+-- =====================================================
+-- HOT / COLD ORDER TABLES
+-- customer_order is referenced by foreign keys from order_item,
+-- shipment and payment, so InnoDB cannot range-partition it. Closed
+-- orders older than N months are instead moved to *_archive copies by
+-- `python order_archive.py`, in small batches. CREATE TABLE ... LIKE
+-- copies columns and indexes (including the order_id index behind each
+-- foreign key) but not the foreign keys themselves.
+-- =====================================================
+CREATE TABLE IF NOT EXISTS customer_order_archive LIKE customer_order;
+CREATE TABLE IF NOT EXISTS order_item_archive LIKE order_item;
+CREATE TABLE IF NOT EXISTS shipment_archive LIKE shipment;
+CREATE TABLE IF NOT EXISTS payment_archive LIKE payment;
+
+CREATE INDEX idx_order_archive_customer ON customer_order_archive(customer_id, order_date);
+
+-- Range scans on order_date for customer history and the archival job
+CREATE INDEX idx_order_customer_date ON customer_order(customer_id, order_date);
+CREATE INDEX idx_order_status_date ON customer_order(order_status, order_date);
+
+-- =====================================================
+-- ROW VERSIONS FOR OPTIMISTIC CONCURRENCY
+-- Editors send back the row_version they read; updates apply only
+-- "WHERE ... AND row_version = <read version>" and a miss is answered
+-- with 409 and the current row. The triggers bump the version on every
+-- update, including allocation upserts and order stock decrements.
+-- The stock mirror sync (see SHARDED STOCK below) is the exception: it
+-- copies slot totals into sharded rows every second, which is not an
+-- edit, so it sets @stock_mirror_sync and the version stays as it is.
+-- Price edits compare price_version instead, which moves only when
+-- unit_price or cost_price does: stock changes on a busy SKU would
+-- otherwise turn every repricing into a conflict.
+-- =====================================================
+ALTER TABLE inventory ADD COLUMN row_version INT UNSIGNED NOT NULL DEFAULT 0;
+ALTER TABLE distributor_inventory ADD COLUMN row_version INT UNSIGNED NOT NULL DEFAULT 0;
+ALTER TABLE distributor_inventory ADD COLUMN price_version INT UNSIGNED NOT NULL DEFAULT 0;
+
+DELIMITER //
+
+CREATE TRIGGER before_inventory_version
+BEFORE UPDATE ON inventory
+FOR EACH ROW
+BEGIN
+    IF @stock_mirror_sync IS NULL THEN
+        SET NEW.row_version = OLD.row_version + 1;
+    END IF;
+END//
+
+CREATE TRIGGER before_distributor_inventory_version
+BEFORE UPDATE ON distributor_inventory
+FOR EACH ROW
+BEGIN
+    IF @stock_mirror_sync IS NULL THEN
+        SET NEW.row_version = OLD.row_version + 1;
+    END IF;
+    IF NOT (NEW.unit_price <=> OLD.unit_price) OR NOT (NEW.cost_price <=> OLD.cost_price) THEN
+        SET NEW.price_version = OLD.price_version + 1;
+    END IF;
+END//
+
+DELIMITER ;
+
+-- =====================================================
+-- PRICE HISTORY SERIES
+-- Charts read one SKU's changes in time order.
+-- =====================================================
+CREATE INDEX idx_price_history_item_time ON price_change_history(dist_inventory_id, changed_at);
+
+-- =====================================================
+-- SHARDED STOCK FOR HOT PRODUCTS
+-- For a product with stock_slots > 0, its stock lives in that many
+-- stock_shard rows. Orders claim units from a random slot, so they do
+-- not queue on one row. quantity_available on the parent becomes a
+-- mirror of the slot total, refreshed by `python stock_shards.py sync`;
+-- stock checks read the slot total (stock_shards.live_quantity_sql),
+-- and absolute counts (manual edits, bulk "set" adjustments) rewrite
+-- the slots under lock. Any other change to a sharded parent's quantity
+-- (allocation upserts, deltas) is moved into slot 0 by the triggers
+-- below. The mirror sync sets @stock_mirror_sync to bypass them.
+-- =====================================================
+ALTER TABLE inventory ADD COLUMN stock_slots TINYINT UNSIGNED NOT NULL DEFAULT 0;
+ALTER TABLE distributor_inventory ADD COLUMN stock_slots TINYINT UNSIGNED NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS stock_shard (
+    owner_type ENUM('manufacturer', 'distributor') NOT NULL,
+    owner_id INT NOT NULL,
+    product_id INT NOT NULL,
+    slot TINYINT UNSIGNED NOT NULL,
+    quantity INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (owner_type, owner_id, product_id, slot)
+);
+
+DELIMITER //
+
+CREATE TRIGGER before_inventory_stock_shards
+BEFORE UPDATE ON inventory
+FOR EACH ROW
+BEGIN
+    IF OLD.stock_slots > 0 AND NEW.stock_slots > 0 AND @stock_mirror_sync IS NULL
+       AND NEW.quantity_available <> OLD.quantity_available THEN
+        UPDATE stock_shard
+        SET quantity = quantity + (NEW.quantity_available - OLD.quantity_available)
+        WHERE owner_type = 'manufacturer' AND owner_id = NEW.manufacturer_id
+          AND product_id = NEW.product_id AND slot = 0;
+    END IF;
+END//
+
+CREATE TRIGGER before_distributor_inventory_stock_shards
+BEFORE UPDATE ON distributor_inventory
+FOR EACH ROW
+BEGIN
+    IF OLD.stock_slots > 0 AND NEW.stock_slots > 0 AND @stock_mirror_sync IS NULL
+       AND NEW.quantity_available <> OLD.quantity_available THEN
+        UPDATE stock_shard
+        SET quantity = quantity + (NEW.quantity_available - OLD.quantity_available)
+        WHERE owner_type = 'distributor' AND owner_id = NEW.distributor_id
+          AND product_id = NEW.product_id AND slot = 0;
+    END IF;
+END//
+
+DELIMITER ;
+
+-- =====================================================
+-- INVENTORY MOVEMENT LEDGER
+-- Every stock change is also appended to inventory_movement as a signed
+-- quantity (allocations both ways, sales, manual adjustments, returns).
+-- `python inventory_ledger.py` periodically writes a snapshot: per
+-- owner, product and movement type, the running total up to
+-- last_movement_id. Point-in-time and window queries read the nearest
+-- earlier snapshot plus the movements after it. The opening balances
+-- below are recorded as adjustments.
+-- =====================================================
+CREATE TABLE IF NOT EXISTS inventory_movement (
+    movement_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    owner_type ENUM('manufacturer', 'distributor') NOT NULL,
+    owner_id INT NOT NULL,
+    product_id INT NOT NULL,
+    movement_type ENUM('allocation_out', 'allocation_in', 'sale', 'adjustment', 'return') NOT NULL,
+    quantity INT NOT NULL,
+    reference_id INT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_movement_owner (owner_type, owner_id, movement_id),
+    INDEX idx_movement_created (created_at)
+);
+
+CREATE TABLE IF NOT EXISTS inventory_snapshot (
+    snapshot_id INT AUTO_INCREMENT PRIMARY KEY,
+    covered_until TIMESTAMP NOT NULL,
+    last_movement_id BIGINT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_snapshot_covered (covered_until)
+);
+
+CREATE TABLE IF NOT EXISTS inventory_snapshot_item (
+    snapshot_id INT NOT NULL,
+    owner_type ENUM('manufacturer', 'distributor') NOT NULL,
+    owner_id INT NOT NULL,
+    product_id INT NOT NULL,
+    movement_type ENUM('allocation_out', 'allocation_in', 'sale', 'adjustment', 'return') NOT NULL,
+    total BIGINT NOT NULL,
+    PRIMARY KEY (snapshot_id, owner_type, owner_id, product_id, movement_type),
+    FOREIGN KEY (snapshot_id) REFERENCES inventory_snapshot(snapshot_id) ON DELETE CASCADE
+);
+
+INSERT INTO inventory_movement (owner_type, owner_id, product_id, movement_type, quantity)
+SELECT 'manufacturer', manufacturer_id, product_id, 'adjustment', quantity_available
+FROM inventory WHERE quantity_available <> 0;
+
+INSERT INTO inventory_movement (owner_type, owner_id, product_id, movement_type, quantity)
+SELECT 'distributor', distributor_id, product_id, 'adjustment', quantity_available
+FROM distributor_inventory WHERE quantity_available <> 0;
+
+-- =====================================================
+-- TRANSACTIONAL OUTBOX
+-- Business writes (products, allocations, stock edits, orders,
+-- payments, price changes) append one compact outbox_event row in their
+-- own transaction. `python outbox.py` relays new events in id order:
+-- it writes the matching change_version_log rows (which web workers
+-- poll for cache invalidation and search re-indexing), updates the
+-- seller_daily_sales rollup, and advances its outbox_consumer
+-- watermark, all in one transaction. Web workers can each run the relay
+-- in a thread; they take turns on the watermark row's lock (SELECT ...
+-- FOR UPDATE), so that row is seeded here, and ids skipped by the
+-- watermark (transactions still in flight) wait in pending_gaps.
+-- =====================================================
+CREATE TABLE IF NOT EXISTS outbox_event (
+    event_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    event_type VARCHAR(50) NOT NULL,
+    entity_id INT NULL,
+    payload JSON NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_outbox_created (created_at)
+);
+
+CREATE TABLE IF NOT EXISTS outbox_consumer (
+    consumer VARCHAR(50) PRIMARY KEY,
+    last_event_id BIGINT NOT NULL DEFAULT 0,
+    pending_gaps JSON NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+INSERT IGNORE INTO outbox_consumer (consumer, last_event_id) VALUES ('relay', 0);
+
+CREATE TABLE IF NOT EXISTS seller_daily_sales (
+    seller_type ENUM('manufacturer', 'distributor') NOT NULL,
+    seller_id INT NOT NULL,
+    sale_date DATE NOT NULL,
+    orders INT NOT NULL DEFAULT 0,
+    units INT NOT NULL DEFAULT 0,
+    revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    paid_revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (seller_type, seller_id, sale_date)
+);
+
+-- =====================================================
+-- BULK PRODUCT IMPORT
+-- SKUs become unique per manufacturer instead of globally (product.sku
+-- already exists in schema-updated.sql, with a global UNIQUE); imports
+-- generate one when the file has none. Each import keeps a checkpoint
+-- (the last file line committed), so a failed import resumes from there
+-- when the same file is uploaded again.
+-- =====================================================
+ALTER TABLE product MODIFY sku VARCHAR(50) NULL,
+    DROP INDEX sku,
+    ADD UNIQUE KEY uq_product_manufacturer_sku (manufacturer_id, sku);
+
+CREATE TABLE IF NOT EXISTS product_import (
+    import_id INT AUTO_INCREMENT PRIMARY KEY,
+    manufacturer_id INT NOT NULL,
+    filename VARCHAR(255),
+    status ENUM('running', 'completed', 'failed') NOT NULL DEFAULT 'running',
+    last_line INT NOT NULL DEFAULT 0,
+    inserted INT NOT NULL DEFAULT 0,
+    failed INT NOT NULL DEFAULT 0,
+    error VARCHAR(500) NULL,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP NULL,
+    FOREIGN KEY (manufacturer_id) REFERENCES manufacturer(manufacturer_id) ON DELETE CASCADE
+);
+
+-- =====================================================
+-- BULK INVENTORY ADJUSTMENTS
+-- Bulk adjustments (inventory_adjustment.py) update a whole chunk of
+-- rows with one join-update from a temporary staging table, then write
+-- reorder_log once for the chunk. They set @bulk_inventory_adjustment
+-- so this trigger skips its per-row reorder insert.
+-- =====================================================
+DROP TRIGGER IF EXISTS after_inventory_update;
+
+DELIMITER //
+
+CREATE TRIGGER after_inventory_update
+AFTER UPDATE ON inventory
+FOR EACH ROW
+BEGIN
+    IF NEW.quantity_available <= NEW.reorder_level AND @bulk_inventory_adjustment IS NULL THEN
+        INSERT INTO reorder_log (product_id, manufacturer_id, quantity_needed, status)
+        VALUES (
+            NEW.product_id,
+            NEW.manufacturer_id,
+            NEW.reorder_level * 2 - NEW.quantity_available,
+            'pending'
+        );
+    END IF;
+END//
+
+DELIMITER ;
+
+-- =====================================================
+-- RECONCILIATION
+-- `python consistency_check.py` compares each inventory row with its
+-- ledger adjustments plus the allocation and order rows since the ledger
+-- opened. These indexes keep the per-row lookups to index range reads.
+-- =====================================================
+CREATE INDEX idx_movement_owner_product ON inventory_movement(owner_type, owner_id, product_id, movement_type);
+CREATE INDEX idx_allocation_product_date ON allocation(product_id, allocation_date);
@@ -0,0 +1,223 @@
+# search_index.py - In-process inverted index (BM25 ranking) and prefix trie for product search
+
+import math
+import re
+import threading
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+FIELD_WEIGHTS = {'name': 3.0, 'sku': 4.0, 'category': 1.5, 'description': 1.0}
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_PREFIX_EXPANSIONS = 50
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+class PrefixTrie:
+    def __init__(self):
+        self._root = {}
+
+    def add(self, term):
+        node = self._root
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node['$'] = True
+
+    def remove(self, term):
+        path = [self._root]
+        for ch in term:
+            node = path[-1].get(ch)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].pop('$', None)
+        # Prune empty branches
+        for depth in range(len(term), 0, -1):
+            if path[depth]:
+                break
+            del path[depth - 1][term[depth - 1]]
+
+    def complete(self, prefix):
+        # Every indexed term starting with prefix
+        node = self._root
+        for ch in prefix:
+            node = node.get(ch)
+            if node is None:
+                return []
+        found = []
+        stack = [(node, prefix)]
+        while stack:
+            node, term = stack.pop()
+            for key, child in node.items():
+                if key == '$':
+                    found.append(term)
+                else:
+                    stack.append((child, term + key))
+        return found
+
+
+class ProductSearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}      # term -> {product_id: weighted term frequency}
+        self._doc_terms = {}     # product_id -> {term: weighted tf}
+        self._doc_length = {}    # product_id -> weighted length
+        self._names = {}         # product_id -> product name
+        self._categories = {}    # product_id -> category
+        self._total_length = 0.0
+        self.trie = PrefixTrie()
+        self.last_product_id = 0
+        self.loaded = False
+        self.stale = False
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    # ----------------------- indexing -----------------------
+
+    def add(self, product_id, name, description=None, sku=None, category=None):
+        terms = {}
+        for field, text in (('name', name), ('description', description), ('category', category)):
+            for token in tokenize(text):
+                terms[token] = terms.get(token, 0.0) + FIELD_WEIGHTS[field]
+        if sku:
+            sku_token = sku.lower()
+            terms[sku_token] = terms.get(sku_token, 0.0) + FIELD_WEIGHTS['sku']
+            for token in tokenize(sku):
+                terms[token] = terms.get(token, 0.0) + FIELD_WEIGHTS['sku']
+
+        with self._lock:
+            self.remove(product_id)
+            for term, tf in terms.items():
+                postings = self._postings.setdefault(term, {})
+                if not postings:
+                    self.trie.add(term)
+                postings[product_id] = tf
+            length = sum(terms.values())
+            self._doc_terms[product_id] = terms
+            self._doc_length[product_id] = length
+            self._names[product_id] = name
+            self._categories[product_id] = category
+            self._total_length += length
+            self.last_product_id = max(self.last_product_id, product_id)
+
+    def remove(self, product_id):
+        with self._lock:
+            terms = self._doc_terms.pop(product_id, None)
+            if terms is None:
+                return
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                postings.pop(product_id, None)
+                if not postings:
+                    del self._postings[term]
+                    self.trie.remove(term)
+            self._total_length -= self._doc_length.pop(product_id)
+            self._names.pop(product_id, None)
+            self._categories.pop(product_id, None)
+
+    def load(self, cursor, since_product_id=0):
+        # Full build (since 0) or incremental catch-up of newly added products
+        cursor.execute("""
+            SELECT product_id, product_name, description, sku, category
+            FROM product
+            WHERE product_id > %s
+            ORDER BY product_id
+        """, (since_product_id,))
+        count = 0
+        for product_id, name, description, sku, category in cursor.fetchall():
+            self.add(product_id, name, description, sku, category)
+            count += 1
+        with self._lock:
+            self.loaded = True
+            self.stale = False
+        return count
+
+    def mark_stale(self):
+        self.stale = True
+
+    # ----------------------- querying -----------------------
+
+    def _complete(self, prefix, limit=MAX_PREFIX_EXPANSIONS):
+        # Prefix completions, most common terms first
+        terms = self.trie.complete(prefix)
+        terms.sort(key=lambda term: (-len(self._postings[term]), term))
+        return terms[:limit]
+
+    def _expand(self, token, prefix):
+        if not prefix:
+            return [token] if token in self._postings else []
+        return self._complete(token)
+
+    def search(self, query, category=None, page=1, per_page=20):
+        tokens = tokenize(query)
+        if not tokens:
+            return {'total': 0, 'page': page, 'per_page': per_page, 'results': []}
+
+        with self._lock:
+            doc_count = len(self._doc_terms) or 1
+            avg_length = self._total_length / doc_count if self._total_length else 1.0
+            scores = None
+            # Every query token must match; the last one also matches as a prefix
+            for position, token in enumerate(tokens):
+                expansions = self._expand(token, prefix=position == len(tokens) - 1)
+                token_scores = {}
+                for term in expansions:
+                    postings = self._postings[term]
+                    idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    # Exact hits outrank prefix completions
+                    boost = 1.0 if term == token else 0.6
+                    for product_id, tf in postings.items():
+                        norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self._doc_length[product_id] / avg_length)
+                        score = boost * idf * tf * (BM25_K1 + 1) / norm
+                        if score > token_scores.get(product_id, 0.0):
+                            token_scores[product_id] = score
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {pid: scores[pid] + s for pid, s in token_scores.items() if pid in scores}
+                if not scores:
+                    break
+
+            scores = scores or {}
+            if category:
+                scores = {pid: s for pid, s in scores.items() if self._categories.get(pid) == category}
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], self._names[item[0]]))
+
+        start = (page - 1) * per_page
+        return {
+            'total': len(ranked),
+            'page': page,
+            'per_page': per_page,
+            'results': [{'product_id': pid, 'score': round(score, 4)} for pid, score in ranked[start:start + per_page]],
+        }
+
+    def autocomplete(self, prefix, limit=10):
+        tokens = tokenize(prefix)
+        if not tokens:
+            return {'terms': [], 'products': []}
+        with self._lock:
+            completions = self._complete(tokens[-1], limit)
+            head = ' '.join(tokens[:-1])
+            suggestions = [f'{head} {term}'.strip() for term in completions]
+            # Product names containing the completed words, best match first
+            found = self.search(prefix, per_page=limit)['results']
+            products = [{'product_id': r['product_id'], 'product_name': self._names[r['product_id']]} for r in found]
+        return {'terms': suggestions, 'products': products}
+
+
+product_search_index = ProductSearchIndex()
+
+
+def ensure_index(cursor):
+    # Lazily build on first use, then catch up on products added since
+    index = product_search_index
+    if not index.loaded:
+        index.load(cursor)
+    elif index.stale:
+        index.load(cursor, index.last_product_id)
+    return index
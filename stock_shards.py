@@ -0,0 +1,273 @@
+# stock_shards.py - Sharded stock counters for hot products
+#
+# A hot (seller, product) keeps its stock in N stock_shard slot rows instead of
+# the single inventory / distributor_inventory row, so concurrent orders
+# decrement different rows. The parent row's quantity_available becomes a
+# mirror of the slot total, refreshed by the sync loop; any other write to the
+# parent's quantity is redirected into slot 0 by a trigger.
+#
+#   python stock_shards.py enable distributor 3 17 --slots 8
+#   python stock_shards.py disable distributor 3 17
+#   python stock_shards.py sync                       # refresh mirrors every second
+#   python stock_shards.py sync --once
+
+import random
+import time
+
+DEFAULT_SLOTS = 8
+MAX_SLOTS = 64
+CLAIM_ATTEMPTS = 3
+DEFAULT_SYNC_INTERVAL = 1.0
+
+# owner_type -> (parent table, owner column)
+PARENTS = {
+    'manufacturer': ('inventory', 'manufacturer_id'),
+    'distributor': ('distributor_inventory', 'distributor_id'),
+}
+
+
+def _split(total, slots):
+    # Even split; the remainder goes to the first slots
+    base, extra = divmod(max(total, 0), slots)
+    shares = [base + (1 if slot < extra else 0) for slot in range(slots)]
+    # A negative total (oversold) stays visible in slot 0
+    shares[0] += min(total, 0)
+    return shares
+
+
+# ======================= ENABLE / DISABLE =======================
+
+def enable_sharding(conn, owner_type, owner_id, product_id, slots=DEFAULT_SLOTS):
+    table, owner_column = PARENTS[owner_type]
+    slots = min(max(int(slots), 2), MAX_SLOTS)
+    cursor = conn.cursor()
+    conn.start_transaction()
+    try:
+        cursor.execute(f"""SELECT quantity_available, stock_slots FROM {table}
+                           WHERE {owner_column} = %s AND product_id = %s
+                           FOR UPDATE""", (owner_id, product_id))
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError('Inventory row not found')
+        if row[1]:
+            conn.rollback()
+            return row[1]
+
+        shares = _split(row[0], slots)
+        cursor.execute(f"""INSERT INTO stock_shard (owner_type, owner_id, product_id, slot, quantity)
+                           VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * slots)}""",
+                       [field for slot, quantity in enumerate(shares)
+                        for field in (owner_type, owner_id, product_id, slot, quantity)])
+        cursor.execute(f"""UPDATE {table} SET stock_slots = %s
+                           WHERE {owner_column} = %s AND product_id = %s""", (slots, owner_id, product_id))
+        conn.commit()
+        return slots
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def disable_sharding(conn, owner_type, owner_id, product_id):
+    # Folds the slots back into the parent row
+    table, owner_column = PARENTS[owner_type]
+    cursor = conn.cursor()
+    conn.start_transaction()
+    try:
+        cursor.execute(f"""SELECT stock_slots FROM {table}
+                           WHERE {owner_column} = %s AND product_id = %s
+                           FOR UPDATE""", (owner_id, product_id))
+        row = cursor.fetchone()
+        if not row or not row[0]:
+            conn.rollback()
+            return None
+        total = _lock_slots(cursor, owner_type, owner_id, product_id)[1]
+        cursor.execute(f"""UPDATE {table} SET stock_slots = 0, quantity_available = %s
+                           WHERE {owner_column} = %s AND product_id = %s""", (total, owner_id, product_id))
+        cursor.execute("""DELETE FROM stock_shard
+                          WHERE owner_type = %s AND owner_id = %s AND product_id = %s""",
+                       (owner_type, owner_id, product_id))
+        conn.commit()
+        return total
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+# ======================= CLAIM =======================
+
+def _lock_slots(cursor, owner_type, owner_id, product_id):
+    # Slot order, so two rebalancers can't deadlock
+    cursor.execute("""SELECT slot, quantity FROM stock_shard
+                      WHERE owner_type = %s AND owner_id = %s AND product_id = %s
+                      ORDER BY slot
+                      FOR UPDATE""", (owner_type, owner_id, product_id))
+    rows = cursor.fetchall()
+    return [row[0] for row in rows], sum(row[1] for row in rows)
+
+
+def lock_slot_totals(cursor, owner_type, owner_id, product_ids):
+    # Locks every slot of these products until the caller commits, so no order can claim from
+    # them in between; {product_id: (slot ids, true total)} for the ones that are sharded.
+    # Take the parent rows' locks first, as enable / disable do.
+    if not product_ids:
+        return {}
+    cursor.execute(f"""SELECT product_id, slot, quantity FROM stock_shard
+                       WHERE owner_type = %s AND owner_id = %s
+                         AND product_id IN ({', '.join(['%s'] * len(product_ids))})
+                       ORDER BY product_id, slot
+                       FOR UPDATE""", (owner_type, owner_id, *sorted(product_ids)))
+    totals = {}
+    for product_id, slot, quantity in cursor.fetchall():
+        slot_ids, total = totals.get(product_id, ([], 0))
+        slot_ids.append(slot)
+        totals[product_id] = (slot_ids, total + quantity)
+    return totals
+
+
+def set_slot_total(cursor, owner_type, owner_id, product_id, slot_ids, total):
+    # Spread total evenly over slots the caller has locked. An absolute count for a sharded row
+    # goes here, not into the parent: an UPDATE of the stale mirror would be applied to slot 0 as NEW - OLD
+    cursor.executemany("""UPDATE stock_shard SET quantity = %s
+                          WHERE owner_type = %s AND owner_id = %s AND product_id = %s AND slot = %s""",
+                       [(share, owner_type, owner_id, product_id, slot)
+                        for slot, share in zip(slot_ids, _split(total, len(slot_ids)))])
+
+
+def claim_from_slots(cursor, owner_type, owner_id, product_id, quantity, slots):
+    # Random slots first; only when none can cover the quantity are all slots locked and rebalanced.
+    # Returns True / False, or None when the product is no longer sharded.
+    for slot in random.sample(range(slots), min(CLAIM_ATTEMPTS, slots)):
+        cursor.execute("""UPDATE stock_shard SET quantity = quantity - %s
+                          WHERE owner_type = %s AND owner_id = %s AND product_id = %s
+                            AND slot = %s AND quantity >= %s""",
+                       (quantity, owner_type, owner_id, product_id, slot, quantity))
+        if cursor.rowcount == 1:
+            return True
+
+    slot_ids, total = _lock_slots(cursor, owner_type, owner_id, product_id)
+    if not slot_ids:
+        return None
+    if total < quantity:
+        return False
+    set_slot_total(cursor, owner_type, owner_id, product_id, slot_ids, total - quantity)
+    return True
+
+
+def take_stock(conn, owner_type, owner_id, product_id, quantity, slots=0):
+    # Decrement stock for an order inside the caller's transaction; slots is the stock_slots value it read
+    table, owner_column = PARENTS[owner_type]
+    cursor = conn.cursor()
+    try:
+        if slots:
+            taken = claim_from_slots(cursor, owner_type, owner_id, product_id, quantity, slots)
+            if taken is not None:
+                return taken
+
+        cursor.execute(f"""UPDATE {table}
+                           SET quantity_available = quantity_available - %s
+                           WHERE {owner_column} = %s AND product_id = %s
+                             AND stock_slots = 0 AND quantity_available >= %s""",
+                       (quantity, owner_id, product_id, quantity))
+        if cursor.rowcount == 1:
+            return True
+
+        # Sharding may have been switched on since the caller read the row
+        cursor.execute(f"SELECT stock_slots FROM {table} WHERE {owner_column} = %s AND product_id = %s",
+                       (owner_id, product_id))
+        row = cursor.fetchone()
+        if row and row[0] and not slots:
+            return bool(claim_from_slots(cursor, owner_type, owner_id, product_id, quantity, row[0]))
+        return False
+    finally:
+        cursor.close()
+
+
+def live_quantity_sql(owner_type, alias):
+    # Expression for a row's true stock: slot total when sharded, else the column itself
+    table, owner_column = PARENTS[owner_type]
+    return f"""IF({alias}.stock_slots > 0,
+                  (SELECT COALESCE(SUM(s.quantity), 0) FROM stock_shard s
+                   WHERE s.owner_type = '{owner_type}' AND s.owner_id = {alias}.{owner_column}
+                     AND s.product_id = {alias}.product_id),
+                  {alias}.quantity_available)"""
+
+
+# ======================= MIRROR SYNC =======================
+
+def sync_mirrors(conn):
+    # Copy slot totals into the parent rows; the session flag keeps the redirect trigger out of
+    # the way and leaves row_version as it is, so editors' compare-and-set is not disturbed
+    cursor = conn.cursor()
+    updated = 0
+    try:
+        cursor.execute("SET @stock_mirror_sync = 1")
+        for owner_type, (table, owner_column) in PARENTS.items():
+            cursor.execute(f"""
+                UPDATE {table} t
+                JOIN (SELECT owner_id, product_id, SUM(quantity) AS total
+                      FROM stock_shard
+                      WHERE owner_type = %s
+                      GROUP BY owner_id, product_id) s
+                  ON t.{owner_column} = s.owner_id AND t.product_id = s.product_id
+                SET t.quantity_available = s.total
+                WHERE t.stock_slots > 0 AND t.quantity_available <> s.total
+            """, (owner_type,))
+            updated += cursor.rowcount
+    finally:
+        cursor.execute("SET @stock_mirror_sync = NULL")
+        cursor.close()
+    return updated
+
+
+def run_sync(connect, interval=DEFAULT_SYNC_INTERVAL):
+    conn = connect()
+    while True:
+        try:
+            sync_mirrors(conn)
+        except Exception as err:
+            print(f"Stock mirror sync failed, reconnecting: {err}")
+            try:
+                conn.close()
+            except Exception:
+                pass
+            conn = connect()
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from app import get_db_connection
+
+    parser = argparse.ArgumentParser(description='Sharded stock counters for hot products')
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name in ('enable', 'disable'):
+        command = commands.add_parser(name)
+        command.add_argument('owner_type', choices=sorted(PARENTS))
+        command.add_argument('owner_id', type=int)
+        command.add_argument('product_id', type=int)
+        if name == 'enable':
+            command.add_argument('--slots', type=int, default=DEFAULT_SLOTS)
+    sync = commands.add_parser('sync')
+    sync.add_argument('--interval', type=float, default=DEFAULT_SYNC_INTERVAL)
+    sync.add_argument('--once', action='store_true')
+    args = parser.parse_args()
+
+    if args.command == 'sync' and not args.once:
+        run_sync(get_db_connection, args.interval)
+    else:
+        conn = get_db_connection()
+        if args.command == 'enable':
+            slots = enable_sharding(conn, args.owner_type, args.owner_id, args.product_id, args.slots)
+            print(f"{args.owner_type} {args.owner_id} product {args.product_id}: {slots} stock slots")
+            print("quantity_available is now a mirror: keep `python stock_shards.py sync` running")
+        elif args.command == 'disable':
+            total = disable_sharding(conn, args.owner_type, args.owner_id, args.product_id)
+            print("Not sharded" if total is None else f"Folded back into one row: {total} units")
+        else:
+            print(f"Refreshed {sync_mirrors(conn)} mirror rows")
+        conn.close()
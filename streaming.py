@@ -0,0 +1,113 @@
+# streaming.py - Row-at-a-time listing responses (HTML through stream_template, NDJSON for API clients)
+
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import current_app, request, stream_template, stream_with_context
+
+STREAM_BATCH_SIZE = 500
+FLUSH_BYTES = 16 * 1024
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+class RowStream:
+    # Reads an unbuffered cursor in fetchmany batches on a dedicated connection,
+    # so only one batch of rows is held in memory at a time.
+
+    def __init__(self, connect, sql, params=(), batch_size=STREAM_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._conn = connect()
+        self._cursor = self._conn.cursor(dictionary=True, buffered=False)
+        self._exhausted = False
+        self._started = False
+        self._closed = False
+        try:
+            self._cursor.execute(sql, params)
+            # First batch eagerly: query errors surface before the response starts
+            self._batch = self._fetch()
+        except Exception:
+            self.close()
+            raise
+
+    def _fetch(self):
+        batch = self._cursor.fetchmany(self.batch_size)
+        if len(batch) < self.batch_size:
+            self._exhausted = True
+        return batch
+
+    def __bool__(self):
+        # Templates test `{% if rows %}` and never loop over an empty result,
+        # so nothing else would give its connection back
+        if not self._batch and self._exhausted and not self._started:
+            self.close()
+        return bool(self._batch)
+
+    def __iter__(self):
+        self._started = True
+        try:
+            batch = self._batch
+            self._batch = []
+            while batch:
+                yield from batch
+                batch = [] if self._exhausted else self._fetch()
+        finally:
+            self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._exhausted:
+            self._cursor.close()
+            self._conn.close()
+        else:
+            # Client went away mid-result: drop the socket instead of reading the rest
+            self._conn.shutdown()
+
+
+def coalesce(chunks, size=FLUSH_BYTES):
+    # Jinja yields one tiny chunk per statement; send them in larger writes
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= size:
+            yield ''.join(pending)
+            pending = []
+            pending_size = 0
+    if pending:
+        yield ''.join(pending)
+
+
+def wants_ndjson():
+    return (request.args.get('format') == 'ndjson'
+            or request.accept_mimetypes.best == NDJSON_MIMETYPE)
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _close_with(response, streams):
+    # Runs when the server closes the response, whether or not the body was ever read
+    for stream in streams:
+        if isinstance(stream, RowStream):
+            response.call_on_close(stream.close)
+    return response
+
+
+def ndjson_response(rows):
+    lines = (json.dumps(row, default=_json_default) + '\n' for row in rows)
+    response = current_app.response_class(stream_with_context(coalesce(lines)), mimetype=NDJSON_MIMETYPE)
+    return _close_with(response, [rows])
+
+
+def stream_page(template_name, **context):
+    response = current_app.response_class(coalesce(stream_template(template_name, **context)))
+    return _close_with(response, context.values())
@@ -0,0 +1,120 @@
+# conftest.py - Puts the application modules on sys.path and provides a scripted fake database
+#
+# FakeConnection answers each statement from the first handler whose pattern occurs in
+# the (whitespace-collapsed) SQL. A handler returns rows (a list), a rowcount (an int)
+# or None, or raises to simulate a database error. Every statement and every
+# start_transaction / commit / rollback is logged in order, so tests can assert what
+# was written and whether it was committed.
+
+import os
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def normalize(sql):
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+class FakeCursor:
+    def __init__(self, conn, dictionary=False):
+        self.conn = conn
+        self.dictionary = dictionary
+        self.rows = []
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def execute(self, sql, params=()):
+        sql = normalize(sql)
+        self.conn.log.append((sql, tuple(params or ())))
+        for pattern, handler in self.conn.handlers:
+            if pattern in sql:
+                result = handler(tuple(params or ()))
+                break
+        else:
+            result = None
+        if isinstance(result, list):
+            self.rows, self.rowcount = list(result), len(result)
+        else:
+            self.rows, self.rowcount = [], result if isinstance(result, int) else 0
+        if sql.startswith('INSERT'):
+            self.conn.last_insert_id += 1
+            self.lastrowid = self.conn.last_insert_id
+
+    def executemany(self, sql, seq_params):
+        for params in seq_params:
+            self.execute(sql, params)
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchmany(self, size=1):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, handlers=()):
+        self.handlers = list(handlers)
+        self.log = []
+        self.last_insert_id = 0
+
+    def on(self, pattern, handler):
+        # Later registrations win over earlier ones
+        self.handlers.insert(0, (pattern, handler if callable(handler) else (lambda params: handler)))
+        return self
+
+    def cursor(self, dictionary=False, buffered=None):
+        return FakeCursor(self, dictionary)
+
+    def start_transaction(self):
+        self.log.append(('START TRANSACTION', ()))
+
+    def commit(self):
+        self.log.append(('COMMIT', ()))
+
+    def rollback(self):
+        self.log.append(('ROLLBACK', ()))
+
+    def close(self):
+        self.log.append(('CLOSE', ()))
+
+    def shutdown(self):
+        self.log.append(('SHUTDOWN', ()))
+
+    def statements(self, pattern=''):
+        return [(sql, params) for sql, params in self.log if pattern in sql]
+
+
+@pytest.fixture
+def fake_conn():
+    return FakeConnection()
+
+
+@pytest.fixture
+def client(monkeypatch, fake_conn):
+    # The Flask app with every connection served by fake_conn; background pollers stay off
+    import app as app_module
+    monkeypatch.setattr(app_module, 'get_db_connection', lambda: fake_conn)
+    monkeypatch.setattr(app_module.invalidation_bus, 'start', lambda: None)
+    monkeypatch.setattr(app_module.invalidation_bus, 'poll', lambda force=False: 0)
+    monkeypatch.setitem(app_module.outbox_config, 'embedded_relay', False)
+    app_module.reference_cache.clear()
+    app_module.app.config['TESTING'] = True
+    return app_module.app.test_client()
+
+
+def login(client, user_type, user_id=1):
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+        session['user_type'] = user_type
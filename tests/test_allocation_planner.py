@@ -0,0 +1,47 @@
+# test_allocation_planner.py - compute_plan on in-memory rows
+
+from allocation_planner import DEFAULT_DIST_REORDER_LEVEL, compute_plan
+
+
+def by_pair(plan):
+    return {(row['distributor_id'], row['product_id']): row for row in plan}
+
+
+def test_empty_inputs():
+    assert compute_plan([], [], []) == []
+    assert compute_plan([(10, 100, 0)], [], []) == []
+
+
+def test_plentiful_stock_fills_every_need():
+    plan = by_pair(compute_plan([(10, 1000, 0)], [(1, 10, 20, 50), (2, 10, 60, 50)], []))
+    assert plan[(1, 10)]['need'] == plan[(1, 10)]['proposed_quantity'] == 30
+    # Already above its reorder level with no sales: nothing to send
+    assert (2, 10) not in plan
+
+
+def test_scarce_stock_is_shared_and_fully_handed_out():
+    stock = [(1, 10, 0, 50), (2, 10, 0, 50), (3, 10, 0, 50)]
+    plan = compute_plan([(10, 100, 0)], stock, [])
+    proposed = sorted(row['proposed_quantity'] for row in plan)
+    assert proposed == [33, 33, 34]
+
+
+def test_reserve_is_kept_unless_disabled():
+    stock = [(1, 10, 0, 50)]
+    assert compute_plan([(10, 70, 40)], stock, [])[0]['proposed_quantity'] == 30
+    assert compute_plan([(10, 70, 40)], stock, [], keep_reserve=False)[0]['proposed_quantity'] == 50
+
+
+def test_sales_drive_the_target_and_default_reorder_level():
+    # 60 units in 30 days = 2/day; 21 days of cover = 42, under the default reorder level
+    plan = by_pair(compute_plan([(10, 1000, 0)], [], [(5, 10, 60)]))
+    assert plan[(5, 10)]['target_stock'] == DEFAULT_DIST_REORDER_LEVEL
+    # 300 units in 30 days = 10/day -> 210 target, minus 15 on hand
+    plan = by_pair(compute_plan([(10, 1000, 0)], [(5, 10, 15, None)], [(5, 10, 300)]))
+    assert plan[(5, 10)]['target_stock'] == 210
+    assert plan[(5, 10)]['need'] == 195
+
+
+def test_products_the_manufacturer_no_longer_stocks_are_dropped():
+    plan = compute_plan([(10, 100, 0)], [(1, 11, 0, 50)], [(1, 9, 30)])
+    assert plan == []
@@ -0,0 +1,151 @@
+# test_bulk_allocation.py - Bulk allocation parsing, validation and chunked apply
+
+import io
+from decimal import Decimal
+
+import mysql.connector
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import bulk_allocation
+
+
+def upload(text, filename='upload.csv'):
+    return FileStorage(stream=io.BytesIO(text.encode('utf-8')), filename=filename)
+
+
+# ======================= PARSING =======================
+
+def test_allocation_csv_ignores_fields_past_the_header():
+    lines = bulk_allocation.parse_csv_lines(upload(
+        "distributor_id,product_id,quantity\n"
+        "1,2,3,extra,columns\n"
+        "4,5,6\n"))
+    assert [(l['line'], l['distributor_id'], l['product_id'], l['quantity']) for l in lines] == [
+        (2, '1', '2', '3'),
+        (3, '4', '5', '6'),
+    ]
+
+
+def test_allocation_csv_short_row_leaves_fields_empty():
+    lines = bulk_allocation.parse_csv_lines(upload("distributor_id,product_id,quantity\n1,2\n"))
+    assert lines[0]['quantity'] == ''
+
+
+def test_allocation_csv_requires_header_columns():
+    with pytest.raises(ValueError):
+        bulk_allocation.parse_csv_lines(upload("distributor_id,quantity\n1,3\n"))
+
+
+def test_allocation_json_accepts_list_or_wrapper():
+    rows = [{'distributor_id': 1, 'product_id': 2, 'quantity': 3}, 'junk']
+    assert bulk_allocation.parse_json_lines(rows) == bulk_allocation.parse_json_lines({'allocations': rows})
+    lines = bulk_allocation.parse_json_lines(rows)
+    assert lines[1] == {'line': 2, 'distributor_id': None, 'product_id': None, 'quantity': None}
+
+
+def test_allocation_json_rejects_too_many_lines(monkeypatch):
+    monkeypatch.setattr(bulk_allocation, 'MAX_LINES', 2)
+    with pytest.raises(ValueError):
+        bulk_allocation.parse_json_lines([{}] * 3)
+
+
+@pytest.mark.parametrize('line, error', [
+    ({'distributor_id': '1', 'product_id': '2', 'quantity': '3'}, None),
+    ({'distributor_id': '1', 'product_id': 'x', 'quantity': '3'}, 'must be integers'),
+    ({'distributor_id': '1', 'product_id': '2', 'quantity': '0'}, 'greater than zero'),
+])
+def test_allocation_coerce(line, error):
+    result = bulk_allocation._coerce(dict(line))
+    assert (result is None) if error is None else (error in result)
+
+
+def test_distributor_price_rounds_to_cents():
+    assert bulk_allocation.distributor_price('33.05') == Decimal('36.36')
+
+
+# ======================= APPLY =======================
+
+def line(number, distributor_id, product_id, quantity):
+    return {'line': number, 'distributor_id': distributor_id, 'product_id': product_id,
+            'quantity': quantity, 'status': 'valid', 'message': None}
+
+
+def inventory(fake_conn, locked_quantity, quantity=100, stock_slots=0):
+    # Plain validation read and the locked re-read of one product (id 10)
+    fake_conn.on('SELECT i.product_id', [(10, quantity, Decimal('5.00'), Decimal('8.00'))])
+    fake_conn.on('FOR UPDATE OF i', [(10, locked_quantity, stock_slots, Decimal('5.00'), Decimal('8.00'))])
+    fake_conn.on('FROM distributor WHERE', [(1,), (2,)])
+
+
+def test_run_allocates_and_records_both_sides(fake_conn):
+    inventory(fake_conn, 100)
+    lines = bulk_allocation.parse_json_lines([{'distributor_id': 1, 'product_id': 10, 'quantity': 30},
+                                              {'distributor_id': 2, 'product_id': 10, 'quantity': 20}])
+    report = bulk_allocation.run_bulk_allocation(fake_conn, 7, lines)
+
+    assert report['summary'] == {'total_lines': 2, 'allocated': 2, 'failed': 0, 'units_allocated': 50}
+    assert report['results'][0]['unit_price'] == '8.80'
+    # One decrement for the product's whole demand in the chunk
+    assert [params for _, params in fake_conn.statements('UPDATE inventory')] == [(50, 10, 7)]
+    movements = fake_conn.statements('INSERT INTO inventory_movement')[0][1]
+    assert movements.count('allocation_out') == 2 and movements.count('allocation_in') == 2
+    assert fake_conn.log[-1][0] == 'COMMIT'
+
+
+def test_stock_drained_since_validation_rejects_the_product(fake_conn):
+    inventory(fake_conn, locked_quantity=40)
+    chunk = [line(2, 1, 10, 30), line(3, 2, 10, 20)]
+    bulk_allocation.apply_lines(fake_conn, 7, chunk, {})
+
+    assert [l['message'] for l in chunk] == ['Stock changed since validation'] * 2
+    assert not fake_conn.statements('INSERT INTO allocation')
+    assert fake_conn.log[-1][0] == 'ROLLBACK'
+
+
+def test_failed_chunk_rolls_back_and_the_next_one_applies(fake_conn):
+    inventory(fake_conn, 100)
+    failures = iter([mysql.connector.errors.DatabaseError(msg='Deadlock found', errno=1213)])
+
+    def upsert(params):
+        error = next(failures, None)
+        if error:
+            raise error
+        return 1
+    fake_conn.on('INSERT INTO distributor_inventory', upsert)
+
+    chunks = [line(2, 1, 10, 5), line(3, 2, 10, 5)]
+    bulk_allocation.apply_lines(fake_conn, 7, chunks, {}, chunk_size=1)
+
+    assert chunks[0]['status'] == 'error' and chunks[0]['message'] == 'Chunk rolled back: Deadlock found'
+    assert chunks[1]['status'] == 'allocated'
+    outcomes = [sql for sql, _ in fake_conn.log if sql in ('COMMIT', 'ROLLBACK')]
+    assert outcomes == ['ROLLBACK', 'COMMIT']
+
+
+def sharded(fake_conn, slots):
+    fake_conn.on('FROM stock_shard', [(10, slot, quantity) for slot, quantity in enumerate(slots)])
+
+
+def test_sharded_product_is_checked_against_its_slots(fake_conn):
+    # The parent's quantity (100) is a stale mirror; the slots hold 6
+    inventory(fake_conn, locked_quantity=100, stock_slots=4)
+    sharded(fake_conn, [3, 1, 1, 1])
+    chunk = [line(2, 1, 10, 30)]
+    bulk_allocation.apply_lines(fake_conn, 7, chunk, {})
+
+    assert chunk[0]['message'] == 'Stock changed since validation'
+    assert 'FOR UPDATE' in fake_conn.statements('FROM stock_shard')[0][0]
+    assert fake_conn.log[-1][0] == 'ROLLBACK'
+
+
+def test_sharded_product_is_taken_from_its_slots(fake_conn):
+    inventory(fake_conn, locked_quantity=100, stock_slots=4)
+    sharded(fake_conn, [3, 1, 1, 1])
+    chunk = [line(2, 1, 10, 2)]
+    bulk_allocation.apply_lines(fake_conn, 7, chunk, {})
+
+    assert chunk[0]['status'] == 'allocated'
+    assert not fake_conn.statements('UPDATE inventory')
+    written = [params[0] for _, params in fake_conn.statements('UPDATE stock_shard SET quantity = %s')]
+    assert written == [1, 1, 1, 1]
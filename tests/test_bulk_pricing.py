@@ -0,0 +1,131 @@
+# test_bulk_pricing.py - Repricing payloads, rules and the price floor
+
+from decimal import Decimal
+
+import pytest
+
+import bulk_pricing
+
+
+# ======================= PARSING =======================
+
+def test_price_lines_round_and_keep_price_version():
+    lines = bulk_pricing.parse_price_lines([{'dist_inventory_id': '4', 'new_price': '12.345', 'price_version': '9'},
+                                            {'dist_inventory_id': 5, 'new_price': 3, 'price_version': ''}])
+    assert lines == [{'dist_inventory_id': 4, 'new_price': Decimal('12.34'), 'price_version': 9},
+                     {'dist_inventory_id': 5, 'new_price': Decimal('3.00'), 'price_version': None}]
+
+
+@pytest.mark.parametrize('row', [
+    {'dist_inventory_id': 'x', 'new_price': '1'},
+    {'dist_inventory_id': 1, 'new_price': '0'},
+    {'dist_inventory_id': 1, 'new_price': 'abc'},
+    {'dist_inventory_id': 1, 'new_price': '1', 'price_version': 'v2'},
+])
+def test_price_lines_reject_bad_rows(row):
+    with pytest.raises(ValueError):
+        bulk_pricing.parse_price_lines([row])
+
+
+def test_rule_percent_is_a_multiplier():
+    rule = bulk_pricing.parse_rule({'percent': 25, 'base': 'cost_price'})
+    assert rule == {'category': None, 'base': 'cost_price', 'multiplier': Decimal('1.25'), 'amount': Decimal('0')}
+    with pytest.raises(ValueError):
+        bulk_pricing.parse_rule({'base': 'list_price'})
+    with pytest.raises(ValueError):
+        bulk_pricing.parse_rule({'percent': -100})
+
+
+def test_pricing_payload_needs_prices_or_rule():
+    assert bulk_pricing.parse_pricing_payload({'rule': {'amount': 1}})[0] is None
+    with pytest.raises(ValueError):
+        bulk_pricing.parse_pricing_payload({})
+
+
+def test_price_floor_uses_decimal_rounding():
+    assert bulk_pricing.price_floor(Decimal('33.05')) == Decimal('36.36')
+
+
+def test_price_ceiling_keeps_the_markup_in_range():
+    assert bulk_pricing.price_ceiling(Decimal('1.00')) == Decimal('10.99')
+    assert bulk_pricing._markup(Decimal('1.00'), Decimal('10.99')) == Decimal('999.00')
+    assert bulk_pricing._markup(Decimal('1.00'), Decimal('50')) == Decimal('999.99')
+    assert bulk_pricing._markup(None, Decimal('5')) is None
+
+
+# ======================= APPLY =======================
+
+def inventory(fake_conn, *rows):
+    # rows: (dist_inventory_id, cost_price, unit_price, price_version)
+    fake_conn.on('FROM distributor_inventory di',
+                 [(item_id, 100 + item_id, cost, unit, version) for item_id, cost, unit, version in rows])
+
+
+def line(item_id, price, price_version=None):
+    return {'dist_inventory_id': item_id, 'new_price': Decimal(price), 'price_version': price_version}
+
+
+def statuses(report):
+    return {result['dist_inventory_id']: result['status'] for result in report['results']}
+
+
+def test_prices_compare_the_price_version(fake_conn):
+    inventory(fake_conn, (1, Decimal('10'), Decimal('12'), 3))
+    fake_conn.on('UPDATE distributor_inventory di', 1)
+    report = bulk_pricing.apply_prices(fake_conn, 9, 2, lines=[line(1, '13.50', 3)])
+
+    assert statuses(report) == {1: 'updated'}
+    assert report['results'][0]['price_version'] == 4
+    (sql, params), = fake_conn.statements('UPDATE distributor_inventory')
+    assert 'di.price_version = np.price_version' in sql
+    assert params == (1, Decimal('13.50'), 3, 9)
+    assert fake_conn.log[-1] == ('COMMIT', ())
+
+
+def test_stale_price_version_is_a_conflict(fake_conn):
+    inventory(fake_conn, (1, Decimal('10'), Decimal('12'), 4), (2, Decimal('10'), Decimal('12'), 0))
+    report = bulk_pricing.apply_prices(fake_conn, 9, 2, lines=[line(1, '13', 3), line(2, '14', 0)])
+
+    assert statuses(report) == {1: 'conflict', 2: 'unchanged'}
+    assert report['results'][0]['price_version'] == 4
+    assert not fake_conn.statements('UPDATE')
+
+
+def test_lost_race_rolls_back_and_reports_the_moved_rows(fake_conn):
+    versions = iter([[(1, 101, Decimal('10'), Decimal('12'), 3), (2, 102, Decimal('10'), Decimal('12'), 0)],
+                     [(1, 101, Decimal('10'), Decimal('12.50'), 4), (2, 102, Decimal('10'), Decimal('12'), 0)]])
+    fake_conn.on('FROM distributor_inventory di', lambda params: next(versions))
+    fake_conn.on('UPDATE distributor_inventory di', 1)
+    report = bulk_pricing.apply_prices(fake_conn, 9, 2, lines=[line(1, '13'), line(2, '14')])
+
+    assert statuses(report) == {1: 'conflict', 2: 'unchanged'}
+    assert report['summary']['updated'] == 0
+    assert ('ROLLBACK', ()) in fake_conn.log
+    assert not fake_conn.statements('INSERT INTO price_change_history')
+
+
+def test_rows_without_a_cost_skip_the_floor(fake_conn):
+    inventory(fake_conn, (1, None, Decimal('12'), 0))
+    fake_conn.on('UPDATE distributor_inventory di', 1)
+    report = bulk_pricing.apply_prices(fake_conn, 9, 2, lines=[line(1, '5')])
+
+    assert statuses(report) == {1: 'updated'}
+    (_, params), = fake_conn.statements('INSERT INTO price_change_history')
+    assert params[5:7] == (None, None)
+
+
+def test_cost_rule_rejects_rows_without_a_cost(fake_conn):
+    inventory(fake_conn, (1, None, Decimal('12'), 0), (2, Decimal('10'), Decimal('12'), 0))
+    fake_conn.on('UPDATE distributor_inventory di', 1)
+    rule = bulk_pricing.parse_rule({'base': 'cost_price', 'percent': 50})
+    report = bulk_pricing.apply_prices(fake_conn, 9, 2, rule=rule)
+    assert statuses(report) == {1: 'error', 2: 'updated'}
+
+
+def test_markup_overflow_is_rejected_per_row(fake_conn):
+    inventory(fake_conn, (1, Decimal('1'), Decimal('2'), 0), (2, Decimal('10'), Decimal('12'), 0))
+    fake_conn.on('UPDATE distributor_inventory di', 1)
+    report = bulk_pricing.apply_prices(fake_conn, 9, 2, lines=[line(1, '11'), line(2, '14')])
+
+    assert statuses(report) == {1: 'error', 2: 'updated'}
+    assert '10.99' in report['results'][0]['message']
@@ -0,0 +1,41 @@
+# test_catalog_snapshot.py - Snapshot round trip, id lookups and the reader's age limit
+
+import os
+import time
+
+from catalog_snapshot import SnapshotReader, write_snapshot
+
+ROWS = [
+    # product_id, name, description, category, manufacturer, best_price_cents, stock
+    (7, 'Anvil', 'Heavy', 'Tools', 'Acme', 4999, 3),
+    (3, 'Bolt', None, 'Hardware', 'Acme', 15, 900),
+    (5, 'Crate', 'Wooden', None, 'Boxco', 1200, 0),
+]
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'catalog.bin')
+    write_snapshot(ROWS, path, generation=42)
+    snapshot = SnapshotReader(path).get()
+
+    assert (snapshot.generation, snapshot.count) == (42, 3)
+    assert snapshot.row(1) == {'product_id': 3, 'product_name': 'Bolt', 'category': 'Hardware', 'description': '',
+                               'company_name': 'Acme', 'display_price': 0.15, 'stock': 900}
+    assert list(snapshot.select('Tools')) == [0]
+
+
+def test_index_of(tmp_path):
+    path = str(tmp_path / 'catalog.bin')
+    write_snapshot(ROWS, path)
+    snapshot = SnapshotReader(path).get()
+    assert list(snapshot.index_of([5, 7, 4, 3, 99])) == [2, 0, -1, 1, -1]
+
+
+def test_stale_snapshot_is_not_served(tmp_path, monkeypatch):
+    path = str(tmp_path / 'catalog.bin')
+    write_snapshot(ROWS, path)
+    reader = SnapshotReader(path, check_interval=0, max_age=60)
+    assert reader.get() is not None
+
+    monkeypatch.setattr(time, 'time', lambda: os.path.getmtime(path) + 120)
+    assert reader.get() is None
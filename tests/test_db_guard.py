@@ -0,0 +1,109 @@
+# test_db_guard.py - Circuit breaker states and read timeouts
+
+import pytest
+from mysql.connector import errorcode
+from mysql.connector.errors import OperationalError, ProgrammingError
+
+from conftest import login
+from db_guard import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, DatabaseUnavailable, is_overload, read_timeout
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.stats()['trips'] == 1 and breaker.stats()['rejected'] == 1
+    assert 1 <= breaker.retry_after() <= 60
+
+
+def test_success_resets_the_count():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_half_open_trial_closes_or_reopens():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    breaker.record_failure()
+    assert breaker.state == OPEN and breaker.trips == 2
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.retry_after() == 0
+
+
+def test_is_overload():
+    assert is_overload(DatabaseUnavailable(msg='open'))
+    assert is_overload(OperationalError(errno=errorcode.CR_SERVER_LOST))
+    assert not is_overload(ProgrammingError(errno=errorcode.ER_PARSE_ERROR))
+
+
+def test_read_timeout():
+    assert read_timeout(2000, slack=2) == 4
+    assert read_timeout(2500, slack=2) == 5
+    # Unlimited budget and no request: the connector default applies
+    assert read_timeout(0) is None
+    assert read_timeout(None) is None
+
+
+
+# ======================= ROUTE BUDGETS =======================
+
+@pytest.fixture
+def guarded(monkeypatch, fake_conn):
+    # The real get_db_connection, with mysql.connector.connect answered by fake_conn
+    import app
+    connects = []
+
+    def connect(**options):
+        connects.append(options)
+        return fake_conn
+    monkeypatch.setattr(app.mysql.connector, 'connect', connect)
+    monkeypatch.setattr(app.invalidation_bus, 'start', lambda: None)
+    monkeypatch.setattr(app.invalidation_bus, 'poll', lambda force=False: 0)
+    monkeypatch.setitem(app.outbox_config, 'embedded_relay', False)
+    monkeypatch.setattr(app, 'db_breaker', CircuitBreaker())
+    app.reference_cache.clear()
+    fake_conn.on('SELECT manufacturer_id', [{'manufacturer_id': 7, 'id': 7}])
+    client = app.app.test_client()
+    login(client, 'manufacturer')
+    return client, connects, app
+
+
+def test_read_pages_get_a_server_limit_and_a_read_timeout(guarded, fake_conn):
+    client, connects, app = guarded
+    client.get('/manufacturer/inventory')
+    assert connects[0]['connection_timeout'] == read_timeout(app.db_guard_config['read_ms'],
+                                                            app.db_guard_config['read_timeout_slack'])
+    assert fake_conn.statements('max_execution_time')[0][1] == (app.db_guard_config['read_ms'],)
+
+
+def test_streamed_listings_run_without_a_budget(guarded, fake_conn):
+    client, connects, app = guarded
+    fake_conn.on('FROM allocation a', [{'allocation_id': 1}])
+    response = client.get('/manufacturer/allocations?format=ndjson')
+    assert response.status_code == 200
+    assert connects and all('connection_timeout' not in options for options in connects)
+    assert not fake_conn.statements('max_execution_time')
+
+
+def test_lost_connection_on_a_stream_does_not_trip_the_breaker(guarded, fake_conn):
+    client, connects, app = guarded
+
+    def lost(params):
+        raise OperationalError(msg='Lost connection to MySQL server during query', errno=errorcode.CR_SERVER_LOST)
+    fake_conn.on('FROM allocation a', lost)
+    response = client.get('/manufacturer/allocations?format=ndjson')
+    assert response.status_code == 503
+    assert app.db_breaker.stats()['consecutive_failures'] == 0
+
+    fake_conn.on('FROM inventory i', lost)
+    assert client.get('/manufacturer/inventory').status_code == 503
+    assert app.db_breaker.stats()['consecutive_failures'] == 1
@@ -0,0 +1,38 @@
+# test_http_cache.py - Browse page validators follow both the catalog scope and the snapshot
+
+import pytest
+
+from catalog_snapshot import SnapshotReader, write_snapshot
+from conftest import login
+
+ROWS = [(7, 'Anvil', 'Heavy', 'Tools', 'Acme', 4999, 3)]
+
+
+@pytest.fixture
+def browse(client, monkeypatch, tmp_path):
+    import app
+    path = str(tmp_path / 'catalog.bin')
+    monkeypatch.setattr(app, 'catalog_reader', SnapshotReader(path, check_interval=0))
+    monkeypatch.setattr(app.scope_versions, 'stamp', lambda scope: ('v5', 1700000000))
+    login(client, 'customer')
+
+    def get(generation=None, etag=None):
+        # A generation rebuilds the snapshot first
+        if generation is not None:
+            write_snapshot(ROWS, path, generation)
+        headers = {'If-None-Match': f'"{etag}"'} if etag else {}
+        return client.get('/customer/browse_products', headers=headers)
+    return get
+
+
+def test_unchanged_snapshot_revalidates(browse):
+    first = browse(1)
+    assert first.status_code == 200
+    assert browse(etag=first.get_etag()[0]).status_code == 304
+
+
+def test_rebuilt_snapshot_changes_the_etag(browse):
+    etag = browse(1).get_etag()[0]
+    response = browse(2, etag)
+    assert response.status_code == 200
+    assert response.get_etag()[0] != etag
@@ -0,0 +1,104 @@
+# test_inventory_adjustment.py - Bulk adjustment parsing, validation and chunked apply
+
+import io
+
+import mysql.connector
+from werkzeug.datastructures import FileStorage
+
+import inventory_adjustment
+
+
+def upload(text, filename='upload.csv'):
+    return FileStorage(stream=io.BytesIO(text.encode('utf-8')), filename=filename)
+
+
+# ======================= PARSING / VALIDATION =======================
+
+def test_adjustment_csv_ignores_fields_past_the_header():
+    lines = inventory_adjustment.parse_csv_lines(upload(
+        "product_id,quantity\n"
+        "7,10,oops\n"
+        "8,,\n"), default_mode='delta')
+    assert lines[0] == {'line': 2, 'product_id': '7', 'quantity': '10', 'reorder_level': None, 'mode': 'delta'}
+    assert lines[1]['quantity'] is None
+
+
+def test_adjustment_json_mode_from_wrapper():
+    lines = inventory_adjustment.parse_json_lines({'mode': 'delta', 'adjustments': [{'product_id': 1, 'quantity': -2}]})
+    assert lines[0]['mode'] == 'delta'
+
+
+def test_adjustment_validation():
+    lines = inventory_adjustment.parse_json_lines([
+        {'product_id': 1, 'quantity': 5},
+        {'product_id': 1, 'quantity': 6},
+        {'product_id': 2, 'quantity': -1},
+        {'product_id': 3, 'quantity': -1, 'mode': 'delta'},
+        {'product_id': 4},
+        {'product_id': 5, 'quantity': 1, 'mode': 'add'},
+    ])
+    inventory_adjustment.validate_lines(lines)
+    assert [line['status'] for line in lines] == ['valid', 'error', 'error', 'valid', 'error', 'error']
+    assert 'more than once' in lines[1]['message']
+
+
+# ======================= APPLY =======================
+
+def applied(fake_conn, rows):
+    # Staged rows read back after the update; none of them failed the checks
+    fake_conn.on('SELECT product_id, old_quantity, new_quantity FROM', rows)
+    fake_conn.on('WHERE old_quantity IS NULL OR new_quantity < 0', [])
+
+
+def adjustments(*rows):
+    lines = inventory_adjustment.parse_json_lines(list(rows))
+    inventory_adjustment.validate_lines(lines)
+    return lines
+
+
+def test_chunk_is_set_based_and_reports_old_and_new(fake_conn):
+    fake_conn.on('FOR UPDATE OF t', [(10, 0), (11, 0)])
+    applied(fake_conn, [(10, 40, 25), (11, 5, 0)])
+    lines = adjustments({'product_id': 10, 'quantity': 25}, {'product_id': 11, 'quantity': 0})
+    inventory_adjustment.apply_lines(fake_conn, 'manufacturer', 7, lines)
+
+    assert [(l['status'], l['old_quantity'], l['new_quantity']) for l in lines] == [
+        ('adjusted', 40, 25), ('adjusted', 5, 0)]
+    # One join-update, one ledger insert and one reorder_log insert for the chunk, trigger switched off
+    assert len(fake_conn.statements('UPDATE inventory t')) == 1
+    assert len(fake_conn.statements('INSERT INTO reorder_log')) == 1
+    flags = [sql for sql, _ in fake_conn.statements('@bulk_inventory_adjustment')]
+    assert flags == ['SET @bulk_inventory_adjustment = 1', 'SET @bulk_inventory_adjustment = NULL']
+    assert fake_conn.statements('DROP TEMPORARY TABLE')
+
+
+def test_unknown_and_negative_lines_are_dropped_from_the_stage(fake_conn):
+    fake_conn.on('WHERE old_quantity IS NULL OR new_quantity < 0', [(10, None, None), (11, 3, -2)])
+    lines = adjustments({'product_id': 10, 'quantity': 1, 'mode': 'delta'},
+                        {'product_id': 11, 'quantity': -5, 'mode': 'delta'})
+    inventory_adjustment.apply_lines(fake_conn, 'distributor', 3, lines)
+
+    assert lines[0]['message'] == 'Product is not in your inventory'
+    assert lines[1]['message'] == 'Only 3 units on hand; cannot remove 5'
+
+
+def test_failed_chunk_rolls_back_and_resets_the_session(fake_conn):
+    failures = iter([mysql.connector.errors.DatabaseError(msg='Deadlock found', errno=1213)])
+
+    def ledger(params):
+        error = next(failures, None)
+        if error:
+            raise error
+    fake_conn.on('INSERT INTO inventory_movement', ledger)
+    applied(fake_conn, [(11, 1, 2)])
+    lines = adjustments({'product_id': 10, 'quantity': 1}, {'product_id': 11, 'quantity': 2})
+    inventory_adjustment.apply_lines(fake_conn, 'distributor', 3, lines, chunk_size=1)
+
+    assert lines[0]['message'] == 'Chunk rolled back: Deadlock found'
+    assert lines[1]['status'] == 'adjusted'
+    log = [sql for sql, _ in fake_conn.log]
+    rollback = log.index('ROLLBACK')
+    # The flag and the staged rows of the failed chunk don't leak into the next one
+    assert log[rollback + 1:rollback + 3] == ['SET @bulk_inventory_adjustment = NULL',
+                                              'DELETE FROM inventory_adjustment_stage']
+    assert log.count('COMMIT') == 1
@@ -0,0 +1,79 @@
+# test_order_archive.py - Moving closed orders to the archive tables and all-time reads over both
+
+from datetime import datetime
+
+import pytest
+
+from conftest import login
+from order_archive import archive_batch, archive_orders, with_archive
+from reports import monthly_order_summary, sales_by_product
+
+CUTOFF = datetime(2026, 4, 1)
+COLUMNS = {table: f'{table}_columns' for table in ('customer_order', 'order_item', 'shipment', 'payment')}
+
+
+def moves(fake_conn):
+    return [sql.split(' (')[0].split(' WHERE')[0] for sql, _ in fake_conn.log
+            if sql.startswith(('INSERT', 'DELETE'))]
+
+
+def test_with_archive_repeats_the_select_per_table():
+    assert with_archive('SELECT order_id FROM customer_order{suffix}') == (
+        'SELECT order_id FROM customer_order\nUNION ALL\nSELECT order_id FROM customer_order_archive')
+
+
+def test_batch_copies_parents_first_and_deletes_children_first(fake_conn):
+    fake_conn.on('FOR UPDATE SKIP LOCKED', [(11,), (12,)])
+    assert archive_batch(fake_conn, COLUMNS, CUTOFF, 10, 2) == [11, 12]
+
+    assert moves(fake_conn) == [
+        'INSERT INTO customer_order_archive', 'INSERT INTO order_item_archive',
+        'INSERT INTO shipment_archive', 'INSERT INTO payment_archive',
+        'DELETE FROM order_item', 'DELETE FROM shipment', 'DELETE FROM payment', 'DELETE FROM customer_order']
+    assert all(params == (11, 12) for sql, params in fake_conn.statements('DELETE'))
+    assert fake_conn.statements('SKIP LOCKED')[0][1] == (10, CUTOFF, 2)
+    assert fake_conn.log[-1] == ('COMMIT', ())
+
+
+def test_failed_batch_moves_nothing(fake_conn):
+    fake_conn.on('FOR UPDATE SKIP LOCKED', [(11,)])
+
+    def fail(params):
+        raise RuntimeError('lock wait timeout')
+    fake_conn.on('DELETE FROM payment', fail)
+    with pytest.raises(RuntimeError):
+        archive_batch(fake_conn, COLUMNS, CUTOFF, 0, 500)
+    assert fake_conn.log[-1] == ('ROLLBACK', ())
+    assert not fake_conn.statements('COMMIT')
+
+
+def test_orders_are_archived_in_batches_until_none_are_left(fake_conn):
+    remaining = [[(1,), (2,)], [(3,)], []]
+    fake_conn.on('SELECT NOW() - INTERVAL %s MONTH', [(CUTOFF,)])
+    fake_conn.on('FROM information_schema.columns', [('order_id',), ('order_date',)])
+    fake_conn.on('FOR UPDATE SKIP LOCKED', lambda params: remaining.pop(0))
+    assert archive_orders(fake_conn, months=6, batch_size=2, pause=0) == 3
+
+    # Each batch resumes after the last archived id
+    assert [params[0] for _, params in fake_conn.statements('SKIP LOCKED')] == [0, 2, 3]
+    assert len(fake_conn.statements('COMMIT')) == 2
+
+
+@pytest.mark.parametrize('report', [monthly_order_summary, sales_by_product])
+def test_reports_read_archived_orders(fake_conn, report):
+    report(fake_conn, 'distributor', 3, {})
+    (sql, params), = fake_conn.statements('UNION ALL')
+    assert 'order_item_archive' in sql
+    assert params[-4:] == ('distributor', 3, 'distributor', 3)
+
+
+def test_customer_dashboard_counts_archived_orders(client, fake_conn):
+    login(client, 'customer')
+    fake_conn.on('SELECT customer_id, first_name', [{'customer_id': 4, 'first_name': 'Ada', 'last_name': 'L',
+                                                     'loyalty_points': 0}])
+    fake_conn.on('as total_spent', [{'total_orders': 2, 'total_spent': 30}])
+    assert client.get('/customer/dashboard').status_code == 200
+
+    (sql, params), = fake_conn.statements('as total_spent')
+    assert 'customer_order_archive' in sql
+    assert params == (4, 4)
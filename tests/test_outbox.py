@@ -0,0 +1,121 @@
+# test_outbox.py - Invalidations derived from outbox events and the relay's watermark and gaps
+
+import json
+import time
+from datetime import datetime
+
+import pytest
+
+from conftest import login
+from invalidation_bus import (DISTRIBUTOR_ORDERS_CHANGED, DISTRIBUTOR_STOCK_CHANGED, MANUFACTURER_ORDERS_CHANGED,
+                              ORDER_PLACED)
+from outbox import GAP_TIMEOUT, ORDER_CREATED, PAYMENT_RECEIVED, OutboxRelay, invalidations
+
+CREATED = datetime(2026, 3, 2, 9, 30)
+
+
+def event(event_id, event_type=ORDER_CREATED, entity_id=None, payload=None):
+    payload = payload or {'product_id': 5, 'seller_type': 'distributor', 'seller_id': 3, 'quantity': 1, 'amount': 10}
+    return (event_id, event_type, entity_id or event_id, json.dumps(payload), CREATED)
+
+
+def test_payment_invalidates_every_seller_of_the_order():
+    payment = (1, PAYMENT_RECEIVED, 40, {'amount': 25, 'sellers': [['manufacturer', 2], ['distributor', 3]]}, CREATED)
+    assert invalidations([payment]) == [(MANUFACTURER_ORDERS_CHANGED, 2), (DISTRIBUTOR_ORDERS_CHANGED, 3)]
+
+
+def test_payment_staged_without_sellers_invalidates_nothing():
+    assert invalidations([(1, PAYMENT_RECEIVED, 40, {'amount': 25}, CREATED)]) == []
+
+
+def test_invalidations_are_deduplicated_in_order():
+    events = [(event_id, ORDER_CREATED, event_id, json.loads(event(event_id)[3]), CREATED) for event_id in (1, 2)]
+    assert invalidations(events) == [(ORDER_PLACED, 5), (DISTRIBUTOR_STOCK_CHANGED, 3)]
+
+
+class Outbox:
+    # outbox_event rows and the relay's watermark row, behind fake_conn
+
+    def __init__(self, fake_conn, events, last_event_id=0, pending_gaps=None):
+        self.events = {row[0]: row for row in events}
+        self.row = (last_event_id, json.dumps(pending_gaps) if pending_gaps else None)
+        fake_conn.on('FROM outbox_consumer WHERE consumer = %s FOR UPDATE', lambda params: [self.row])
+        fake_conn.on('WHERE event_id > %s ORDER BY event_id', self.after)
+        fake_conn.on('WHERE event_id IN', lambda params: [self.events[i] for i in params if i in self.events])
+        fake_conn.on('INSERT INTO outbox_consumer', self.store)
+
+    def after(self, params):
+        watermark, limit = params
+        return [self.events[i] for i in sorted(self.events) if i > watermark][:limit]
+
+    def store(self, params):
+        _, last_event_id, pending_gaps = params
+        self.row = (last_event_id, pending_gaps)
+        return 1
+
+    @property
+    def gaps(self):
+        return [event_id for event_id, _ in json.loads(self.row[1])] if self.row[1] else []
+
+
+def test_relay_writes_invalidations_and_advances_the_watermark(fake_conn):
+    outbox = Outbox(fake_conn, [event(1), event(2)])
+    assert OutboxRelay(lambda: fake_conn).relay_batch(fake_conn) == 2
+
+    (_, params), = fake_conn.statements('INSERT INTO change_version_log')
+    assert params == ('order_placed', 5, 'distributor_stock_changed', 3)
+    assert outbox.row == (2, None)
+    assert fake_conn.log[-1] == ('COMMIT', ())
+
+
+def test_skipped_ids_are_kept_on_the_watermark_row(fake_conn):
+    outbox = Outbox(fake_conn, [event(1), event(3)])
+    OutboxRelay(lambda: fake_conn).relay_batch(fake_conn)
+    assert outbox.row[0] == 3
+    assert outbox.gaps == [2]
+
+    # Another worker's relay picks up the late event the first one saw missing
+    outbox.events[2] = event(2)
+    assert OutboxRelay(lambda: fake_conn).relay_batch(fake_conn) == 1
+    assert outbox.row == (3, None)
+
+
+def test_gaps_are_given_up_after_the_timeout(fake_conn):
+    outbox = Outbox(fake_conn, [event(1)], last_event_id=3,
+                    pending_gaps=[[2, time.time() - GAP_TIMEOUT - 1], [3, time.time()]])
+    OutboxRelay(lambda: fake_conn).relay_batch(fake_conn)
+    assert outbox.gaps == [3]
+
+
+def test_nothing_new_rolls_back(fake_conn):
+    outbox = Outbox(fake_conn, [event(1)], last_event_id=1)
+    assert OutboxRelay(lambda: fake_conn).relay_batch(fake_conn) == 0
+    assert not fake_conn.statements('INSERT')
+    assert fake_conn.log[-1] == ('ROLLBACK', ())
+    assert outbox.row == (1, None)
+
+
+def test_failed_batch_keeps_the_watermark(fake_conn):
+    outbox = Outbox(fake_conn, [event(1), event(3)])
+
+    def fail(params):
+        raise RuntimeError('rollup failed')
+    fake_conn.on('INSERT INTO seller_daily_sales', fail)
+    with pytest.raises(RuntimeError):
+        OutboxRelay(lambda: fake_conn).relay_batch(fake_conn)
+    assert fake_conn.log[-1] == ('ROLLBACK', ())
+    assert outbox.row == (0, None)
+
+
+def test_payment_stages_the_order_sellers(client, fake_conn):
+    login(client, 'customer')
+    fake_conn.on('SELECT customer_id FROM customer', [{'customer_id': 4}])
+    fake_conn.on('SELECT total_amount FROM customer_order', [{'total_amount': 25}])
+    fake_conn.on('SELECT DISTINCT seller_type, seller_id FROM order_item',
+                 [{'seller_type': 'manufacturer', 'seller_id': 2}, {'seller_type': 'distributor', 'seller_id': 3}])
+    response = client.post('/customer/process_payment/40', data={'payment_method': 'card'})
+    assert response.get_json()['success']
+
+    (_, (event_type, order_id, payload)), = fake_conn.statements('INSERT INTO outbox_event')
+    assert (event_type, order_id) == (PAYMENT_RECEIVED, 40)
+    assert json.loads(payload)['sellers'] == [['manufacturer', 2], ['distributor', 3]]
@@ -0,0 +1,42 @@
+# test_price_history.py - LTTB downsampling and the date range filter
+
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+
+from price_history import load_price_series, lttb, parse_date
+
+
+def test_short_series_are_kept_whole():
+    x = np.arange(10, dtype=float)
+    assert lttb(x, x, 10).tolist() == list(range(10))
+    assert lttb(x, x, 2).tolist() == list(range(10))
+
+
+def test_budget_endpoints_and_order():
+    x = np.arange(1000, dtype=float)
+    y = np.sin(x / 25)
+    kept = lttb(x, y, 50)
+    assert len(kept) == 50
+    assert kept[0] == 0 and kept[-1] == 999
+    assert np.all(np.diff(kept) > 0)
+
+
+def test_spikes_survive():
+    x = np.arange(500, dtype=float)
+    y = np.zeros(500)
+    y[123] = 100
+    y[377] = -100
+    kept = set(lttb(x, y, 20).tolist())
+    assert {123, 377} <= kept
+
+
+def test_range_includes_the_whole_end_date(fake_conn):
+    fake_conn.on('FROM price_change_history', [(1767225600, Decimal('10.00'), Decimal('11.00'))])
+    times, prices, initial = load_price_series(fake_conn.cursor(), 3, 9, parse_date('2026-01-01'),
+                                               parse_date('2026-01-31'))
+    sql, params = fake_conn.statements('FROM price_change_history')[0]
+    assert 'changed_at >= %s' in sql and 'changed_at < %s' in sql
+    assert params[2:] == (datetime(2026, 1, 1), datetime(2026, 2, 1))
+    assert initial == 10.0 and prices.tolist() == [11.0]
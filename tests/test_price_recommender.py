@@ -0,0 +1,59 @@
+# test_price_recommender.py - compute_recommendations on in-memory rows
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+
+from bulk_pricing import price_floor
+from price_recommender import MAX_STEP, compute_recommendations
+
+NOW = datetime(2026, 1, 15, 12, 0)
+
+
+def inventory_row(dist_inventory_id, quantity, cost_price, unit_price, reorder_level=10):
+    # dist_inventory_id, product_id, price_version, quantity, reorder_level, cost_price, unit_price, name
+    return (dist_inventory_id, dist_inventory_id + 100, 1, quantity, reorder_level,
+            Decimal(cost_price), Decimal(unit_price), f'Product {dist_inventory_id}')
+
+
+def test_no_inventory():
+    assert compute_recommendations([], [], np.zeros(0), now=NOW) == []
+
+
+def test_slow_movers_drop_by_at_most_one_step():
+    rows = [inventory_row(1, 500, '10.00', '20.00')]
+    rec, = compute_recommendations(rows, [], np.zeros(1), now=NOW)
+    assert rec['reason'] == 'No recent sales'
+    assert rec['suggested_price'] == Decimal('20.00') * (1 - Decimal(str(MAX_STEP)))
+    assert rec['cover_days'] is None
+
+
+def test_fast_sellers_rise():
+    rows = [inventory_row(1, 20, '10.00', '20.00')]
+    # 300 units in 30 days leaves 2 days of cover
+    rec, = compute_recommendations(rows, [], np.array([300.0]), now=NOW)
+    assert rec['reason'] == 'Selling fast'
+    assert rec['suggested_price'] == Decimal('22.00')
+
+
+def test_recent_change_damps_the_step():
+    # 60 days of cover against a 30 day target: -8%, halved inside the cooldown
+    rows = [inventory_row(1, 60, '10.00', '20.00')]
+    sold = np.array([30.0])
+    assert compute_recommendations(rows, [], sold, now=NOW)[0]['suggested_price'] == Decimal('18.40')
+    rec, = compute_recommendations(rows, [(1, NOW - timedelta(days=2))], sold, now=NOW)
+    assert rec['days_since_change'] == 2
+    assert rec['suggested_price'] == Decimal('19.20')
+
+
+def test_never_cut_at_or_under_reorder_level():
+    rows = [inventory_row(1, 5, '10.00', '20.00', reorder_level=10)]
+    assert compute_recommendations(rows, [], np.zeros(1), now=NOW) == []
+
+
+def test_floor_matches_decimal_rounding():
+    # float(33.05) * 1.1 rounds to 36.35, a paisa under the 36.36 the apply step enforces
+    rows = [inventory_row(1, 500, '33.05', '37.00')]
+    rec, = compute_recommendations(rows, [], np.zeros(1), now=NOW)
+    assert rec['suggested_price'] == price_floor(Decimal('33.05')) == Decimal('36.36')
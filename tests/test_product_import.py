@@ -0,0 +1,106 @@
+# test_product_import.py - Catalog import parsing, validation and checkpointed chunks
+
+import io
+from decimal import Decimal
+
+import mysql.connector
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import product_import
+
+
+def upload(text, filename='upload.csv'):
+    return FileStorage(stream=io.BytesIO(text.encode('utf-8')), filename=filename)
+
+
+# ======================= PARSING / VALIDATION =======================
+
+def test_import_csv_rows_ignore_fields_past_the_header():
+    rows = list(product_import.iter_csv_rows(upload(
+        "product_name,unit_price,initial_quantity\n"
+        "Shoe,10.00,100,surplus\n")))
+    assert rows == [(2, {'product_name': 'Shoe', 'unit_price': '10.00', 'initial_quantity': '100'})]
+
+
+def test_import_jsonl_rows_flag_bad_lines():
+    rows = list(product_import.iter_jsonl_rows(upload('{"product_name": "Shoe"}\n\n[1, 2]\nnot json\n',
+                                                      filename='upload.jsonl')))
+    assert [line for line, _ in rows] == [1, 3, 4]
+    assert rows[1][1] == rows[2][1] == {'_error': 'Line is not a JSON object'}
+
+
+def test_import_validate_row_generates_deterministic_sku():
+    row = {'product_name': 'Shoe', 'unit_price': '19.999', 'initial_quantity': '100', 'category': 'foot-wear'}
+    product = product_import.validate_row(row, 3, 12, 7)
+    assert product['sku'] == 'FOO-3-12-7'
+    assert product['unit_price'] == Decimal('20.00')
+    assert product['reorder_level'] == product_import.DEFAULT_REORDER_LEVEL
+
+
+@pytest.mark.parametrize('sku, valid', [
+    ('A' * 50, True),
+    ('A' * 51, False),
+    ('ab.c_d-1', True),
+    ('-leading', False),
+    ('has space', False),
+])
+def test_import_sku_rules(sku, valid):
+    row = {'product_name': 'Shoe', 'unit_price': '10', 'initial_quantity': '100', 'sku': sku}
+    if valid:
+        assert product_import.validate_row(row, 1, 1, 2)['sku'] == sku
+    else:
+        with pytest.raises(ValueError):
+            product_import.validate_row(row, 1, 1, 2)
+
+
+@pytest.mark.parametrize('row', [
+    {'product_name': 'Shoe', 'unit_price': '0', 'initial_quantity': '100'},
+    {'product_name': 'Shoe', 'unit_price': 'ten', 'initial_quantity': '100'},
+    {'product_name': 'Shoe', 'unit_price': '10', 'initial_quantity': '99'},
+    {'product_name': '', 'unit_price': '10', 'initial_quantity': '100'},
+    {'_error': 'Line is not a JSON object'},
+])
+def test_import_rejects_invalid_rows(row):
+    with pytest.raises(ValueError):
+        product_import.validate_row(row, 1, 1, 2)
+
+
+# ======================= CHUNKS AND RESUME =======================
+
+def rows(count):
+    return [(line, {'product_name': f'Item {line}', 'unit_price': '10', 'initial_quantity': '100'})
+            for line in range(2, count + 2)]
+
+
+def test_failed_chunk_keeps_the_previous_checkpoint(fake_conn):
+    inserts = iter([None, mysql.connector.errors.DatabaseError(msg='Lock wait timeout exceeded', errno=1205)])
+
+    def insert_products(params):
+        error = next(inserts)
+        if error:
+            raise error
+    fake_conn.on('INSERT INTO product (', insert_products)
+
+    report = product_import.run_import(fake_conn, 3, rows(4), filename='catalog.csv', chunk_size=2)
+
+    assert report['status'] == 'failed' and 'Lock wait timeout' in report['error']
+    # First chunk (lines 2-3) committed with its checkpoint; the second rolled back
+    checkpoints = [params for _, params in fake_conn.statements('SET last_line')]
+    assert checkpoints == [(3, 2, 0, report['import_id'])]
+    outcomes = [sql for sql, _ in fake_conn.log if sql in ('COMMIT', 'ROLLBACK')]
+    assert outcomes == ['COMMIT', 'ROLLBACK']
+    assert fake_conn.statements("SET status = %s")[-1][1][0] == 'failed'
+
+
+def test_resume_skips_lines_up_to_the_checkpoint(fake_conn):
+    fake_conn.on('SELECT import_id, last_line', [{'import_id': 5, 'last_line': 3, 'inserted': 2,
+                                                  'failed': 0, 'status': 'failed'}])
+    report = product_import.run_import(fake_conn, 3, rows(4), import_id=5, chunk_size=2)
+
+    assert report['status'] == 'completed'
+    assert report['summary']['skipped'] == 2
+    # Generated SKUs depend on the line, so a resumed import produces the same ones
+    (_, params), = fake_conn.statements('INSERT INTO product (')
+    # Nine columns per row; sku is the second
+    assert (params[1], params[10]) == ('GEN-3-5-4', 'GEN-3-5-5')
@@ -0,0 +1,156 @@
+# test_stock_shards.py - Slot splitting, claims, rebalancing and allocations against sharded stock
+
+import pytest
+
+from conftest import login
+from stock_shards import _split, take_stock
+
+
+@pytest.mark.parametrize('total, slots, expected', [
+    (10, 4, [3, 3, 2, 2]),
+    (8, 8, [1] * 8),
+    (3, 5, [1, 1, 1, 0, 0]),
+    (0, 3, [0, 0, 0]),
+    (-7, 3, [-7, 0, 0]),
+])
+def test_split(total, slots, expected):
+    assert _split(total, slots) == expected
+    assert sum(_split(total, slots)) == total
+
+
+class ShardedStock:
+    # stock_shard rows of one product plus its (possibly stale) parent mirror, behind fake_conn
+
+    def __init__(self, fake_conn, slots, mirror):
+        self.slots = dict(enumerate(slots))
+        self.mirror = mirror
+        fake_conn.on('UPDATE stock_shard SET quantity = quantity - %s', self.claim)
+        fake_conn.on('UPDATE stock_shard SET quantity = %s', self.write)
+        fake_conn.on('SELECT slot, quantity FROM stock_shard', lambda params: sorted(self.slots.items()))
+        fake_conn.on('SELECT product_id, slot, quantity FROM stock_shard',
+                     lambda params: [(params[2], slot, quantity) for slot, quantity in sorted(self.slots.items())])
+        fake_conn.on('SELECT stock_slots FROM', [(len(slots),)])
+        # Parent decrements only apply to unsharded rows
+        fake_conn.on('AND stock_slots = 0 AND quantity_available >= %s', 0)
+
+    @property
+    def total(self):
+        return sum(self.slots.values())
+
+    def claim(self, params):
+        quantity, slot = params[0], params[4]
+        if self.slots[slot] < quantity:
+            return 0
+        self.slots[slot] -= quantity
+        return 1
+
+    def write(self, params):
+        self.slots[params[4]] = params[0]
+        return 1
+
+
+def test_claim_from_a_slot_that_covers_it(fake_conn):
+    stock = ShardedStock(fake_conn, [5, 5, 5, 5], mirror=20)
+    assert take_stock(fake_conn, 'distributor', 3, 17, 4, slots=4)
+    assert stock.total == 16
+    assert not fake_conn.statements('FOR UPDATE')
+
+
+def test_rebalance_when_no_single_slot_covers_it(fake_conn):
+    stock = ShardedStock(fake_conn, [2, 2, 2, 2], mirror=8)
+    assert take_stock(fake_conn, 'distributor', 3, 17, 5, slots=4)
+    assert sorted(stock.slots.values(), reverse=True) == [1, 1, 1, 0]
+
+
+def test_short_stock_is_refused_and_left_alone(fake_conn):
+    stock = ShardedStock(fake_conn, [2, 2, 2, 2], mirror=100)
+    assert not take_stock(fake_conn, 'distributor', 3, 17, 9, slots=4)
+    assert stock.slots == {0: 2, 1: 2, 2: 2, 3: 2}
+
+
+def test_sharded_after_the_caller_read_the_row(fake_conn):
+    stock = ShardedStock(fake_conn, [3, 3], mirror=6)
+    assert take_stock(fake_conn, 'manufacturer', 7, 10, 2, slots=0)
+    assert stock.total == 4
+
+
+# ======================= ALLOCATIONS =======================
+
+def allocation_db(fake_conn, stock):
+    fake_conn.on('SELECT manufacturer_id FROM manufacturer', [{'manufacturer_id': 7}])
+    # Stock checks go through live_quantity_sql; a read of the bare column would get the mirror
+    fake_conn.on('FROM inventory i JOIN product p',
+                 lambda params: [{'quantity_available': stock.mirror, 'stock_slots': 4,
+                                  'manufacturing_cost': 5, 'unit_price': 8}])
+    fake_conn.on('IF(i.stock_slots > 0',
+                 lambda params: [{'quantity_available': stock.total, 'stock_slots': 4,
+                                  'manufacturing_cost': 5, 'unit_price': 8}])
+
+
+def test_allocate_against_a_stale_mirror_is_refused(client, fake_conn):
+    stock = ShardedStock(fake_conn, [2, 1, 1, 1], mirror=100)
+    allocation_db(fake_conn, stock)
+    login(client, 'manufacturer')
+
+    response = client.post('/manufacturer/allocate', data={'distributor_id': 3, 'product_id': 10, 'quantity': 30})
+
+    assert b'Only 5 units available' in response.data
+    assert not fake_conn.statements('INSERT INTO allocation')
+    assert stock.total == 5
+
+
+def test_allocate_takes_units_from_the_slots(client, fake_conn):
+    stock = ShardedStock(fake_conn, [2, 1, 1, 1], mirror=100)
+    allocation_db(fake_conn, stock)
+    login(client, 'manufacturer')
+
+    response = client.post('/manufacturer/allocate', data={'distributor_id': 3, 'product_id': 10, 'quantity': 4})
+
+    assert b'Successfully allocated 4 units' in response.data
+    assert stock.total == 1
+    # The parent mirror is never decremented (its trigger would move NEW - OLD into slot 0 again)
+    assert not fake_conn.statements('SET quantity_available = quantity_available - %s WHERE product_id')
+    assert fake_conn.log[-1][0] != 'ROLLBACK'
+
+
+# ======================= ABSOLUTE COUNTS =======================
+
+def test_manual_count_of_a_sharded_row_rewrites_the_slots(client, fake_conn):
+    stock = ShardedStock(fake_conn, [2, 1, 1, 1], mirror=100)
+    fake_conn.on('SELECT manufacturer_id AS id', [{'id': 7, 'company_name': 'Acme'}])
+    fake_conn.on('SELECT product_id, quantity_available, stock_slots FROM inventory',
+                 [{'product_id': 10, 'quantity_available': 100, 'stock_slots': 4}])
+    fake_conn.on('UPDATE inventory', 1)
+    fake_conn.on('SELECT i.inventory_id', [{'inventory_id': 1, 'quantity_available': 12,
+                                            'reorder_level': 50, 'row_version': 4}])
+    login(client, 'manufacturer')
+
+    response = client.post('/manufacturer/inventory/1', data={'quantity_available': 12, 'reorder_level': 50,
+                                                              'row_version': 3})
+
+    assert response.get_json()['success']
+    assert stock.total == 12 and sorted(stock.slots.values()) == [3, 3, 3, 3]
+    # The parent keeps its mirror; only reorder_level (and the version) change
+    (sql, params), = fake_conn.statements('UPDATE inventory')
+    assert 'IF(stock_slots > 0, quantity_available, %s)' in sql
+    # Ledger delta from the slot total, not from the stale mirror
+    assert fake_conn.statements('INSERT INTO inventory_movement')[0][1][4] == 7
+
+
+def test_bulk_set_of_a_sharded_row_rewrites_the_slots(fake_conn):
+    from inventory_adjustment import run_bulk_adjustment
+
+    stock = ShardedStock(fake_conn, [2, 1, 1, 1], mirror=100)
+    fake_conn.on('FOR UPDATE OF t', [(10, 4)])
+    fake_conn.on('SELECT product_id, new_quantity FROM', [(10, 20)])
+    fake_conn.on('SELECT product_id, old_quantity, new_quantity FROM', [(10, 5, 20)])
+    fake_conn.on('WHERE old_quantity IS NULL OR new_quantity < 0', [])
+
+    report = run_bulk_adjustment(fake_conn, 'manufacturer', 7, [
+        {'line': 2, 'product_id': 10, 'quantity': 20, 'reorder_level': None, 'mode': 'set'}])
+
+    assert report['results'][0]['status'] == 'adjusted'
+    assert stock.total == 20
+    # Old quantity comes from the slot total; the parent update leaves a sharded row's mirror alone
+    assert 'stock_shard' in fake_conn.statements('SET s.old_quantity')[0][0]
+    assert fake_conn.statements('SET t.quantity_available = IF(t.stock_slots > 0, t.quantity_available')
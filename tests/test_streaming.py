@@ -0,0 +1,44 @@
+# test_streaming.py - RowStream batching and giving its connection back on every path
+
+from conftest import FakeConnection
+from streaming import RowStream, ndjson_response
+
+SQL = 'SELECT allocation_id FROM allocation'
+
+
+def stream(rows, batch_size=2):
+    conn = FakeConnection().on(SQL, [{'allocation_id': i} for i in rows])
+    return conn, RowStream(lambda: conn, SQL, batch_size=batch_size)
+
+
+def closes(conn):
+    return [sql for sql, _ in conn.log if sql in ('CLOSE', 'SHUTDOWN')]
+
+
+def test_iterates_every_batch_and_closes():
+    conn, rows = stream(range(5))
+    assert [row['allocation_id'] for row in rows] == [0, 1, 2, 3, 4]
+    assert closes(conn) == ['CLOSE']
+
+
+def test_empty_result_closes_on_the_truth_test():
+    conn, rows = stream([])
+    assert not rows
+    assert closes(conn) == ['CLOSE']
+
+
+def test_truth_test_on_rows_keeps_the_stream_open():
+    conn, rows = stream(range(3))
+    assert rows
+    assert closes(conn) == []
+    assert len(list(rows)) == 3
+
+
+def test_unread_response_closes_the_stream():
+    import app
+    conn, rows = stream(range(5))
+    with app.app.test_request_context('/'):
+        response = ndjson_response(rows)
+    response.close()
+    # Rows were left unread, so the connection is dropped rather than drained
+    assert closes(conn) == ['SHUTDOWN']